@@ -1,37 +1,210 @@
-from flask import Flask, render_template, request, jsonify, send_from_directory
+from flask import Flask, render_template, request, jsonify, send_file, Response, g
+from werkzeug.exceptions import HTTPException
+import werkzeug.utils
 import yt_dlp
+from yt_dlp.downloader.common import FileDownloader
+from yt_dlp.postprocessor import PostProcessor
+from yt_dlp.networking.exceptions import HTTPError
+from yt_dlp.utils import PagedList, format_bytes, parse_bytes, prepend_extension
 import os
 import json
 import re
 from datetime import datetime
 import threading
+import queue
+import sqlite3
+import time
+import collections
+import itertools
+import uuid
+import urllib.parse
+import mimetypes
 import subprocess
 import requests
 from packaging import version
 import logging
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 import traceback
+import fcntl
+import glob
+import signal
+import multiprocessing
+import contextlib
+import cProfile
+import pstats
+import io
+import shutil
+import atexit
+import zlib
+import concurrent.futures
 
 app = Flask(__name__)
+# For the time from startup to the first downloaded byte
+APP_STARTED = time.monotonic()
 
 # Configure logging
 LOG_DIR = '/app/logs'
 os.makedirs(LOG_DIR, exist_ok=True)
+# Every job also logs to JOB_LOG_DIR/<download_id>.log, up to JOB_LOG_MAX_BYTES
+JOB_LOG_DIR = os.path.join(LOG_DIR, 'jobs')
+os.makedirs(JOB_LOG_DIR, exist_ok=True)
+JOB_LOG_MAX_BYTES = 2 * 1024 * 1024
+# Lines kept in memory per job, for this many recent jobs
+JOB_LOG_LINES = 500
+JOB_LOG_BUFFERS = 64
+# How much of yt-dlp's output a job logs, unless its request sets logLevel
+JOB_LOG_LEVELS = ('error', 'warning', 'info', 'debug')
+JOB_LOG_LEVEL = os.environ.get('JOB_LOG_LEVEL', 'info').lower()
+# INFO/DEBUG bytes per second (per process) that go to the shared log and the
+# console; warnings and errors always do. Job logs are not limited. 0 = no limit
+LOG_BUDGET = parse_bytes(os.environ.get('LOG_BUDGET') or '32K') or 0
+# Log records of a job start with its download id
+JOB_LOG_RECORD = re.compile(r'\[((?:batch_)?\d{8}_\d{6}_\d{6}(?:_\d{5})?)\] ')
 
-# Set up logging configuration
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        RotatingFileHandler(
-            os.path.join(LOG_DIR, 'ytdlp-web.log'),
-            maxBytes=10485760,  # 10MB
-            backupCount=5
-        ),
-        logging.StreamHandler()  # Also log to console
-    ]
-)
+
+class SharedRotatingFileHandler(RotatingFileHandler):
+    """RotatingFileHandler that several worker processes can write to.
+
+    If another process already rotated the log, reopen the new file instead
+    of rotating it a second time.
+    """
+
+    def shouldRollover(self, record):
+        if self.stream is not None:
+            try:
+                rotated = os.stat(self.baseFilename).st_ino != os.fstat(self.stream.fileno()).st_ino
+            except OSError:
+                rotated = True
+            if rotated:
+                self.stream.close()
+                self.stream = self._open()
+        return super().shouldRollover(record)
+
+
+class LogBudget(logging.Filter):
+    """Token bucket over the volume of INFO and DEBUG records.
+
+    Allows LOG_BUDGET bytes per second with bursts of ten seconds' worth.
+    Records over the budget are dropped, and a warning says how many once
+    records fit again. Shared by several handlers, which all get the same
+    decision for a record.
+    """
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+        self.capacity = self.tokens = rate * 10
+        self.updated = time.monotonic()
+        self.dropped = 0
+
+    def filter(self, record):
+        allowed = getattr(record, 'within_budget', None)
+        if allowed is None:
+            allowed = record.within_budget = self.allow(record)
+        return allowed
+
+    def allow(self, record):
+        if not self.rate or record.levelno >= logging.WARNING:
+            return True
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        size = len(record.getMessage()) + 60
+        if self.tokens < size:
+            self.dropped += 1
+            return False
+        self.tokens -= size
+        if self.dropped:
+            # Goes through the queue like any other record
+            logging.getLogger(__name__).warning(
+                f"Log budget of {format_bytes(self.rate)}/s exceeded: dropped {self.dropped} INFO/DEBUG records")
+            self.dropped = 0
+        return True
+
+
+def job_log_path(download_id):
+    return os.path.join(JOB_LOG_DIR, f'{os.path.basename(download_id)}.log')
+
+
+class JobLogHandler(logging.Handler):
+    """Copy the records of each job to its own log.
+
+    Recent jobs keep their last JOB_LOG_LINES lines in memory; every job
+    also gets a file in JOB_LOG_DIR, cut off at JOB_LOG_MAX_BYTES.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.buffers = collections.OrderedDict()
+        self.sizes = {}
+
+    def emit(self, record):
+        try:
+            match = JOB_LOG_RECORD.match(record.getMessage())
+            if not match:
+                return
+            download_id = match.group(1)
+            line = self.format(record) + '\n'
+            buffer = self.buffers.pop(download_id, None) or collections.deque(maxlen=JOB_LOG_LINES)
+            buffer.append(line)
+            self.buffers[download_id] = buffer
+            while len(self.buffers) > JOB_LOG_BUFFERS:
+                self.sizes.pop(self.buffers.popitem(last=False)[0], None)
+
+            path = job_log_path(download_id)
+            size = self.sizes.get(download_id)
+            if size is None:
+                size = os.path.getsize(path) if os.path.exists(path) else 0
+            if size < JOB_LOG_MAX_BYTES:
+                if size + len(line) > JOB_LOG_MAX_BYTES:
+                    line = f'[{download_id}] Log cut off at {format_bytes(JOB_LOG_MAX_BYTES)}\n'
+                    size = JOB_LOG_MAX_BYTES
+                # Appending whole lines keeps the writes of job processes apart
+                with open(path, 'a', encoding='utf-8') as f:
+                    f.write(line)
+                size += len(line)
+            self.sizes[download_id] = size
+        except Exception:
+            self.handleError(record)
+
+    def recent(self, download_id):
+        """The lines in memory for a job, or None"""
+        with self.lock:
+            buffer = self.buffers.get(download_id)
+            return list(buffer) if buffer is not None else None
+
+
+# Set up logging configuration. Threads only put records on a queue; one
+# listener thread formats and writes them, so logging never waits for disk.
+log_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+log_budget = LogBudget(LOG_BUDGET)
+shared_log_handlers = [
+    SharedRotatingFileHandler(
+        os.path.join(LOG_DIR, 'ytdlp-web.log'),
+        maxBytes=10485760,  # 10MB
+        backupCount=5
+    ),
+    logging.StreamHandler()  # Also log to console
+]
+for handler in shared_log_handlers:
+    handler.setFormatter(log_formatter)
+    # DEBUG records only go to the per-job logs
+    handler.setLevel(logging.INFO)
+    handler.addFilter(log_budget)
+job_log_handler = JobLogHandler()
+job_log_handler.setFormatter(log_formatter)
+log_queue = queue.SimpleQueue()
+log_listener = QueueListener(log_queue, *shared_log_handlers, job_log_handler, respect_handler_level=True)
+log_listener.start()
+# Write out what is still queued when the process exits
+atexit.register(log_listener.stop)
+queue_handler = QueueHandler(log_queue)
+# Only merges the message (and traceback); the listener's handlers add the rest
+queue_handler.setFormatter(logging.Formatter('%(message)s'))
+logging.basicConfig(level=logging.INFO, handlers=[queue_handler])
 logger = logging.getLogger(__name__)
+# Job DEBUG records (logLevel=debug) reach the queue; the shared handlers drop them
+logger.setLevel(logging.DEBUG)
 logger.info("yt-dlp web app starting up")
 
 # Configuration
@@ -42,50 +215,1706 @@ BASE_DIR = os.environ.get('BASE_DIR', '/media')
 DEFAULT_DOWNLOAD_DIR = '/downloads'
 os.makedirs(DEFAULT_DOWNLOAD_DIR, exist_ok=True)
 
-# Store download progress
+# Maximum number of downloads running at the same time, shared by all clients
+MAX_CONCURRENT_DOWNLOADS = max(1, int(os.environ.get('MAX_CONCURRENT_DOWNLOADS', 3)))
+
+# ffmpeg postprocessing (conversions, audio extraction, embedding) runs in its
+# own pool after the download, so it neither holds a download slot nor
+# oversubscribes the CPU. Postprocessors with these `when` values are deferred.
+POSTPROCESS_WORKERS = max(1, int(os.environ.get('POSTPROCESS_WORKERS', os.cpu_count() or 1)))
+POSTPROCESS_STAGE_WHEN = ('post_process', 'after_move')
+
+# 'thread' runs yt-dlp in the download worker threads. 'process' runs each job
+# in its own process: no GIL contention with the web server, and cancelling
+# kills the job (including ffmpeg) immediately.
+EXECUTION_MODE = os.environ.get('EXECUTION_MODE', 'thread').lower()
+# Spawned, not forked: forking a process that runs threads is not safe
+job_process_context = multiprocessing.get_context('spawn')
+
+# Persistent state (job history, queue) lives here so it survives restarts
+DATA_DIR = os.environ.get('DATA_DIR', '/app/data')
+os.makedirs(DATA_DIR, exist_ok=True)
+JOB_DB_PATH = os.path.join(DATA_DIR, 'jobs.db')
+
+# Finished jobs are kept this many days, and at most this many are kept
+JOB_RETENTION_DAYS = float(os.environ.get('JOB_RETENTION_DAYS', 7))
+JOB_RETENTION_COUNT = int(os.environ.get('JOB_RETENTION_COUNT', 5000))
+
+# Let a front proxy send the file bytes: '' (serve from Python), 'X-Sendfile'
+# (Apache, lighttpd) or 'X-Accel-Redirect' (nginx, internal location below)
+SENDFILE_HEADER = os.environ.get('SENDFILE_HEADER', '').lower()
+ACCEL_REDIRECT_PREFIX = os.environ.get('ACCEL_REDIRECT_PREFIX', '/internal-files').rstrip('/')
+
+ACTIVE_STATES = ('queued', 'starting', 'downloading', 'processing')
+FINISHED_STATES = ('completed', 'error', 'cancelled')
+
+
+class SQLiteStore:
+    """Base for stores kept in the job database, with one connection per thread"""
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        with self.connection() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            self.create_schema(conn)
+
+    def create_schema(self, conn):
+        pass
+
+    def connection(self):
+        """Return this thread's connection, opening it on first use"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+        return conn
+
+
+class JobStore(SQLiteStore):
+    """SQLite-backed store for download jobs.
+
+    Only the indexed fields get their own columns; the status dict served by
+    /status is stored as JSON next to the yt-dlp options needed to (re)run it.
+    """
+
+    def create_schema(self, conn):
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                directory TEXT,
+                priority INTEGER NOT NULL DEFAULT 0,
+                created REAL NOT NULL,
+                updated REAL NOT NULL,
+                url TEXT,
+                options TEXT,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, priority);
+            CREATE INDEX IF NOT EXISTS idx_jobs_directory ON jobs (directory, status);
+            CREATE INDEX IF NOT EXISTS idx_jobs_updated ON jobs (updated);
+            CREATE TABLE IF NOT EXISTS batches (
+                id TEXT PRIMARY KEY,
+                created REAL NOT NULL,
+                total INTEGER NOT NULL,
+                directory TEXT,
+                options TEXT
+            );
+        ''')
+        columns = [row['name'] for row in conn.execute('PRAGMA table_info(jobs)')]
+        if 'batch_id' not in columns:
+            conn.execute('ALTER TABLE jobs ADD COLUMN batch_id TEXT')
+        if 'cancel_requested' not in columns:
+            conn.execute('ALTER TABLE jobs ADD COLUMN cancel_requested INTEGER NOT NULL DEFAULT 0')
+        # Site of the job (see site_host(); NULL without one, e.g. ytsearch:) and the
+        # earliest time it may run again
+        if 'host' not in columns:
+            conn.execute('ALTER TABLE jobs ADD COLUMN host TEXT')
+        if 'not_before' not in columns:
+            conn.execute('ALTER TABLE jobs ADD COLUMN not_before REAL')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_batch ON jobs (batch_id, status)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_host ON jobs (host, status)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_cancel ON jobs (cancel_requested) WHERE cancel_requested = 1')
+
+    def create(self, download_id, job, options, priority=0):
+        now = time.time()
+        with self.connection() as conn:
+            conn.execute(
+                'INSERT INTO jobs (id, status, directory, priority, created, updated, url, options, data, host) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (download_id, job['status'], job.get('directory'), priority, now, now,
+                 job.get('url'), json.dumps(options), json.dumps(job, default=str), site_host(job.get('url')) or None)
+            )
+
+    def create_batch(self, batch_id, jobs, options, directory, priority=0, job_options=None):
+        """Insert all jobs of a batch in one transaction, sharing one options blob.
+
+        job_options maps the ids of jobs that need options of their own to them.
+        """
+        job_options = job_options or {}
+        now = time.time()
+        with self.connection() as conn:
+            conn.execute(
+                'INSERT INTO batches (id, created, total, directory, options) VALUES (?, ?, ?, ?, ?)',
+                (batch_id, now, len(jobs), directory, json.dumps(options))
+            )
+            conn.executemany(
+                'INSERT INTO jobs (id, status, directory, priority, created, updated, url, options, data, batch_id, host) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                [(download_id, job['status'], directory, priority, now, now, job.get('url'),
+                  json.dumps(job_options[download_id]) if download_id in job_options else None,
+                  json.dumps(job, default=str), batch_id, site_host(job.get('url')) or None) for download_id, job in jobs]
+            )
+
+    def batch_summary(self, batch_id):
+        row = self.connection().execute(
+            'SELECT created, total, directory FROM batches WHERE id = ?', (batch_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        counts = self.connection().execute(
+            'SELECT status, COUNT(*) AS n FROM jobs WHERE batch_id = ? GROUP BY status', (batch_id,)
+        ).fetchall()
+        return {
+            'created': datetime.fromtimestamp(row['created']).isoformat(),
+            'total': row['total'],
+            'directory': row['directory'],
+            'counts': {count['status']: count['n'] for count in counts}
+        }
+
+    def save(self, download_id, job):
+        with self.connection() as conn:
+            conn.execute(
+                'UPDATE jobs SET status = ?, data = ?, updated = ? WHERE id = ?',
+                (job['status'], json.dumps(job, default=str), time.time(), download_id)
+            )
+
+    def save_many(self, jobs):
+        """Persist several jobs in one transaction (used for progress updates)"""
+        now = time.time()
+        with self.connection() as conn:
+            conn.executemany(
+                'UPDATE jobs SET status = ?, data = ?, updated = ? WHERE id = ?',
+                [(job['status'], json.dumps(job, default=str), now, download_id)
+                 for download_id, job in jobs]
+            )
+
+    def claim_next(self):
+        """Atomically take the next queued job, or return None.
+
+        Jobs run by priority, then in the order they were queued. Jobs are
+        skipped while deferred (not_before), while their site is backing
+        off, and while DOMAIN_CONCURRENCY jobs of their site are running.
+        """
+        now = time.time()
+        with self.connection() as conn:
+            row = conn.execute(
+                "UPDATE jobs SET status = 'starting', updated = ?, not_before = NULL WHERE id = ("
+                "SELECT id FROM jobs AS queued WHERE status = 'queued' "
+                "AND (not_before IS NULL OR not_before <= ?) "
+                "AND (host IS NULL OR host NOT IN (SELECT host FROM domain_governor WHERE blocked_until > ?)) "
+                "AND (host IS NULL OR ? = 0 OR (SELECT COUNT(*) FROM jobs AS running WHERE running.host = queued.host "
+                "AND running.status IN ('starting', 'downloading')) < ?) "
+                "ORDER BY priority DESC, rowid LIMIT 1"
+                ") AND status = 'queued' RETURNING id",
+                (now, now, now, DOMAIN_CONCURRENCY, DOMAIN_CONCURRENCY)
+            ).fetchone()
+        return row['id'] if row else None
+
+    def defer(self, download_id, not_before):
+        """Keep a job from being claimed again before `not_before`"""
+        with self.connection() as conn:
+            conn.execute('UPDATE jobs SET not_before = ? WHERE id = ?', (not_before, download_id))
+
+    def request_cancel(self, download_id):
+        """Flag a job for cancellation; the process running it picks this up.
+
+        A job that is still queued is cancelled on the spot instead, in the
+        same transaction, so claim_next() can't take it and no process is left
+        to clear the flag. Returns True if the job was still queued.
+        """
+        with self.connection() as conn:
+            row = conn.execute(
+                "UPDATE jobs SET status = 'cancelled', cancel_requested = 0 "
+                "WHERE id = ? AND status = 'queued' RETURNING id", (download_id,)
+            ).fetchone()
+            if row is None:
+                conn.execute('UPDATE jobs SET cancel_requested = 1 WHERE id = ?', (download_id,))
+        return row is not None
+
+    def cancel_requested_ids(self):
+        """Jobs flagged for cancellation, whatever their saved status.
+
+        The worker that takes the cancel request saves the job as 'cancelled'
+        right away, while the job may still be running in another process.
+        """
+        rows = self.connection().execute('SELECT id FROM jobs WHERE cancel_requested = 1').fetchall()
+        return [row['id'] for row in rows]
+
+    def cancel_requested(self, download_id):
+        row = self.connection().execute(
+            'SELECT cancel_requested FROM jobs WHERE id = ?', (download_id,)
+        ).fetchone()
+        return bool(row and row['cancel_requested'])
+
+    def clear_cancel_request(self, download_id):
+        """Unflag a cancelled job once it has stopped"""
+        with self.connection() as conn:
+            conn.execute('UPDATE jobs SET cancel_requested = 0 WHERE id = ?', (download_id,))
+
+    def jobs_with_status(self, statuses, batch_id=None):
+        placeholders = ','.join('?' * len(statuses))
+        if batch_id is None:
+            rows = self.connection().execute(
+                f'SELECT id, data FROM jobs WHERE status IN ({placeholders})', tuple(statuses)
+            ).fetchall()
+        else:
+            rows = self.connection().execute(
+                f'SELECT id, data FROM jobs WHERE batch_id = ? AND status IN ({placeholders})',
+                (batch_id,) + tuple(statuses)
+            ).fetchall()
+        return [dict(json.loads(row['data']), download_id=row['id']) for row in rows]
+
+    def get(self, download_id):
+        row = self.connection().execute(
+            'SELECT data FROM jobs WHERE id = ?', (download_id,)
+        ).fetchone()
+        return json.loads(row['data']) if row else None
+
+    def get_job_args(self, download_id):
+        """Return (status, url, options, directory, priority) for running a job"""
+        row = self.connection().execute(
+            'SELECT jobs.status, jobs.url, COALESCE(jobs.options, batches.options) AS options, '
+            'jobs.directory, jobs.priority FROM jobs LEFT JOIN batches ON batches.id = jobs.batch_id '
+            'WHERE jobs.id = ?', (download_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return row['status'], row['url'], json.loads(row['options'] or '{}'), row['directory'], row['priority']
+
+    def ids_with_status(self, statuses):
+        placeholders = ','.join('?' * len(statuses))
+        rows = self.connection().execute(
+            f'SELECT id FROM jobs WHERE status IN ({placeholders}) ORDER BY priority DESC, rowid',
+            tuple(statuses)
+        ).fetchall()
+        return [row['id'] for row in rows]
+
+    def directories(self, status, since=0):
+        rows = self.connection().execute(
+            'SELECT DISTINCT directory FROM jobs WHERE status = ? AND updated > ?', (status, since)
+        ).fetchall()
+        return [row['directory'] for row in rows if row['directory']]
+
+    def recent_urls(self, limit):
+        rows = self.connection().execute(
+            'SELECT url FROM jobs WHERE url IS NOT NULL ORDER BY created DESC LIMIT ?', (limit,)
+        ).fetchall()
+        return [row['url'] for row in rows]
+
+    def count_by_status(self):
+        rows = self.connection().execute(
+            'SELECT status, COUNT(*) AS n FROM jobs GROUP BY status'
+        ).fetchall()
+        return {row['status']: row['n'] for row in rows}
+
+    def count_by_stage(self):
+        """Count running jobs per pipeline stage (download, postprocess_wait, postprocess)"""
+        rows = self.connection().execute(
+            "SELECT json_extract(data, '$.stage') AS stage, COUNT(*) AS n FROM jobs "
+            "WHERE status IN ('starting', 'downloading', 'processing') GROUP BY stage"
+        ).fetchall()
+        return {row['stage']: row['n'] for row in rows if row['stage']}
+
+    def prune(self):
+        """Apply the retention policy to finished jobs"""
+        placeholders = ','.join('?' * len(FINISHED_STATES))
+        cutoff = time.time() - JOB_RETENTION_DAYS * 86400
+        with self.connection() as conn:
+            removed = conn.execute(
+                f'DELETE FROM jobs WHERE status IN ({placeholders}) AND updated < ?',
+                FINISHED_STATES + (cutoff,)
+            ).rowcount
+            removed += conn.execute(
+                f'DELETE FROM jobs WHERE id IN (SELECT id FROM jobs WHERE status IN ({placeholders}) '
+                f'ORDER BY updated DESC LIMIT -1 OFFSET ?)',
+                FINISHED_STATES + (JOB_RETENTION_COUNT,)
+            ).rowcount
+            conn.execute('DELETE FROM batches WHERE id NOT IN (SELECT DISTINCT batch_id FROM jobs WHERE batch_id IS NOT NULL)')
+        if removed:
+            logger.info(f"Pruned {removed} finished jobs from the job store")
+        return removed
+
+
+job_store = JobStore(JOB_DB_PATH)
+
+
+class DownloadArchive(SQLiteStore):
+    """Index of videos already downloaded into each directory.
+
+    Entries are keyed like yt-dlp's --download-archive lines ("<extractor>
+    <id>", extractor lowercased) so archive files can be imported and
+    exported. An entry only counts while its file still exists; imported
+    entries have no path and always count.
+    """
+
+    def create_schema(self, conn):
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS archive (
+                extractor TEXT NOT NULL,
+                video_id TEXT NOT NULL,
+                directory TEXT NOT NULL,
+                path TEXT,
+                size INTEGER,
+                completed REAL NOT NULL,
+                PRIMARY KEY (directory, extractor, video_id)
+            );
+            CREATE INDEX IF NOT EXISTS idx_archive_video ON archive (extractor, video_id);
+        ''')
+
+    def add(self, extractor, video_id, directory, path=None, size=None):
+        with self.connection() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO archive (extractor, video_id, directory, path, size, completed) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (extractor.lower(), video_id, directory, path, size, time.time())
+            )
+
+    def import_lines(self, directory, lines):
+        """Import lines of a yt-dlp download archive file; returns the count"""
+        now = time.time()
+        rows = []
+        for line in lines:
+            extractor, _, video_id = line.strip().partition(' ')
+            if extractor and video_id:
+                rows.append((extractor.lower(), video_id.strip(), directory, now))
+        with self.connection() as conn:
+            conn.executemany(
+                'INSERT OR IGNORE INTO archive (extractor, video_id, directory, completed) VALUES (?, ?, ?, ?)',
+                rows
+            )
+        return len(rows)
+
+    def export_lines(self, directory):
+        rows = self.connection().execute(
+            'SELECT extractor, video_id FROM archive WHERE directory = ? ORDER BY completed', (directory,)
+        )
+        return [f"{row['extractor']} {row['video_id']}" for row in rows]
+
+    def lookup(self, directory, keys):
+        """Return {(extractor, id): entry} for the keys archived in a directory"""
+        found = {}
+        keys = [(extractor.lower(), video_id) for extractor, video_id in keys]
+        for start in range(0, len(keys), 400):
+            chunk = keys[start:start + 400]
+            rows = self.connection().execute(
+                'SELECT extractor, video_id, path, size, completed FROM archive WHERE directory = ? AND '
+                '(extractor, video_id) IN (VALUES ' + ','.join(['(?, ?)'] * len(chunk)) + ')',
+                (directory,) + tuple(value for key in chunk for value in key)
+            ).fetchall()
+            for row in rows:
+                # The file was deleted since: it can be downloaded again
+                if row['path'] and not os.path.exists(row['path']):
+                    continue
+                found[(row['extractor'], row['video_id'])] = {
+                    'path': row['path'],
+                    'size': row['size'],
+                    'completed': datetime.fromtimestamp(row['completed']).isoformat()
+                }
+        return found
+
+
+download_archive = DownloadArchive(JOB_DB_PATH)
+
+
+def archive_key(url, extractor=None, video_id=None):
+    """Return the (extractor, id) archive key of a video, or None.
+
+    Without an id from a previous extraction, the first extractor (other
+    than the generic one) that matches the URL supplies it, which needs no
+    network access.
+    """
+    if not (extractor and video_id):
+        extractor = video_id = None
+        for ie in yt_dlp.extractor.gen_extractor_classes():
+            if ie.ie_key() != 'Generic' and ie.suitable(url):
+                extractor, video_id = ie.ie_key(), ie.get_temp_id(url)
+                break
+    if extractor and video_id:
+        return extractor.lower(), video_id
+    return None
+
+
+def find_archived(videos, directory, resolve_urls=False):
+    """Map the index of each already downloaded video in `videos` to its archive entry.
+
+    Videos without an extractor and id are only looked up by URL when
+    resolve_urls is set, since matching a URL against every extractor is
+    too slow for whole channel listings.
+    """
+    keys = {}
+    for i, video in enumerate(videos):
+        if video.get('extractor') and video.get('id'):
+            key = archive_key(video['url'], video['extractor'], video['id'])
+        elif resolve_urls:
+            key = archive_key(video.get('url', ''))
+        else:
+            continue
+        if key:
+            keys[i] = key
+    found = download_archive.lookup(directory, set(keys.values())) if keys else {}
+    return {i: found[key] for i, key in keys.items() if key in found}
+
+
+def mark_archived(videos, directory):
+    """Return copies of listing entries flagged with whether they were already downloaded"""
+    if not directory:
+        return videos
+    archived = find_archived(videos, directory)
+    return [dict(video, archived=i in archived) for i, video in enumerate(videos)]
+
+
+def record_archive(info, download_dir, filename):
+    """Add the videos of a finished download to the download archive"""
+    entries = info.get('entries') if info.get('_type') == 'playlist' else [info]
+    for entry in entries or []:
+        if not entry or not entry.get('id') or not entry.get('extractor_key'):
+            continue
+        downloads = entry.get('requested_downloads') or [{}]
+        path = downloads[0].get('filepath') or (filename if entry is info else None)
+        size = os.path.getsize(path) if path and os.path.exists(path) else None
+        download_archive.add(entry['extractor_key'], entry['id'], download_dir, path, size)
+
+# Minimum seconds between two progress samples recorded for the same download
+PROGRESS_INTERVAL = float(os.environ.get('PROGRESS_INTERVAL', 0.5))
+
+# Download bandwidth cap across all jobs (bytes/s, e.g. 50M); empty = none
+BANDWIDTH_LIMIT = os.environ.get('BANDWIDTH_LIMIT', '')
+# Per-host caps, e.g. "googlevideo.com=20M,example.org=1M" (subdomains included)
+BANDWIDTH_HOST_LIMITS = os.environ.get('BANDWIDTH_HOST_LIMITS', '')
+# Bandwidth weight of single downloads; playlist/channel batch jobs weigh 1
+INTERACTIVE_BANDWIDTH_WEIGHT = 4
+# Seconds of unused bandwidth share a throttled job may use up in one burst
+BANDWIDTH_BURST = 1.0
+
+# Fragment downloads (HLS/DASH) running at once, across all jobs
+FRAGMENT_THREADS = max(1, int(os.environ.get('FRAGMENT_THREADS', 16)))
+# External downloader for fragmented formats ('aria2c'); empty = yt-dlp's own
+FRAGMENT_DOWNLOADER = os.environ.get('FRAGMENT_DOWNLOADER', '').lower()
+# Fragment concurrency tried first on a host, and the step when probing for more
+FRAGMENT_START_CONCURRENCY = max(1, int(os.environ.get('FRAGMENT_START_CONCURRENCY', 4)))
+FRAGMENT_CONCURRENCY_STEP = max(1, int(os.environ.get('FRAGMENT_CONCURRENCY_STEP', 2)))
+# Levels whose throughput is within this fraction of the best one count as just as good
+FRAGMENT_RATE_TOLERANCE = float(os.environ.get('FRAGMENT_RATE_TOLERANCE', 0.1))
+# Seconds a host that throttled fragment downloads is kept at the lowered concurrency
+FRAGMENT_BACKOFF = float(os.environ.get('FRAGMENT_BACKOFF', 600))
+# Smaller files don't say much about a host's throughput
+FRAGMENT_MIN_SAMPLE = parse_bytes(os.environ.get('FRAGMENT_MIN_SAMPLE') or '4M') or 0
+# Protocols yt-dlp downloads fragment by fragment (concurrent_fragment_downloads)
+FRAGMENTED_PROTOCOLS = ('m3u8_native', 'http_dash_segments', 'http_dash_segments_generator')
+# yt-dlp messages that mean a host is failing fragment requests
+FRAGMENT_ERROR_MESSAGE = re.compile(r'Retrying fragment|HTTP Error (429|503)')
+
+# Downloads from one site that run at the same time; 0 = no limit (opt-in, since
+# a playlist batch comes from one site and would never reach MAX_CONCURRENT_DOWNLOADS)
+DOMAIN_CONCURRENCY = int(os.environ.get('DOMAIN_CONCURRENCY', 0))
+# Minimum seconds between requests to one host (media downloads excepted), across all jobs
+DOMAIN_REQUEST_INTERVAL = float(os.environ.get('DOMAIN_REQUEST_INTERVAL', 0.5))
+# Backoff after a host answers 429: doubles from the first value up to the second
+DOMAIN_BACKOFF = (30, 3600)
+# Shorter backoffs are waited out inside the job; longer ones put it back in the queue
+DOMAIN_BACKOFF_WAIT = 10
+# Times a job goes back to the queue because of throttling before it fails
+DOMAIN_MAX_DEFERRALS = 10
+# Seconds a process reuses a host's backoff state before reading it again
+DOMAIN_STATE_TTL = 1.0
+# Job errors that mean the site is throttling us (for errors not seen by the governor)
+THROTTLED_ERROR = re.compile(r'HTTP Error 429|Too Many Requests|rate.limit', re.IGNORECASE)
+
+# Extractors loaded at startup, besides the ones recent jobs used most
+WARM_EXTRACTORS = ('Youtube', 'YoutubeTab', 'Generic')
+# Idle extraction-only YoutubeDL instances kept per set of options (playlist listings)
+YDL_POOL_SIZE = 4
+# Job processes started ahead of time in EXECUTION_MODE=process, so a job doesn't wait for Python to start
+JOB_PROCESS_SPARES = max(0, int(os.environ.get('JOB_PROCESS_SPARES', 1)))
+
+# Files in download directories are listed for this many days
+RECENT_FILE_DAYS = float(os.environ.get('RECENT_FILE_DAYS', 7))
+# Seconds between rescans of the download directories for outside changes
+FILE_CATALOG_INTERVAL = float(os.environ.get('FILE_CATALOG_INTERVAL', 60))
+# Seconds between checks for directories that changed since their last scan
+CATALOG_POLL_INTERVAL = 2.0
+
+# Flat playlist/channel listings are reused for this many seconds
+PLAYLIST_CACHE_TTL = float(os.environ.get('PLAYLIST_CACHE_TTL', 3600))
+# Maximum number of playlists/channels kept in the listing cache
+PLAYLIST_CACHE_SIZE = int(os.environ.get('PLAYLIST_CACHE_SIZE', 32))
+# Extracted video info is reused by downloads of the same URL for this many seconds
+# (well within the lifetime of the media URLs in it on most sites; 0 disables the cache)
+INFO_CACHE_TTL = float(os.environ.get('INFO_CACHE_TTL', 1800))
+# Maximum number of videos kept in the info cache (compressed JSON, typically 10-50 KB each)
+INFO_CACHE_SIZE = int(os.environ.get('INFO_CACHE_SIZE', 1000))
+# yt-dlp options that don't change what extraction returns. Any other option
+# (cookies, extractor_args, proxy, ...) is part of the info cache key
+INFO_CACHE_NEUTRAL_OPTIONS = {
+    'format', 'outtmpl', 'postprocessors', 'writesubtitles', 'writeautomaticsub', 'writethumbnail',
+    'addmetadata', 'writeinfojson', 'merge_output_format', 'subtitleslangs', 'ratelimit', 'noplaylist', 'playliststart', 'playlistend',
+    'extract_flat', 'lazy_playlist', 'quiet', 'no_warnings', 'verbose', 'ignore_errors',
+    'concurrent_fragment_downloads', 'external_downloader',
+}
+# Videos probed at once by one /formats request, and the most it accepts
+FORMAT_PROBE_WORKERS = 4
+FORMAT_PROBE_MAX_URLS = 50
+
+# Progress updates for a job are pushed to /events at most this often (seconds)
+EVENT_INTERVAL = float(os.environ.get('EVENT_INTERVAL', 0.5))
+# Number of past events kept for clients resuming with Last-Event-ID
+EVENT_BACKLOG = int(os.environ.get('EVENT_BACKLOG', 2000))
+
+# Seconds between writes of this process's metrics to the job database
+METRICS_INTERVAL = 5.0
+# Histogram buckets (seconds) for job phases and for HTTP requests
+PHASE_BUCKETS = (0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+HTTP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+SETUP_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# Routes whose latency is recorded
+HTTP_METRIC_RULES = ('/status/<download_id>', '/downloads', '/browse', '/formats')
+
+# Profiles of jobs queued with "profile": true, one directory per job
+PROFILE_DIR = os.path.join(DATA_DIR, 'profiles')
+# Spans kept per profiled stage (prepare_filename runs for every file)
+PROFILE_MAX_SPANS = 5000
+
+
+class EventBroker(SQLiteStore):
+    """Fan out job status updates to /events subscribers.
+
+    Progress updates are coalesced per job and flushed every EVENT_INTERVAL,
+    state changes are flushed immediately. Flushed events go to an events
+    table in the job database (together with the job progress), so every
+    worker process can serve them. Event ids are prefixed with an epoch
+    stored in the database, so clients can tell when the backlog they resume
+    from belongs to a database that no longer exists.
+    """
+
+    def __init__(self, path, interval, backlog):
+        self.interval = interval
+        self.backlog = backlog
+        self.cond = threading.Condition()
+        self.pending = {}
+        self.last_flush = 0.0
+        super().__init__(path)
+        self.epoch = self.connection().execute(
+            "SELECT value FROM meta WHERE key = 'events_epoch'"
+        ).fetchone()['value']
+        self.seq = self.latest_seq()
+
+    def create_schema(self, conn):
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS events (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                data TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+        ''')
+        conn.execute(
+            "INSERT OR IGNORE INTO meta (key, value) VALUES ('events_epoch', ?)", (uuid.uuid4().hex[:8],)
+        )
+
+    def latest_seq(self):
+        return self.connection().execute('SELECT COALESCE(MAX(seq), 0) AS seq FROM events').fetchone()['seq']
+
+    def publish(self, download_id, job, immediate=False):
+        with self.cond:
+            self.pending[download_id] = dict(job)
+            if immediate or time.monotonic() - self.last_flush >= self.interval:
+                self._flush()
+
+    def _flush(self):
+        pending = list(self.pending.items())
+        self.pending.clear()
+        self.last_flush = time.monotonic()
+        events = [
+            (json.dumps(format_progress(dict(job, download_id=download_id)), default=str),)
+            for download_id, job in pending
+        ]
+        with self.connection() as conn:
+            conn.executemany('INSERT INTO events (data) VALUES (?)', events)
+            seq = conn.execute('SELECT MAX(seq) AS seq FROM events').fetchone()['seq']
+            conn.execute('DELETE FROM events WHERE seq <= ?', (seq - self.backlog,))
+        # Progress is only persisted here, so other processes see it too
+        job_store.save_many(pending)
+        self.seq = seq
+        self.cond.notify_all()
+
+    def flush_loop(self):
+        """Push out coalesced updates and pick up events from other processes"""
+        while True:
+            time.sleep(self.interval)
+            try:
+                with self.cond:
+                    if self.pending:
+                        self._flush()
+                    else:
+                        seq = self.latest_seq()
+                        if seq != self.seq:
+                            self.seq = seq
+                            self.cond.notify_all()
+            except Exception as e:
+                logger.error(f"Event flush failed: {e}")
+
+    def event_id(self, seq):
+        return f'{self.epoch}-{seq}'
+
+    def parse_event_id(self, event_id):
+        """Return the sequence number to resume after, or None if unknown"""
+        epoch, _, seq = (event_id or '').partition('-')
+        if epoch != self.epoch or not seq.isdigit():
+            return None
+        seq = int(seq)
+        # The client may come from another process, whose events this one has
+        # not picked up yet: compare with the table, not with self.seq
+        row = self.connection().execute(
+            'SELECT MIN(seq) AS oldest, COALESCE(MAX(seq), 0) AS latest FROM events'
+        ).fetchone()
+        if seq > row['latest'] or (row['oldest'] is not None and seq < row['oldest'] - 1):
+            return None
+        return seq
+
+    def wait(self, after, timeout):
+        """Block until events newer than `after` exist; None if they were dropped"""
+        with self.cond:
+            self.cond.wait_for(lambda: self.seq > after, timeout)
+            if self.seq <= after:
+                return []
+        rows = self.connection().execute(
+            'SELECT seq, data FROM events WHERE seq > ? ORDER BY seq', (after,)
+        ).fetchall()
+        oldest = self.connection().execute('SELECT MIN(seq) AS seq FROM events').fetchone()['seq']
+        if oldest is None or oldest > after + 1:
+            return None
+        return [(row['seq'], row['data']) for row in rows]
+
+
+event_broker = EventBroker(JOB_DB_PATH, EVENT_INTERVAL, EVENT_BACKLOG)
+
+
+class Metrics(SQLiteStore):
+    """Counters and histograms for /metrics, in Prometheus text format.
+
+    Every process (web workers, job processes) adds to its own pending
+    deltas and merges them into a metrics table in the job database every
+    METRICS_INTERVAL, so /metrics reports the totals of all of them.
+    """
+
+    def __init__(self, path):
+        self.families = {}
+        self.lock = threading.Lock()
+        self.pending = collections.defaultdict(float)
+        super().__init__(path)
+
+    def create_schema(self, conn):
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS metrics (
+                name TEXT NOT NULL,
+                labels TEXT NOT NULL,
+                le TEXT NOT NULL,
+                value REAL NOT NULL,
+                PRIMARY KEY (name, labels, le)
+            )
+        ''')
+
+    def counter(self, name, help):
+        self.families[name] = ('counter', help, None)
+
+    def histogram(self, name, help, buckets):
+        self.families[name] = ('histogram', help, buckets)
+
+    @staticmethod
+    def format_labels(labels):
+        """{'phase': 'download'} -> 'phase="download"'"""
+        escape = lambda value: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        return ','.join(f'{key}="{escape(value)}"' for key, value in sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        with self.lock:
+            self.pending[(name, self.format_labels(labels), '')] += value
+
+    def observe(self, name, value, **labels):
+        labels = self.format_labels(labels)
+        buckets = self.families[name][2]
+        with self.lock:
+            for bound in buckets:
+                if value <= bound:
+                    self.pending[(name + '_bucket', labels, str(bound))] += 1
+            self.pending[(name + '_bucket', labels, '+Inf')] += 1
+            self.pending[(name + '_sum', labels, '')] += value
+            self.pending[(name + '_count', labels, '')] += 1
+
+    def flush(self):
+        with self.lock:
+            pending = list(self.pending.items())
+            self.pending.clear()
+        if not pending:
+            return
+        with self.connection() as conn:
+            conn.executemany(
+                'INSERT INTO metrics (name, labels, le, value) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (name, labels, le) DO UPDATE SET value = value + excluded.value',
+                [(name, labels, le, value) for (name, labels, le), value in pending]
+            )
+
+    def flush_loop(self):
+        while True:
+            time.sleep(METRICS_INTERVAL)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Metrics flush failed: {e}")
+
+    @staticmethod
+    def sample(name, labels, value):
+        value = int(value) if float(value).is_integer() else value
+        return f'{name}{{{labels}}} {value}' if labels else f'{name} {value}'
+
+    def render(self, gauges):
+        """Return the exposition text: `gauges` (name -> (help, {labels: value})) plus the stored metrics"""
+        self.flush()
+        samples = collections.defaultdict(list)
+        for row in self.connection().execute('SELECT name, labels, le, value FROM metrics'):
+            family = row['name'] if row['name'] in self.families else re.sub(r'_(bucket|sum|count)$', '', row['name'])
+            samples[family].append((row['name'], row['labels'], row['le'], row['value']))
+
+        lines = []
+        for name, (help, values) in gauges.items():
+            lines += [f'# HELP {name} {help}', f'# TYPE {name} gauge']
+            lines += [self.sample(name, labels, value) for labels, value in values.items()]
+        for name, (kind, help, _) in self.families.items():
+            lines += [f'# HELP {name} {help}', f'# TYPE {name} {kind}']
+            # Per label set: the buckets in ascending order, then _sum and _count
+            order = {name + '_sum': 1, name + '_count': 2}
+            for sample, labels, le, value in sorted(samples[name], key=lambda s: (
+                    s[1], order.get(s[0], 0), float(s[2].replace('+Inf', 'inf') or 0))):
+                if le:
+                    labels = f'{labels},le="{le}"' if labels else f'le="{le}"'
+                lines.append(self.sample(sample, labels, value))
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics(JOB_DB_PATH)
+metrics.histogram('ytdlp_dash_job_phase_seconds',
+                  'Time jobs spend per phase (queue, extraction, download, merge, postprocess_wait, postprocess)',
+                  PHASE_BUCKETS)
+metrics.histogram('ytdlp_dash_postprocessor_seconds', 'Run time of each yt-dlp postprocessor', PHASE_BUCKETS)
+metrics.counter('ytdlp_dash_downloaded_bytes_total', 'Bytes downloaded')
+metrics.counter('ytdlp_dash_jobs_finished_total', 'Jobs finished, by final status')
+metrics.counter('ytdlp_dash_job_errors_total', 'Failed jobs, by extractor')
+metrics.counter('ytdlp_dash_jobs_deferred_total', 'Jobs put back in the queue because their site throttled, by host')
+metrics.counter('ytdlp_dash_info_cache_total', 'Info cache lookups, by result (hit/miss)')
+metrics.histogram('ytdlp_dash_http_request_seconds', 'HTTP request latency', HTTP_BUCKETS)
+metrics.histogram('ytdlp_dash_setup_seconds',
+                  'Setup time (warmup: extractors at startup; youtubedl: per YoutubeDL; job_process: until a job process runs)',
+                  SETUP_BUCKETS)
+metrics.histogram('ytdlp_dash_first_byte_seconds',
+                  'Time to the first downloaded byte since the job started (since="job") or the app started (since="startup", once)',
+                  PHASE_BUCKETS)
+
+# Monotonic start time of the job phases currently running in this process
+phase_started = {}
+
+
+def start_phase(download_id, phase):
+    phase_started.setdefault((download_id, phase), time.monotonic())
+
+
+def end_phase(download_id, phase, metric='ytdlp_dash_job_phase_seconds', **labels):
+    """Record the duration of a phase started with start_phase(), if it was"""
+    started = phase_started.pop((download_id, phase), None)
+    if started is None:
+        return None
+    elapsed = time.monotonic() - started
+    metrics.observe(metric, elapsed, **(labels or {'phase': phase}))
+    return elapsed
+
+
+class JobProfile:
+    """Wall-clock spans of a job stage that runs with profiling on"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.spans = []
+        self.open = {}
+
+    def add(self, name, started):
+        if len(self.spans) < PROFILE_MAX_SPANS:
+            self.spans.append({
+                'name': name,
+                'start': round(started - self.started, 4),
+                'seconds': round(time.monotonic() - started, 4)
+            })
+
+    def begin(self, name):
+        self.open[name] = time.monotonic()
+
+    def end(self, name):
+        started = self.open.pop(name, None)
+        if started is not None:
+            self.add(name, started)
+
+    @contextlib.contextmanager
+    def span(self, name):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add(name, started)
+
+
+# Profiles of the job stages running in this process, by download id
+job_profiles = {}
+
+
+def job_span(download_id, name):
+    """Time a block as a span of the job's profile; a no-op for unprofiled jobs"""
+    profile = job_profiles.get(download_id)
+    return profile.span(name) if profile else contextlib.nullcontext()
+
+
+class ExtractorRegistry:
+    """yt-dlp's extractor list, built once per process instead of by every YoutubeDL.
+
+    A YoutubeDL spends most of its construction registering yt-dlp's ~1700
+    extractors (112 ms of it with yt-dlp 2026.08.19, against 2 ms through
+    create()); create() hands it the list built for the first one. warm()
+    also compiles every extractor's URL pattern and imports the extractors
+    in common use, so the first job doesn't pay for them. pooled() lends out
+    extraction-only YoutubeDL instances, which keep their extractors'
+    caches and connections between requests.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.extractors = None
+        self.idle = {}  # options as JSON -> idle YoutubeDL instances
+
+    def default_extractors(self):
+        with self.lock:
+            if self.extractors is None:
+                self.extractors = list(yt_dlp.YoutubeDL({'quiet': True})._ies.values())
+            return self.extractors
+
+    def create(self, params):
+        """Create a YoutubeDL with the default extractors, as YoutubeDL(params) would"""
+        if 'allowed_extractors' in params:
+            return yt_dlp.YoutubeDL(params)
+        ydl = yt_dlp.YoutubeDL(params, auto_init=False)
+        for ie in self.default_extractors():
+            # Extractor instances (the final catch-all) belong to one YoutubeDL
+            ydl.add_info_extractor(ie if isinstance(ie, type) else type(ie)())
+        if params.get('verbose'):
+            # auto_init=False also skips the debug header of verbose jobs
+            ydl.print_debug_header()
+        return ydl
+
+    @contextlib.contextmanager
+    def pooled(self, params):
+        """Borrow an idle YoutubeDL with these options; only for options without hooks or loggers"""
+        key = json.dumps(params, sort_keys=True)
+        with self.lock:
+            idle = self.idle.setdefault(key, [])
+            ydl = idle.pop() if idle else None
+        if ydl is None:
+            ydl = govern(self.create(params))
+        reusable = False
+        try:
+            yield ydl
+            reusable = True
+        except GeneratorExit:
+            # The caller stopped reading a lazy playlist early
+            reusable = True
+            raise
+        finally:
+            # Errors may leave the instance in an unknown state, so it is not reused
+            with self.lock:
+                if reusable and len(idle) < YDL_POOL_SIZE:
+                    idle.append(ydl)
+                    ydl = None
+            if ydl is not None:
+                ydl.close()
+
+    def warm(self):
+        """Build the extractor list, compile the URL patterns and import the common extractors"""
+        started = time.monotonic()
+        extractors = self.default_extractors()
+        for ie in extractors:
+            if isinstance(ie, type):
+                ie.suitable('https://warmup.invalid/')
+        keys = list(WARM_EXTRACTORS)
+        try:
+            recent = collections.Counter(extractor_name(url) for url in job_store.recent_urls(200))
+        except sqlite3.Error as e:
+            logger.warning(f"Could not read recent jobs to warm their extractors: {e}")
+            recent = collections.Counter()
+        keys += [key for key, _ in recent.most_common(5) if key not in keys]
+        ydl = self.create({'quiet': True})
+        for key in keys:
+            try:
+                ydl.get_info_extractor(key)
+            except Exception as e:
+                logger.warning(f"Could not load the {key} extractor: {e}")
+        elapsed = time.monotonic() - started
+        metrics.observe('ytdlp_dash_setup_seconds', elapsed, step='warmup')
+        logger.info(f"Loaded {len(extractors)} extractors in {elapsed:.2f}s; warmed {', '.join(keys)}")
+
+
+extractor_registry = ExtractorRegistry()
+
+
+def extractor_name(url):
+    """Return the key of the extractor yt-dlp would use for `url`"""
+    for ie in yt_dlp.extractor.gen_extractor_classes():
+        if ie.suitable(url):
+            return ie.ie_key()
+    return 'Generic'
+
+def parse_rate(value):
+    """Parse a bandwidth limit (bytes/s as a number or a string like '5M'); None = unlimited"""
+    if value is None or value == '':
+        return None
+    rate = parse_bytes(value) if isinstance(value, str) else value
+    if not isinstance(rate, (int, float)) or isinstance(rate, bool) or rate <= 0:
+        raise ValueError(f'Invalid bandwidth limit: {value!r}')
+    return float(rate)
+
+
+def fair_shares(capacity, demands):
+    """Weighted max-min fair split of `capacity` over demands {id: (weight, cap)}.
+
+    Jobs whose cap is below their weighted share get their cap, and what
+    they leave is split among the others.
+    """
+    shares = {}
+    pending = dict(demands)
+    while pending:
+        unit = capacity / sum(weight for weight, _ in pending.values())
+        capped = {key: cap for key, (weight, cap) in pending.items() if cap <= weight * unit}
+        if not capped:
+            shares.update((key, weight * unit) for key, (weight, _) in pending.items())
+            break
+        for key, cap in capped.items():
+            shares[key] = cap
+            capacity = max(capacity - cap, 0)
+            del pending[key]
+    return shares
+
+
+class BandwidthScheduler(SQLiteStore):
+    """Share download bandwidth between the running jobs.
+
+    Enforces a global cap and per-host caps (BANDWIDTH_LIMIT and
+    BANDWIDTH_HOST_LIMITS, changed at runtime through /bandwidth and kept
+    in the job database). The scheduler process rebalances the shares every
+    tick: weighted max-min fairness, where a job that doesn't use its share
+    (slow server, its own ratelimit) leaves the rest to the others. Jobs
+    throttle themselves to their share in progress_hook().
+    """
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.rebalancing = threading.Lock()
+        # download_id -> {'weight', 'ratelimit', 'value', 'settled'}; value
+        # is the shared multiprocessing.Value of a job running in a job
+        # process, settled when its rate can reflect its latest share
+        self.jobs = {}
+        # Current share (bytes/s) of each throttled job
+        self.shares = {}
+        super().__init__(path)
+
+    def create_schema(self, conn):
+        # host '' is the global limit; a NULL rate means unlimited
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS bandwidth_limits (
+                host TEXT PRIMARY KEY,
+                rate REAL
+            )
+        ''')
+
+    def limits(self):
+        """Return (global limit, {host: limit}) with the runtime changes applied"""
+        limit = parse_rate(BANDWIDTH_LIMIT)
+        hosts = {}
+        for item in filter(None, (item.strip() for item in BANDWIDTH_HOST_LIMITS.split(','))):
+            host, _, rate = item.partition('=')
+            hosts[host.strip().lower()] = parse_rate(rate.strip())
+        for row in self.connection().execute('SELECT host, rate FROM bandwidth_limits'):
+            if row['host'] == '':
+                limit = row['rate']
+            else:
+                hosts[row['host']] = row['rate']
+        return limit, {host: rate for host, rate in hosts.items() if rate}
+
+    def set_limits(self, changes):
+        """Store limit changes {host or '': bytes/s or None}"""
+        with self.connection() as conn:
+            conn.executemany(
+                'INSERT INTO bandwidth_limits (host, rate) VALUES (?, ?) '
+                'ON CONFLICT (host) DO UPDATE SET rate = excluded.rate',
+                list(changes.items())
+            )
+
+    def register(self, download_id, weight, ratelimit):
+        with self.lock:
+            self.jobs[download_id] = {'weight': weight, 'ratelimit': ratelimit, 'value': None, 'settled': 0}
+        # Small files are done long before the next scheduler tick
+        self.rebalance()
+
+    def attach(self, download_id, value):
+        """Use a shared value to pass the job's share to its job process"""
+        with self.lock:
+            if download_id in self.jobs:
+                self.jobs[download_id]['value'] = value
+
+    def unregister(self, download_id):
+        with self.lock:
+            self.jobs.pop(download_id, None)
+            self.shares.pop(download_id, None)
+
+    def rebalance(self):
+        """Recompute the shares: every scheduler tick, and when a job starts or changes host"""
+        with self.rebalancing:
+            self.update_shares()
+
+    def update_shares(self):
+        limit, host_limits = self.limits()
+        now = time.monotonic()
+        with self.lock:
+            jobs = dict(self.jobs)
+        demands = {}
+        for download_id, entry in jobs.items():
+            job = download_status.get(download_id) or {}
+            cap = entry['ratelimit'] or float('inf')
+            share = self.shares.get(download_id)
+            speed = job.get('rate_bytes')
+            if share and speed is not None and speed < share * 0.8 and now >= entry['settled']:
+                # Not using its share: only keep some headroom above its speed
+                cap = min(cap, max(speed * 1.25, 65536))
+            demands[download_id] = (entry['weight'], cap, job.get('host') or '')
+
+        # Split each host's limit between its jobs first, then the global one
+        caps = {download_id: (weight, cap) for download_id, (weight, cap, _) in demands.items()}
+        for host, rate in host_limits.items():
+            on_host = {download_id: caps[download_id] for download_id, (_, _, job_host) in demands.items()
+                       if job_host == host or job_host.endswith('.' + host)}
+            for download_id, share in fair_shares(rate, on_host).items():
+                caps[download_id] = (caps[download_id][0], share)
+        shares = fair_shares(limit or float('inf'), caps)
+
+        with self.lock:
+            previous_shares = self.shares
+            self.shares = {download_id: share for download_id, share in shares.items()
+                           if share != float('inf') and download_id in self.jobs}
+            for download_id, entry in self.jobs.items():
+                share = self.shares.get(download_id)
+                old = entry['value'].value if entry['value'] is not None else previous_shares.get(download_id)
+                if share and (not old or share > old * 1.1):
+                    # Give the job a few samples to speed up before judging its use
+                    entry['settled'] = now + PROGRESS_INTERVAL * 3
+                if entry['value'] is not None:
+                    entry['value'].value = share or 0.0
+                job = download_status.get(download_id)
+                if job is None:
+                    continue
+                previous = job.get('bandwidth_share')
+                changed = (share is None) != (previous is None) or (
+                    share and previous and abs(share - previous) > previous * 0.1)
+                if changed:
+                    job['bandwidth_share'] = round(share) if share else None
+                    event_broker.publish(download_id, job)
+
+
+bandwidth = BandwidthScheduler(JOB_DB_PATH)
+
+
+class FragmentTuner(SQLiteStore):
+    """Tune the fragment concurrency of HLS/DASH downloads per host.
+
+    Remembers the throughput each concurrency level got from a host and
+    picks the lowest level within FRAGMENT_RATE_TOLERANCE of the best one,
+    probing a step higher while the best is also the highest tried. A host that starts
+    failing fragment requests (429/503, retries) gets half the concurrency
+    for FRAGMENT_BACKOFF seconds. Kept in the job database, so jobs in
+    other processes learn from each other.
+    """
+
+    def create_schema(self, conn):
+        # rates: {concurrency: bytes/s}; ceiling applies until throttled + FRAGMENT_BACKOFF
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS fragment_hosts (
+                host TEXT PRIMARY KEY,
+                rates TEXT NOT NULL DEFAULT '{}',
+                ceiling INTEGER,
+                throttled REAL NOT NULL DEFAULT 0
+            )
+        ''')
+
+    def state(self, host):
+        """Return (rates, ceiling or None while not backing off) for a host"""
+        row = self.connection().execute(
+            'SELECT rates, ceiling, throttled FROM fragment_hosts WHERE host = ?', (host,)
+        ).fetchone()
+        if row is None:
+            return {}, None
+        rates = {int(level): rate for level, rate in json.loads(row['rates']).items()}
+        backing_off = time.time() < row['throttled'] + FRAGMENT_BACKOFF
+        return rates, row['ceiling'] if backing_off else None
+
+    def concurrency(self, host, jobs):
+        """Fragments to download at once from `host` while `jobs` downloads are running"""
+        rates, ceiling = self.state(host)
+        if not rates:
+            level = FRAGMENT_START_CONCURRENCY
+        else:
+            best = max(rates.values())
+            level = min(level for level, rate in rates.items() if rate >= best * (1 - FRAGMENT_RATE_TOLERANCE))
+            if level == max(rates) and ceiling is None:
+                level += FRAGMENT_CONCURRENCY_STEP
+        if ceiling is not None:
+            level = min(level, ceiling)
+        # Leave threads for the other running downloads
+        return max(1, min(level, FRAGMENT_THREADS // max(jobs, 1)))
+
+    def record(self, host, level, rate):
+        """Record the throughput of a finished download"""
+        rates, _ = self.state(host)
+        rates[level] = rate if level not in rates else (rates[level] + rate) / 2
+        with self.connection() as conn:
+            conn.execute(
+                'INSERT INTO fragment_hosts (host, rates) VALUES (?, ?) '
+                'ON CONFLICT (host) DO UPDATE SET rates = excluded.rates',
+                (host, json.dumps(rates))
+            )
+
+    def throttled(self, host, level):
+        """Back off after `host` failed fragment requests at `level`"""
+        rates, ceiling = self.state(host)
+        ceiling = max(1, min(level // 2, ceiling or level))
+        # Levels above the ceiling have to prove themselves again afterwards
+        rates = {n: rate for n, rate in rates.items() if n <= ceiling}
+        with self.connection() as conn:
+            conn.execute(
+                'INSERT INTO fragment_hosts (host, rates, ceiling, throttled) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (host) DO UPDATE SET rates = excluded.rates, '
+                'ceiling = excluded.ceiling, throttled = excluded.throttled',
+                (host, json.dumps(rates), ceiling, time.time())
+            )
+        return ceiling
+
+
+fragment_tuner = FragmentTuner(JOB_DB_PATH)
+# download_id -> {'host', 'concurrency', 'throttled'} of the video being downloaded
+fragment_jobs = {}
+
+
+class HostThrottled(Exception):
+    """A host is backing off; the job should be retried at `until`"""
+
+    def __init__(self, host, until):
+        super().__init__(f'{host} is throttling requests; retrying at {datetime.fromtimestamp(until):%H:%M:%S}')
+        self.host = host
+        self.until = until
+
+
+def site_host(url):
+    """Host of a URL as the governor keys it (lowercase, without www.)"""
+    host = (urllib.parse.urlsplit(url or '').hostname or '').lower()
+    return host[4:] if host.startswith('www.') else host
+
+
+class DomainGovernor(SQLiteStore):
+    """Pace requests to each host and back off, across all jobs, when it throttles.
+
+    Every job's YoutubeDL sends its requests through govern(). Requests to a
+    host are spaced DOMAIN_REQUEST_INTERVAL apart, and a 429 blocks the host
+    with an exponential backoff (DOMAIN_BACKOFF, or the Retry-After the host
+    asked for). claim_next() also keeps jobs for a blocked host in the
+    queue. Kept in the job database, so all processes see the same state;
+    each process caches a host's backoff for DOMAIN_STATE_TTL, so unpaced
+    media and fragment requests don't read the database each time.
+    """
+
+    def __init__(self, path):
+        self.blocked_cache = {}  # host -> (blocked_until, monotonic time read)
+        super().__init__(path)
+
+    def create_schema(self, conn):
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS domain_governor (
+                host TEXT PRIMARY KEY,
+                next_request REAL NOT NULL DEFAULT 0,
+                blocked_until REAL NOT NULL DEFAULT 0,
+                strikes INTEGER NOT NULL DEFAULT 0,
+                last_strike REAL NOT NULL DEFAULT 0
+            )
+        ''')
+
+    def blocked_until(self, host):
+        cached = self.blocked_cache.get(host)
+        if cached is not None and time.monotonic() - cached[1] < DOMAIN_STATE_TTL:
+            return cached[0]
+        row = self.connection().execute(
+            'SELECT blocked_until FROM domain_governor WHERE host = ?', (host,)
+        ).fetchone()
+        until = row['blocked_until'] if row else 0
+        self.blocked_cache[host] = (until, time.monotonic())
+        return until
+
+    def acquire(self, host, paced=True, download_id=None):
+        """Wait for this host's next request slot; raise HostThrottled if it is backing off for long"""
+        now = time.time()
+        until = self.blocked_until(host)
+        if until > now + DOMAIN_BACKOFF_WAIT:
+            raise HostThrottled(host, until)
+        slot = until
+        if paced and DOMAIN_REQUEST_INTERVAL > 0:
+            with self.connection() as conn:
+                row = conn.execute(
+                    'INSERT INTO domain_governor (host, next_request) VALUES (?, ?) '
+                    'ON CONFLICT (host) DO UPDATE SET next_request = MAX(next_request, ?) + ? '
+                    'RETURNING next_request',
+                    (host, now + DOMAIN_REQUEST_INTERVAL, now, DOMAIN_REQUEST_INTERVAL)
+                ).fetchone()
+            slot = max(slot, row['next_request'] - DOMAIN_REQUEST_INTERVAL)
+        while slot > time.time():
+            if download_id in cancelled_downloads:
+                raise Exception('Download cancelled by user')
+            time.sleep(max(min(slot - time.time(), 0.5), 0))
+
+    def throttled(self, host, retry_after=None):
+        """Block a host that answered 429; return when it may be tried again.
+
+        Requests that were already under way when the host got blocked don't
+        extend the backoff, so a burst of 429s counts once.
+        """
+        now = time.time()
+        with self.connection() as conn:
+            row = conn.execute(
+                'SELECT blocked_until, strikes, last_strike FROM domain_governor WHERE host = ?', (host,)
+            ).fetchone()
+            if row and row['blocked_until'] > now:
+                self.blocked_cache[host] = (row['blocked_until'], time.monotonic())
+                return row['blocked_until']
+            # Strikes are forgiven once the host has behaved for the longest backoff
+            strikes = row['strikes'] + 1 if row and now - row['last_strike'] < DOMAIN_BACKOFF[1] * 2 else 1
+            backoff = min(DOMAIN_BACKOFF[0] * 2 ** (strikes - 1), DOMAIN_BACKOFF[1])
+            until = now + max(backoff, retry_after or 0)
+            conn.execute(
+                'INSERT INTO domain_governor (host, blocked_until, strikes, last_strike) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (host) DO UPDATE SET blocked_until = excluded.blocked_until, '
+                'strikes = excluded.strikes, last_strike = excluded.last_strike',
+                (host, until, strikes, now)
+            )
+        self.blocked_cache[host] = (until, time.monotonic())
+        logger.warning(f"{host} is throttling requests; backing off for {until - now:.0f}s")
+        return until
+
+    def blocked(self):
+        """Return {host: blocked_until} of the hosts backing off right now"""
+        rows = self.connection().execute(
+            'SELECT host, blocked_until FROM domain_governor WHERE blocked_until > ?', (time.time(),)
+        ).fetchall()
+        return {row['host']: row['blocked_until'] for row in rows}
+
+
+domain_governor = DomainGovernor(JOB_DB_PATH)
+
+
+def govern(ydl, download_id=None):
+    """Send a YoutubeDL's requests through the domain governor.
+
+    Media downloads are not paced (a fragmented download makes hundreds of
+    requests), but still stop when their host is backing off.
+    """
+    urlopen, dl = ydl.urlopen, ydl.dl
+    downloading = []
+
+    def governed_urlopen(req):
+        host = site_host(req if isinstance(req, str) else getattr(req, 'url', None) or req.get_full_url())
+        domain_governor.acquire(host, paced=not downloading, download_id=download_id)
+        try:
+            return urlopen(req)
+        except HTTPError as e:
+            retry_after = e.response.headers.get('Retry-After') or ''
+            if e.status == 429 or (e.status == 503 and retry_after):
+                until = domain_governor.throttled(host, int(retry_after) if retry_after.isdigit() else None)
+                raise HostThrottled(host, until) from e
+            raise
+
+    def governed_dl(*args, **kwargs):
+        downloading.append(True)
+        try:
+            return dl(*args, **kwargs)
+        finally:
+            downloading.pop()
+
+    ydl.urlopen = governed_urlopen
+    ydl.dl = governed_dl
+    return ydl
+
+
+# Throttling state of the jobs downloading in this process:
+# download_id -> (allowed monotonic time, downloaded bytes, filename)
+throttle_state = {}
+# Per-job lock around the throttle state: fragment threads report progress concurrently
+throttle_locks = {}
+# Host each job in this process last downloaded from, as reported
+job_hosts = {}
+
+# (monotonic time, downloaded bytes, filename) of the last recorded progress
+# sample per running download
+progress_sampled = {}
+
+# Status of the jobs this process is currently running. Queued and finished
+# jobs only live in the job store, so memory stays flat over time.
 download_status = {}
 # Track downloads that should be cancelled
 cancelled_downloads = set()
 
-class ProgressLogger:
+# The server-side queue is the job store itself: workers claim queued jobs from
+# it, so jobs queued through any worker process get picked up. Local enqueues
+# wake the workers right away, others are seen within QUEUE_POLL_INTERVAL.
+QUEUE_POLL_INTERVAL = 1.0
+job_available = threading.Condition()
+# Handoff from the download stage to the postprocessing workers
+postprocess_queue = queue.Queue()
+download_workers = []
+download_workers_lock = threading.Lock()
+
+
+def get_job(download_id):
+    """Return the status dict of a job, whether it is running or not"""
+    job = download_status.get(download_id)
+    if job is not None:
+        return job
+    return job_store.get(download_id)
+
+
+def format_progress(job):
+    """Return a copy of a job with display strings for its numeric progress.
+
+    progress_hook only records raw numbers; formatting happens here, when a
+    status is actually read.
+    """
+    if job.get('downloaded_bytes') is None:
+        return job
+    job = dict(job)
+    downloaded = job['downloaded_bytes']
+    total = job.get('total_bytes')
+    speed = job.get('speed_bytes')
+    job.update({
+        'percent': FileDownloader.format_percent(downloaded * 100 / total).strip() if total else 'N/A',
+        'speed': FileDownloader.format_speed(speed).strip() if speed else 'N/A',
+        'eta': FileDownloader.format_eta(job.get('eta_seconds')).strip(),
+        'downloaded': format_bytes(downloaded),
+        'total': format_bytes(total) if total else 'N/A'
+    })
+    return job
+
+
+def save_job(download_id, job):
+    """Persist a job state change and push it to /events subscribers"""
+    # An immediate flush writes the job to the store along with the event
+    event_broker.publish(download_id, job, immediate=True)
+
+
+def finish_job(download_id, **fields):
+    """Record the final state of a running job and drop it from memory"""
+    job = download_status.pop(download_id, None) or job_store.get(download_id) or {}
+    job.update(fields)
+    save_job(download_id, job)
+    if job.get('status') == 'cancelled':
+        job_store.clear_cancel_request(download_id)
+    forget_job(download_id)
+    metrics.inc('ytdlp_dash_jobs_finished_total', status=job.get('status'))
+
+
+def defer_job(download_id, host, until):
+    """Put a job whose site is throttling us back in the queue until `until`"""
+    job = download_status.pop(download_id, None) or job_store.get(download_id) or {}
+    retry_at = datetime.fromtimestamp(until)
+    logger.warning(f"[{download_id}] {host} is throttling requests; retrying at {retry_at:%H:%M:%S}")
+    # not_before first: the job can be claimed as soon as it is 'queued'
+    job_store.defer(download_id, until)
+    job.update({
+        'status': 'queued',
+        'message': f'{host} is throttling requests; retrying at {retry_at:%H:%M:%S}',
+        'retry_at': retry_at.isoformat(),
+        'deferrals': job.get('deferrals', 0) + 1,
+        'queued': datetime.now().isoformat()
+    })
+    save_job(download_id, job)
+    forget_job(download_id)
+    metrics.inc('ytdlp_dash_jobs_deferred_total', host=host)
+
+
+def forget_job(download_id):
+    """Drop the in-memory state of a job that stopped running"""
+    cancelled_downloads.discard(download_id)
+    progress_sampled.pop(download_id, None)
+    throttle_state.pop(download_id, None)
+    throttle_locks.pop(download_id, None)
+    job_hosts.pop(download_id, None)
+    fragment_jobs.pop(download_id, None)
+    bandwidth.unregister(download_id)
+    for key in [key for key in phase_started if key[0] == download_id]:
+        del phase_started[key]
+
+
+# Set once the first job since startup has downloaded something
+first_byte_since_startup = threading.Event()
+
+
+class JobReporter:
+    """Apply status updates from a running job to its entry in download_status.
+
+    Also remembers the files yt-dlp writes, so the partial ones can be
+    removed when the job is cancelled.
+    """
+
     def __init__(self, download_id):
         self.download_id = download_id
+        self.files = set()
+        self.started = time.monotonic()
+        self.first_byte = None
+
+    def update(self, fields, immediate=False):
+        job = download_status[self.download_id]
+        job.update(fields)
+        if self.first_byte is None and fields.get('downloaded_bytes'):
+            self.record_first_byte()
+        event_broker.publish(self.download_id, job, immediate=immediate)
+        if 'host' in fields:
+            # A per-host limit may apply now
+            bandwidth.rebalance()
+
+    def record_first_byte(self):
+        now = time.monotonic()
+        self.first_byte = round(now - self.started, 2)
+        metrics.observe('ytdlp_dash_first_byte_seconds', now - self.started, since='job')
+        if not first_byte_since_startup.is_set():
+            first_byte_since_startup.set()
+            metrics.observe('ytdlp_dash_first_byte_seconds', now - APP_STARTED, since='startup')
+            logger.info(f"[{self.download_id}] First byte {now - APP_STARTED:.2f}s after startup "
+                        f"({self.first_byte:.2f}s after the job started)")
+
+    def bandwidth_share(self):
+        return bandwidth.shares.get(self.download_id)
+
+    def track_file(self, path):
+        if path:
+            self.files.add(path)
+
+    def remove_partial_files(self):
+        """Delete the .part/.ytdl/fragment/.temp files of the tracked files"""
+        for path in self.files:
+            candidates = [path + '.part', path + '.ytdl', prepend_extension(path, 'temp')]
+            candidates += glob.glob(glob.escape(path) + '.part-Frag*')
+            for candidate in candidates:
+                try:
+                    os.remove(candidate)
+                    logger.info(f"[{self.download_id}] Removed partial file {candidate}")
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logger.warning(f"[{self.download_id}] Could not remove {candidate}: {e}")
+
+
+class PipeReporter:
+    """JobReporter stand-in for a job running in a worker process.
+
+    Forwards updates to the parent process, which owns download_status.
+    """
+
+    def __init__(self, conn, share):
+        self.conn = conn
+        self.share = share
+        self.files = set()
+
+    def update(self, fields, immediate=False):
+        self.conn.send(('update', fields, immediate))
+
+    def bandwidth_share(self):
+        return self.share.value or None
+
+    def track_file(self, path):
+        if path and path not in self.files:
+            self.files.add(path)
+            self.conn.send(('file', path))
+
+
+class ProgressLogger:
+    """yt-dlp's logger for a job, at the job's verbosity (one of JOB_LOG_LEVELS)"""
+
+    def __init__(self, download_id, reporter, level=JOB_LOG_LEVEL):
+        self.download_id = download_id
+        self.reporter = reporter
+        self.level = LOG_LEVELS.get(level.upper(), logging.INFO)
 
     def debug(self, msg):
-        # Log yt-dlp debug messages at INFO level so they appear in logs
-        # Filter out some noisy debug messages
-        if msg and not msg.startswith('[debug]'):
+        # yt-dlp sends its screen messages here too: [debug] output and progress
+        # lines are logged at DEBUG, the rest of the screen output at INFO
+        if not msg:
+            return
+        if msg.startswith('[debug]'):
+            if self.level <= logging.DEBUG:
+                logger.debug(f"[{self.download_id}] {msg}")
+            return
+        # yt-dlp reports fragment retries as screen messages
+        if FRAGMENT_ERROR_MESSAGE.search(msg):
+            fragment_errors(self.download_id)
+        if PROGRESS_LINE.match(msg):
+            # The progress hook already reports these
+            if self.level <= logging.DEBUG:
+                logger.debug(f"[{self.download_id}] {msg}")
+        elif self.level <= logging.INFO:
             logger.info(f"[{self.download_id}] {msg}")
 
     def warning(self, msg):
-        logger.warning(f"[{self.download_id}] {msg}")
-        download_status[self.download_id]['warning'] = msg
+        if self.level <= logging.WARNING:
+            logger.warning(f"[{self.download_id}] {msg}")
+        if FRAGMENT_ERROR_MESSAGE.search(msg):
+            fragment_errors(self.download_id)
+        self.reporter.update({'warning': msg})
 
     def error(self, msg):
         logger.error(f"[{self.download_id}] {msg}")
-        download_status[self.download_id]['error'] = msg
-        download_status[self.download_id]['status'] = 'error'
+        self.reporter.update({'error': msg, 'status': 'error'})
+
+def postprocessor_hook(d, download_id, reporter):
+    """Hook called when a postprocessor starts or finishes"""
+    if download_id in cancelled_downloads:
+        raise Exception('Download cancelled by user')
+    reporter.track_file(d['info_dict'].get('filepath'))
+
+    end_phase(download_id, 'extraction')
+    name = d.get('postprocessor')
+    profile = job_profiles.get(download_id)
+    if d['status'] == 'started':
+        start_phase(download_id, f'pp:{name}')
+        if profile:
+            profile.begin(f'postprocessor:{name}')
+    elif d['status'] == 'finished':
+        if profile:
+            profile.end(f'postprocessor:{name}')
+        elapsed = end_phase(download_id, f'pp:{name}', 'ytdlp_dash_postprocessor_seconds', postprocessor=name)
+        if name == 'Merger' and elapsed is not None:
+            metrics.observe('ytdlp_dash_job_phase_seconds', elapsed, phase='merge')
+
+class FragmentTuningPP(PostProcessor):
+    """Set the fragment concurrency (and downloader) of each video before it downloads"""
+
+    def __init__(self, download_id, reporter, downloader=None):
+        super().__init__(downloader)
+        self.download_id = download_id
+        self.reporter = reporter
+        self.running = None
+
+    def run(self, info):
+        fragmented = [f for f in info.get('requested_formats') or [info] if f.get('protocol') in FRAGMENTED_PROTOCOLS]
+        if not fragmented:
+            fragment_jobs.pop(self.download_id, None)
+            return [], info
+        host = urllib.parse.urlsplit(fragmented[0].get('fragment_base_url') or fragmented[0].get('url') or '').hostname or ''
+        if self.running is None:
+            # Once per job: playlist entries don't each query the store
+            self.running = job_store.count_by_status().get('downloading', 0)
+        level = fragment_tuner.concurrency(host, self.running)
+        params = self._downloader.params
+        params['concurrent_fragment_downloads'] = level
+        if FRAGMENT_DOWNLOADER == 'aria2c' and shutil.which('aria2c'):
+            params['external_downloader'] = {'dash': 'aria2c', 'm3u8': 'aria2c'}
+            params['external_downloader_args'] = {'aria2c': [f'-j{level}']}
+        fragment_jobs[self.download_id] = {'host': host, 'concurrency': level, 'throttled': False}
+        logger.info(f"[{self.download_id}] Downloading {level} fragment(s) at a time from {host}")
+        self.reporter.update({'fragment_concurrency': level})
+        return [], info
+
+
+def fragment_errors(download_id):
+    """Lower the concurrency of a host that started failing fragment requests"""
+    tuning = fragment_jobs.get(download_id)
+    if tuning is None or tuning['throttled']:
+        return
+    tuning['throttled'] = True
+    ceiling = fragment_tuner.throttled(tuning['host'], tuning['concurrency'])
+    logger.warning(f"[{download_id}] {tuning['host']} is failing fragment requests; "
+                   f"using at most {ceiling} at a time for the next {FRAGMENT_BACKOFF}s")
+
+
+def throttle(download_id, d, rate):
+    """Hold the download thread back so the job stays within its bandwidth share.
+
+    With concurrent fragment downloads, several threads report the job's
+    total at once, not always in order. Each report books the bytes added
+    since the last one under the job's lock, and every thread waits for the
+    booked total, so together they stay within the share.
+    """
+    if rate is None:
+        throttle_state.pop(download_id, None)
+        return
+    now = time.monotonic()
+    downloaded = d.get('downloaded_bytes') or 0
+    with throttle_locks.setdefault(download_id, threading.Lock()):
+        state = throttle_state.get(download_id)
+        if state is None or state[2] != d.get('filename'):
+            throttle_state[download_id] = (now, downloaded, d.get('filename'))
+            return
+        allowed = state[0]
+        if downloaded > state[1]:
+            allowed += (downloaded - state[1]) / rate
+            # Unused share only carries over up to BANDWIDTH_BURST seconds
+            throttle_state[download_id] = (max(allowed, now - BANDWIDTH_BURST), downloaded, d.get('filename'))
+    while allowed > time.monotonic():
+        if download_id in cancelled_downloads:
+            raise Exception('Download cancelled by user')
+        time.sleep(max(min(allowed - time.monotonic(), 0.5), 0))
+
 
-def progress_hook(d, download_id):
+def progress_hook(d, download_id, reporter):
     """Hook to track download progress"""
     # Check if this download was cancelled
     if download_id in cancelled_downloads:
         raise Exception('Download cancelled by user')
 
+    reporter.track_file(d.get('filename'))
+    end_phase(download_id, 'extraction')
     if d['status'] == 'downloading':
-        download_status[download_id].update({
+        host = urllib.parse.urlsplit(d.get('info_dict', {}).get('url') or '').hostname
+        if host and job_hosts.get(download_id) != host:
+            job_hosts[download_id] = host
+            reporter.update({'host': host})
+        throttle(download_id, d, reporter.bandwidth_share())
+
+        # yt-dlp calls this for every chunk; only keep a sample now and then
+        now = time.monotonic()
+        downloaded = d.get('downloaded_bytes') or 0
+        last_time, last_bytes, last_file = progress_sampled.get(download_id, (0, 0, None))
+        if now - last_time < PROGRESS_INTERVAL:
+            return
+        progress_sampled[download_id] = (now, downloaded, d.get('filename'))
+
+        reporter.update({
             'status': 'downloading',
-            'percent': d.get('_percent_str', 'N/A'),
-            'speed': d.get('_speed_str', 'N/A'),
-            'eta': d.get('_eta_str', 'N/A'),
-            'downloaded': d.get('_downloaded_bytes_str', 'N/A'),
-            'total': d.get('_total_bytes_str', 'N/A')
+            'downloaded_bytes': downloaded,
+            'total_bytes': d.get('total_bytes') or d.get('total_bytes_estimate'),
+            'speed_bytes': d.get('speed'),
+            # yt-dlp's speed is averaged over the whole file; the bandwidth
+            # scheduler needs the current rate
+            'rate_bytes': ((downloaded - last_bytes) / (now - last_time)
+                           if last_file == d.get('filename') and downloaded >= last_bytes else None),
+            'eta_seconds': d.get('eta')
         })
     elif d['status'] == 'finished':
-        download_status[download_id].update({
+        # No 'elapsed' when the file was already there and nothing was fetched
+        if d.get('elapsed') is not None:
+            metrics.observe('ytdlp_dash_job_phase_seconds', d['elapsed'], phase='download')
+            metrics.inc('ytdlp_dash_downloaded_bytes_total', d.get('total_bytes') or d.get('downloaded_bytes') or 0)
+            tuning = fragment_jobs.get(download_id)
+            size = d.get('total_bytes') or 0
+            # Throughput under a bandwidth share or with errors says nothing about the concurrency
+            if (tuning and not tuning['throttled'] and d['elapsed'] > 0 and size >= FRAGMENT_MIN_SAMPLE
+                    and d.get('info_dict', {}).get('protocol') in FRAGMENTED_PROTOCOLS
+                    and reporter.bandwidth_share() is None):
+                fragment_tuner.record(tuning['host'], tuning['concurrency'], size / d['elapsed'])
+        reporter.update({
             'status': 'processing',
             'message': 'Processing download...'
-        })
+        }, immediate=True)
 
 def generate_nfo_file(info, filepath, download_id):
     """Generate a Kodi-compatible NFO file from video metadata"""
@@ -142,94 +1971,953 @@ def generate_nfo_file(info, filepath, download_id):
 </movie>
 '''
 
-        with open(nfo_path, 'w', encoding='utf-8') as f:
-            f.write(nfo_content)
+        with open(nfo_path, 'w', encoding='utf-8') as f:
+            f.write(nfo_content)
+
+        logger.info(f"[{download_id}] Generated NFO file: {nfo_path}")
+        return nfo_path
+
+    except Exception as e:
+        logger.error(f"[{download_id}] Failed to generate NFO file: {e}")
+        return None
+
+
+def postprocess_later(options):
+    """Return the postprocessors that run in the postprocessing stage"""
+    # The subtitle/thumbnail convertors need yt-dlp's in-download file bookkeeping
+    return [pp for pp in options.get('postprocessors') or []
+            if pp.get('when', 'post_process') in POSTPROCESS_STAGE_WHEN
+            and pp.get('key') not in ('FFmpegSubtitlesConvertor', 'FFmpegThumbnailsConvertor')]
+
+
+def ytdlp_options(download_id, download_dir, options, reporter):
+    # A verbose custom flag asks for yt-dlp's debug output
+    log_level = options.get('_log_level') or ('debug' if options.get('verbose') else JOB_LOG_LEVEL)
+    ydl_opts = {
+        'outtmpl': os.path.join(download_dir, '%(title)s.%(ext)s'),
+        'progress_hooks': [lambda d: progress_hook(d, download_id, reporter)],
+        'postprocessor_hooks': [lambda d: postprocessor_hook(d, download_id, reporter)],
+        'logger': ProgressLogger(download_id, reporter, log_level),
+        # yt-dlp only produces its [debug] output when verbose
+        'verbose': log_level == 'debug',
+    }
+
+    # Merge user options (_log_level is ours, like _generate_nfo)
+    ydl_opts.update((key, value) for key, value in options.items() if key != '_log_level')
+    return ydl_opts
+
+
+def downloaded_videos(info):
+    """Return the info dicts of the videos a download covered (one per playlist entry)"""
+    if info.get('_type') == 'playlist':
+        return [video for entry in info.get('entries') or [] if entry for video in downloaded_videos(entry)]
+    return [info]
+
+
+def downloaded_files(info):
+    """Return the info dicts of the files a download produced (one per format/entry)"""
+    return [download for video in downloaded_videos(info) for download in video.get('requested_downloads') or [video]]
+
+
+# Codecs each container takes as a plain stream copy: (video, audio), None = any
+CONTAINER_CODECS = {
+    'mkv': (None, None),
+    'mp4': (('avc1', 'avc3', 'h264', 'hev1', 'hvc1', 'hevc', 'h265', 'av01', 'vp09', 'vp9'),
+            ('mp4a', 'aac', 'mp3', 'ac-3', 'ec-3', 'alac')),
+    'mov': (('avc1', 'avc3', 'h264', 'hev1', 'hvc1', 'hevc', 'h265'), ('mp4a', 'aac', 'mp3', 'alac')),
+    'webm': (('vp8', 'vp09', 'vp9', 'av01'), ('opus', 'vorbis')),
+}
+# Source codecs FFmpegExtractAudio copies instead of re-encoding, per target
+AUDIO_COPY_CODECS = {
+    'm4a': ('mp4a', 'aac'),
+    'aac': ('mp4a', 'aac'),
+    'mp3': ('mp3',),
+    'opus': ('opus',),
+    'vorbis': ('vorbis',),
+    'flac': ('flac',),
+    'alac': ('alac',),
+}
+
+
+def codec_name(codec):
+    """'avc1.640028' -> 'avc1'; None when the codec is unknown"""
+    return codec.split('.')[0].lower() if codec else None
+
+
+def codecs_fit(formats, container):
+    """Whether all streams of `formats` can be copied into `container`"""
+    video_codecs, audio_codecs = CONTAINER_CODECS.get(container, ((), ()))
+    for f in formats:
+        for codec, allowed in ((f.get('vcodec'), video_codecs), (f.get('acodec'), audio_codecs)):
+            codec = codec_name(codec)
+            if codec != 'none' and allowed is not None and codec not in allowed:
+                return False
+    return True
+
+
+def codecs_known(formats):
+    """Whether the extractor reported the codecs of all `formats`"""
+    return all(f.get('vcodec') and f.get('acodec') for f in formats)
+
+
+def describe_formats(formats):
+    """'vp9+opus', or the file extensions when the codecs are unknown"""
+    if not codecs_known(formats):
+        return '+'.join(f.get('ext') or '?' for f in formats)
+    return '+'.join(codec_name(c) for f in formats
+                    for c in (f.get('vcodec'), f.get('acodec')) if codec_name(c) != 'none')
+
+
+def select_format(ydl, info, spec):
+    """Return the formats `spec` picks from a probed video, or None"""
+    formats = info.get('formats') or []
+    try:
+        selected = list(ydl.build_format_selector(spec)({
+            'formats': formats,
+            'has_merged_format': any('none' not in (f.get('acodec'), f.get('vcodec')) for f in formats),
+            'incomplete_formats': (all(f.get('vcodec') == 'none' for f in formats)
+                                   or all(f.get('acodec') == 'none' for f in formats)),
+        }))
+    except Exception:
+        return None
+    return (selected[0].get('requested_formats') or [selected[0]]) if selected else None
+
+
+def restrict_format_spec(spec, video_codecs, audio_codecs):
+    """Add codec filters to every bestvideo/bestaudio/best... selector in `spec`"""
+    vfilter = f"[vcodec~='^({'|'.join(video_codecs)})']" if video_codecs else ''
+    afilter = f"[acodec~='^({'|'.join(audio_codecs)})']" if audio_codecs else ''
+
+    def add_filters(match):
+        # Filters go after the '*' of bestvideo*; yt-dlp matches nothing otherwise
+        name = match.group(0)
+        if name.rstrip('*').endswith('video'):
+            return name + vfilter
+        if name.rstrip('*').endswith('audio'):
+            return name + afilter
+        return name + vfilter + afilter
+
+    return re.sub(r'\b(?:best|worst)(?:video|audio)?\b\*?', add_filters, spec)
+
+
+def plan_conversion(ydl, info, options, pinned=False):
+    """Pick the cheapest way to the requested container or audio codec.
+
+    Looks at the formats of a probed video and prefers, in order: nothing to
+    do, picking formats that are already in a fitting codec, merging or
+    remuxing into the target container (stream copies). The re-encoding
+    FFmpegVideoConvertor/FFmpegExtractAudio steps are only kept when nothing
+    else gives the same quality. With `pinned` (a formatId), the chosen
+    streams are kept. Returns (options, conversion), where
+    conversion = {'path': none|merge|remux|copy|transcode, 'detail': ...}.
+    """
+    options = dict(options)
+    postprocessors = list(options.get('postprocessors') or [])
+    convert = next((pp for pp in postprocessors if pp.get('key') == 'FFmpegVideoConvertor'), None)
+    extract = next((pp for pp in postprocessors if pp.get('key') == 'FFmpegExtractAudio'), None)
+    chosen = info.get('requested_formats') or [info]
+    spec = options.get('format') or 'bestvideo*+bestaudio/best'
+
+    if extract:
+        # Audio-only output: a video container conversion would be wasted work
+        if convert:
+            postprocessors.remove(convert)
+        options['postprocessors'] = postprocessors
+        target = extract.get('preferredcodec') or 'best'
+        codecs = AUDIO_COPY_CODECS.get(target, ())
+        source = next((codec_name(f.get('acodec')) for f in chosen if codec_name(f.get('acodec')) != 'none'), None)
+        if target == 'best' or source in codecs:
+            return options, {'path': 'copy', 'detail': f'{source or "audio"} stream kept as is'}
+        if source is None:
+            # FFmpegExtractAudio still copies when ffprobe finds a fitting codec
+            return options, {'path': 'transcode', 'detail': f'source codec unknown, converting to {target} if needed'}
+        if codecs and not pinned:
+            audio_spec = f"bestaudio[acodec~='^({'|'.join(codecs)})']"
+            picked = select_format(ydl, info, audio_spec)
+            if picked:
+                options['format'] = f'{audio_spec}/{spec}'
+                return options, {'path': 'copy', 'detail': f'picked the {describe_formats(picked)} stream instead of {source}'}
+        return options, {'path': 'transcode', 'detail': f'no {target} source stream, converting from {source}'}
+
+    if not convert:
+        return options, None
+    target = convert.get('preferedformat')
+    if target not in CONTAINER_CODECS:
+        return options, {'path': 'transcode', 'detail': f'{target} needs a re-encode'}
+
+    if not codecs_known(chosen) and CONTAINER_CODECS[target] != (None, None):
+        # Nothing to plan with; FFmpegVideoConvertor skips files already in the target
+        if len(chosen) == 1 and chosen[0].get('ext') == target:
+            return options, {'path': 'none', 'detail': f'already {target}'}
+        return options, {'path': 'transcode', 'detail': f'source codecs unknown ({describe_formats(chosen)})'}
+
+    detail = f'{describe_formats(chosen)} copied into {target}'
+    if not codecs_fit(chosen, target):
+        if pinned:
+            return options, {'path': 'transcode', 'detail': f'{describe_formats(chosen)} (format {spec}) cannot be copied into {target}'}
+        video_codecs, audio_codecs = CONTAINER_CODECS[target]
+        picked = select_format(ydl, info, restrict_format_spec(spec, video_codecs, audio_codecs))
+        height = max((f.get('height') or 0 for f in chosen), default=0)
+        if not picked or not codecs_fit(picked, target) or max((f.get('height') or 0 for f in picked), default=0) < height:
+            return options, {'path': 'transcode', 'detail': f'{describe_formats(chosen)} cannot be copied into {target}'}
+        options['format'] = f'{restrict_format_spec(spec, video_codecs, audio_codecs)}/{spec}'
+        detail = f'picked {describe_formats(picked)} instead of {describe_formats(chosen)}'
+        chosen = picked
+
+    postprocessors.remove(convert)
+    if len(chosen) > 1:
+        # The merger writes the target container directly, copying the streams
+        options['merge_output_format'] = target
+        path = 'merge'
+    elif chosen[0].get('ext') == target:
+        path = 'none'
+    else:
+        postprocessors.append({'key': 'FFmpegVideoRemuxer', 'preferedformat': target})
+        path = 'remux'
+    options['postprocessors'] = postprocessors
+    return options, {'path': path, 'detail': detail}
+
+
+def create_ydl(download_id, ydl_opts):
+    """Create a governed YoutubeDL; for profiled jobs, time its construction and prepare_filename()"""
+    started = time.monotonic()
+    profile = job_profiles.get(download_id)
+    with profile.span('YoutubeDL()') if profile else contextlib.nullcontext():
+        ydl = govern(extractor_registry.create(ydl_opts), download_id)
+    metrics.observe('ytdlp_dash_setup_seconds', time.monotonic() - started, step='youtubedl')
+    if profile is None:
+        return ydl
+    prepare_filename = ydl.prepare_filename
+
+    def timed_prepare_filename(*args, **kwargs):
+        with profile.span('prepare_filename'):
+            return prepare_filename(*args, **kwargs)
+
+    ydl.prepare_filename = timed_prepare_filename
+    return ydl
+
+
+def download_stage(download_id, reporter, url, options, download_dir):
+    """Download (and merge) the media, leaving conversions for postprocess_stage.
+
+    Single videos that need a conversion are probed first, so plan_conversion
+    can avoid re-encoding. Single videos extracted recently (by a probe or a
+    listing) are downloaded from the info cache. Returns the sanitized info
+    dict, so it can cross process boundaries, and the options as adjusted by
+    the plan.
+    """
+    info = conversion = None
+    pinned = options.pop('_format_pinned', False)
+    # The cache holds videos, so it can only stand in for single-video jobs
+    cached = info_cache.get(url, options) if options.get('noplaylist') else None
+    start_phase(download_id, 'extraction')
+    if any(pp.get('key') in ('FFmpegVideoConvertor', 'FFmpegExtractAudio') for pp in options.get('postprocessors') or []):
+        if options.get('noplaylist'):
+            with create_ydl(download_id, ytdlp_options(download_id, download_dir, dict(options, postprocessors=[]), reporter)) as probe:
+                if cached is not None:
+                    logger.info(f"[{download_id}] Planning the conversion from cached info...")
+                    with job_span(download_id, 'process_ie_result (probe)'):
+                        info = probe.process_ie_result(cached, download=False)
+                else:
+                    logger.info(f"[{download_id}] Probing formats to plan the conversion...")
+                    with job_span(download_id, 'extract_info'):
+                        info = probe.extract_info(url, download=False)
+                    info_cache.put(url, options, probe, info)
+                end_phase(download_id, 'extraction')
+                if info and info.get('_type', 'video') == 'video':
+                    options, conversion = plan_conversion(probe, info, options, pinned)
+                else:
+                    info = None
+        if conversion is None:
+            conversion = {'path': 'transcode', 'detail': 'not planned for playlists'}
+        logger.info(f"[{download_id}] Conversion: {conversion['path']} ({conversion['detail']})")
+        reporter.update({'conversion': conversion})
+
+    ydl_opts = ytdlp_options(download_id, download_dir, options, reporter)
+    later = postprocess_later(options)
+    ydl_opts['postprocessors'] = [pp for pp in options.get('postprocessors') or [] if pp not in later]
+
+    if ydl_opts['logger'].level <= logging.DEBUG:
+        logger.debug(f"[{download_id}] yt-dlp options: {json.dumps(ydl_opts, default=str)}")
+
+    with create_ydl(download_id, ydl_opts) as ydl:
+        if not {'concurrent_fragment_downloads', 'external_downloader'} & set(options):
+            ydl.add_post_processor(FragmentTuningPP(download_id, reporter), when='before_dl')
+        if info is None and cached is not None:
+            logger.info(f"[{download_id}] Using cached info, skipping extraction")
+            info = cached
+        if info is not None:
+            # Reuse the probe: select formats again with the planned options
+            for key in ('requested_formats', 'requested_downloads'):
+                info.pop(key, None)
+            try:
+                with job_span(download_id, 'process_ie_result (download)'):
+                    info = ydl.process_ie_result(info, download=True)
+            except yt_dlp.utils.DownloadError as e:
+                if cached is None or THROTTLED_ERROR.search(str(e)):
+                    raise
+                # The media URLs in the cached info may have expired
+                logger.warning(f"[{download_id}] Download from cached info failed, extracting again: {e}")
+                info_cache.discard(url, options)
+                # ProgressLogger.error() marked the job as failed
+                reporter.update({'status': 'starting', 'error': None,
+                                 'message': 'Cached info is out of date, extracting again...'}, immediate=True)
+                info = None
+        if info is None:
+            logger.info(f"[{download_id}] Extracting info from URL...")
+            with job_span(download_id, 'extract_info (download)'):
+                info = ydl.extract_info(url, download=True)
+            if options.get('noplaylist'):
+                info_cache.put(url, options, ydl, info)
+        return ydl.sanitize_info(info), options
+
+
+def postprocess_stage(download_id, reporter, info, options, download_dir):
+    """Run the deferred postprocessors (conversions, metadata, embedding) on a download"""
+    ydl_opts = ytdlp_options(download_id, download_dir, options, reporter)
+    ydl_opts['postprocessors'] = postprocess_later(options)
+
+    with create_ydl(download_id, ydl_opts) as ydl:
+        for video in downloaded_videos(info):
+            for download in video.get('requested_downloads') or [video]:
+                if not download.get('filepath'):
+                    continue
+                # yt-dlp drops the fields a download shares with its video
+                # (title, ext, ...) from requested_downloads; the pps need them
+                full = {k: v for k, v in video.items() if k not in ('requested_downloads', 'requested_formats')}
+                full.update(download)
+                full = ydl.run_all_pps('post_process', full)
+                full = ydl.run_all_pps('after_move', full)
+                full.pop('__files_to_move', None)
+                download.update(full)
+    return info
+
+
+class JobProcessError(Exception):
+    """A job failed inside its worker process"""
+
+    def __init__(self, message, trace):
+        super().__init__(message)
+        self.traceback = trace
+
+
+def job_process_main(conn, share):
+    """Entry point of a job's worker process (EXECUTION_MODE=process)"""
+    # Own process group, so cancelling can kill ffmpeg children too
+    os.setsid()
+    try:
+        if not conn.poll():
+            # A spare process: get ready while waiting for a job
+            extractor_registry.warm()
+        stage, download_id, args = conn.recv()
+    except EOFError:
+        # The app exited before handing out this spare
+        return
+    conn.send(('started',))
+    try:
+        conn.send(('done', stage(download_id, PipeReporter(conn, share), *args)))
+    except HostThrottled as e:
+        conn.send(('throttled', e.host, e.until))
+    except Exception as e:
+        conn.send(('failed', str(e), traceback.format_exc()))
+    finally:
+        metrics.flush()
+        conn.close()
+
+
+class JobProcessPool:
+    """Job processes started ahead of time (EXECUTION_MODE=process).
+
+    A new process spends a second or more starting Python and importing
+    yt-dlp before a job can begin; a spare has done that, and warmed the
+    extractors, while it waited. Every process still runs a single job
+    stage and exits, so nothing carries over from one job to the next.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.lock = threading.Lock()
+        self.spares = collections.deque()
+
+    def spawn(self):
+        parent_conn, child_conn = job_process_context.Pipe()
+        # The job's bandwidth share, kept up to date by the bandwidth scheduler
+        share = job_process_context.Value('d', 0.0, lock=False)
+        process = job_process_context.Process(
+            target=job_process_main, args=(child_conn, share), name='job-process', daemon=True
+        )
+        process.start()
+        child_conn.close()
+        return process, parent_conn, share
+
+    def take(self):
+        """A spare process (replacing it), or a new one if there is none"""
+        with self.lock:
+            while self.spares:
+                process, conn, share = self.spares.popleft()
+                if process.is_alive():
+                    self.spares.append(self.spawn())
+                    return process, conn, share
+                conn.close()
+        return self.spawn()
+
+    def fill(self):
+        with self.lock:
+            while len(self.spares) < self.size:
+                self.spares.append(self.spawn())
+
+
+job_processes = JobProcessPool(JOB_PROCESS_SPARES)
+
+
+def run_in_process(stage, download_id, reporter, *args):
+    """Run a job stage in its own process, relaying its updates to `reporter`.
+
+    A cancelled job's process group is killed right away instead of waiting
+    for the next progress hook call.
+    """
+    started = time.monotonic()
+    process, parent_conn, share = job_processes.take()
+    share.value = bandwidth.shares.get(download_id) or 0.0
+    bandwidth.attach(download_id, share)
+    parent_conn.send((stage, download_id, args))
+    try:
+        while True:
+            if download_id in cancelled_downloads:
+                try:
+                    os.killpg(process.pid, signal.SIGKILL)
+                except OSError:
+                    process.kill()
+                raise Exception('Download cancelled by user')
+
+            if not parent_conn.poll(0.2):
+                if not process.is_alive() and not parent_conn.poll():
+                    raise Exception(f'Worker process exited with code {process.exitcode}')
+                continue
+            message = parent_conn.recv()
+            if message[0] == 'started':
+                metrics.observe('ytdlp_dash_setup_seconds', time.monotonic() - started, step='job_process')
+            elif message[0] == 'update':
+                reporter.update(message[1], immediate=message[2])
+            elif message[0] == 'file':
+                reporter.track_file(message[1])
+            elif message[0] == 'done':
+                return message[1]
+            elif message[0] == 'failed':
+                raise JobProcessError(message[1], message[2])
+            elif message[0] == 'throttled':
+                raise HostThrottled(message[1], message[2])
+    finally:
+        process.join(timeout=5)
+        parent_conn.close()
+
+
+def profile_path(download_id, name):
+    return os.path.join(PROFILE_DIR, os.path.basename(download_id), name)
+
+
+def profiled_stage(download_id, reporter, stage, *args):
+    """Run a job stage under cProfile, recording spans along the way.
+
+    The stats go to PROFILE_DIR/<id>/<stage>.prof and the spans to
+    <stage>.json next to them. Only the thread running the stage is
+    profiled, so other jobs are not slowed down.
+    """
+    name = stage.__name__.replace('_stage', '')
+    profile = job_profiles[download_id] = JobProfile()
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError as e:
+        # Only one cProfile can be active at a time on Python 3.12+
+        logger.warning(f"[{download_id}] cProfile unavailable, recording spans only: {e}")
+        profiler = None
+    try:
+        return stage(download_id, reporter, *args)
+    finally:
+        if profiler:
+            profiler.disable()
+        job_profiles.pop(download_id, None)
+        try:
+            os.makedirs(os.path.dirname(profile_path(download_id, name)), exist_ok=True)
+            if profiler:
+                profiler.dump_stats(profile_path(download_id, f'{name}.prof'))
+            with open(profile_path(download_id, f'{name}.json'), 'w') as f:
+                json.dump({'seconds': round(time.monotonic() - profile.started, 4), 'spans': profile.spans}, f)
+            logger.info(f"[{download_id}] Saved {name} profile")
+        except OSError as e:
+            logger.error(f"[{download_id}] Could not save {name} profile: {e}")
+
+
+def prune_job_logs():
+    """Remove the logs of jobs that are no longer in the job store"""
+    for name in os.listdir(JOB_LOG_DIR):
+        if name.endswith('.log') and job_store.get(name[:-len('.log')]) is None:
+            try:
+                os.remove(os.path.join(JOB_LOG_DIR, name))
+            except OSError as e:
+                logger.warning(f"Could not remove job log {name}: {e}")
+
+
+def prune_profiles():
+    """Remove the profiles of jobs that are no longer in the job store"""
+    if not os.path.isdir(PROFILE_DIR):
+        return
+    for download_id in os.listdir(PROFILE_DIR):
+        if job_store.get(download_id) is None:
+            shutil.rmtree(os.path.join(PROFILE_DIR, download_id), ignore_errors=True)
+
+
+def run_stage(stage, download_id, reporter, *args):
+    """Run a job stage in this thread or in a worker process, per EXECUTION_MODE"""
+    if download_status.get(download_id, {}).get('profiled'):
+        stage, args = profiled_stage, (stage,) + args
+    if EXECUTION_MODE == 'process':
+        return run_in_process(stage, download_id, reporter, *args)
+    return stage(download_id, reporter, *args)
+
+
+def complete_download(download_id, info, download_dir, generate_nfo):
+    """Record a finished download and mark its job completed"""
+    # A cancel may reach a job after its last progress hook (extraction,
+    # ffmpeg) or through another worker process before sync_cancellations()
+    if download_id in cancelled_downloads or job_store.cancel_requested(download_id):
+        cancelled_downloads.add(download_id)
+        raise Exception('Download cancelled by user')
+    files = downloaded_files(info)
+    filename = files[-1].get('filepath') or files[-1].get('_filename') or ''
+
+    # Check if file actually exists
+    if not os.path.exists(filename):
+        logger.warning(f"[{download_id}] Expected file not found at {filename}, checking directory...")
+        # List all files in the directory to help debug
+        if os.path.exists(download_dir):
+            files = os.listdir(download_dir)
+            logger.info(f"[{download_id}] Files in {download_dir}: {files}")
+
+    # Generate NFO file if requested
+    if generate_nfo and info:
+        generate_nfo_file(info, filename, download_id)
+
+    if info:
+        record_archive(info, download_dir, filename)
+    file_catalog.track(download_dir)
+
+    logger.info(f"[{download_id}] Download completed successfully: {filename}")
+
+    finish_job(
+        download_id,
+        status='completed',
+        message=f'Download completed: {os.path.basename(filename)}',
+        filename=os.path.basename(filename),
+        full_path=filename
+    )
+
+
+def fail_download(download_id, reporter, e):
+    """Mark a job failed or cancelled; call from the `except` block that caught `e`"""
+    error_msg = str(e)
+    error_trace = getattr(e, 'traceback', None) or traceback.format_exc()
+    logger.error(f"[{download_id}] Download failed: {error_msg}")
+    logger.error(f"[{download_id}] Traceback: {error_trace}")
+
+    if download_id in cancelled_downloads:
+        reporter.remove_partial_files()
+        finish_job(download_id, status='cancelled', message='Cancelled by user')
+    else:
+        url = (get_job(download_id) or {}).get('url')
+        metrics.inc('ytdlp_dash_job_errors_total', extractor=extractor_name(url) if url else 'unknown')
+        finish_job(download_id, status='error', error=error_msg, traceback=error_trace)
+
+
+def download_video(url, options, download_id, download_dir):
+    """Background task to download video.
+
+    Runs the download stage in the calling download worker. Jobs with
+    conversions left to do are then handed to the postprocessing workers,
+    which frees the download slot for the next job.
+    """
+    reporter = JobReporter(download_id)
+    try:
+        job = job_store.get(download_id) or {'url': url, 'directory': download_dir}
+        if job.get('queued'):
+            waited = (datetime.now() - datetime.fromisoformat(job['queued'])).total_seconds()
+            metrics.observe('ytdlp_dash_job_phase_seconds', max(waited, 0), phase='queue')
+        job.update({
+            'status': 'starting',
+            'stage': 'download',
+            'message': 'Starting download...',
+            'started': datetime.now().isoformat()
+        })
+        download_status[download_id] = job
+        save_job(download_id, job)
+        logger.info(f"[{download_id}] Starting download of {url} to {download_dir}")
+
+        # Extract NFO flag before passing to yt-dlp (it's not a valid yt-dlp option)
+        generate_nfo = options.pop('_generate_nfo', False)
+        if options.pop('_profile', False):
+            reporter.update({'profiled': True})
+        weight = options.pop('_bandwidth_weight', None) or (1 if job.get('batch_id') else INTERACTIVE_BANDWIDTH_WEIGHT)
+
+        started = time.monotonic()
+        bandwidth.register(download_id, weight, options.get('ratelimit'))
+        try:
+            info, options = run_stage(download_stage, download_id, reporter, url, options, download_dir)
+        finally:
+            bandwidth.unregister(download_id)
+        timings = {'download': round(time.monotonic() - started, 2)}
+        if reporter.first_byte is not None:
+            timings['first_byte'] = reporter.first_byte
+
+        if not postprocess_later(options):
+            reporter.update({'timings': timings})
+            complete_download(download_id, info, download_dir, generate_nfo)
+            return
+
+        reporter.update({
+            'status': 'processing',
+            'stage': 'postprocess_wait',
+            'message': 'Waiting for a postprocessing slot',
+            'postprocess_queue': postprocess_queue.qsize(),
+            'timings': timings
+        }, immediate=True)
+        postprocess_queue.put((download_id, reporter, info, options, download_dir, generate_nfo, time.monotonic()))
+    except Exception as e:
+        throttled = isinstance(e, HostThrottled) or THROTTLED_ERROR.search(str(e))
+        deferrals = (download_status.get(download_id) or {}).get('deferrals', 0)
+        if throttled and download_id not in cancelled_downloads and deferrals < DOMAIN_MAX_DEFERRALS:
+            if not isinstance(e, HostThrottled):
+                # Throttling the governor didn't see (extractor errors, external
+                # downloaders) blocks the job's site
+                host = site_host(url)
+                e = HostThrottled(host, domain_governor.throttled(host))
+            defer_job(download_id, e.host, e.until)
+        else:
+            fail_download(download_id, reporter, e)
+
+
+def postprocess_download(download_id, reporter, info, options, download_dir, generate_nfo, queued_at):
+    """Run the postprocessing stage of a job handed over by download_video()"""
+    try:
+        if download_id in cancelled_downloads:
+            raise Exception('Download cancelled by user')
+        timings = dict(download_status[download_id].get('timings') or {})
+        timings['postprocess_wait'] = round(time.monotonic() - queued_at, 2)
+        metrics.observe('ytdlp_dash_job_phase_seconds', timings['postprocess_wait'], phase='postprocess_wait')
+        reporter.update({
+            'stage': 'postprocess',
+            'message': 'Postprocessing...',
+            'timings': timings
+        }, immediate=True)
+
+        started = time.monotonic()
+        info = run_stage(postprocess_stage, download_id, reporter, info, options, download_dir)
+        timings['postprocess'] = round(time.monotonic() - started, 2)
+        metrics.observe('ytdlp_dash_job_phase_seconds', timings['postprocess'], phase='postprocess')
+        reporter.update({'timings': timings})
+        complete_download(download_id, info, download_dir, generate_nfo)
+    except Exception as e:
+        fail_download(download_id, reporter, e)
+
+
+def enqueue_download(url, options, download_id, download_dir, priority=0):
+    """Persist a new job and add it to the server-side queue"""
+    job = {
+        'status': 'queued',
+        'message': 'Waiting for a free download slot',
+        'url': url,
+        'directory': download_dir,
+        'queued': datetime.now().isoformat()
+    }
+    job_store.create(download_id, job, options, priority)
+    event_broker.publish(download_id, job, immediate=True)
+    with job_available:
+        job_available.notify()
+    logger.info(f"[{download_id}] Queued (priority {priority})")
+
+
+def enqueue_batch(batch_id, videos, options, download_dir, priority=0):
+    """Persist a whole batch atomically, which queues all of its jobs"""
+    queued = datetime.now().isoformat()
+    jobs = [(f'{batch_id}_{i:05d}', {
+        'status': 'queued',
+        'message': 'Waiting for a free download slot',
+        'url': video['url'],
+        'title': video.get('title') or video['url'],
+        'directory': download_dir,
+        'batch_id': batch_id,
+        'queued': queued
+    }) for i, video in enumerate(videos, 1)]
+    # Videos with a formatId from /formats get their own options
+    job_options = {download_id: dict(options, format=str(video['formatId']), _format_pinned=True)
+                   for (download_id, _), video in zip(jobs, videos) if video.get('formatId')}
+    job_store.create_batch(batch_id, jobs, options, download_dir, priority, job_options)
+
+    # No per-job events here: the caller gets every id back in one response
+    with job_available:
+        job_available.notify_all()
+    logger.info(f"[{batch_id}] Queued batch of {len(jobs)} downloads (priority {priority})")
+    return [download_id for download_id, _ in jobs]
+
+
+def resume_interrupted_jobs():
+    """Re-queue jobs that were queued or running when the process stopped"""
+    resumed = 0
+    for download_id in job_store.ids_with_status(ACTIVE_STATES):
+        job = job_store.get(download_id)
+        if job['status'] != 'queued':
+            job.update({'status': 'queued', 'message': 'Resuming after restart'})
+            save_job(download_id, job)
+        resumed += 1
+    if resumed:
+        logger.info(f"Resumed {resumed} interrupted jobs from the job store")
+
+
+def download_worker():
+    """Run queued downloads one at a time for as long as the process lives"""
+    while True:
+        download_id = None
+        try:
+            # Cancelled jobs are no longer 'queued', so they are never claimed
+            download_id = job_store.claim_next()
+            if download_id is None:
+                with job_available:
+                    job_available.wait(QUEUE_POLL_INTERVAL)
+                continue
+            _, url, options, download_dir, _ = job_store.get_job_args(download_id)
+            download_video(url, options, download_id, download_dir)
+        except Exception as e:
+            logger.error(f"[{download_id}] Download worker error: {e}")
+            time.sleep(QUEUE_POLL_INTERVAL)
+
+
+def postprocess_worker():
+    """Run handed-over postprocessing one job at a time"""
+    while True:
+        download_id = None
+        try:
+            job = postprocess_queue.get()
+            download_id = job[0]
+            postprocess_download(*job)
+        except Exception as e:
+            # Keep the worker: a dead thread would shrink the pool for good
+            logger.error(f"[{download_id}] Postprocess worker error: {e}")
+
+
+def start_download_workers():
+    """Start the global download and postprocessing worker pools (once per process)"""
+    with download_workers_lock:
+        if download_workers:
+            return
+        for number in range(1, MAX_CONCURRENT_DOWNLOADS + 1):
+            download_workers.append(threading.Thread(
+                target=download_worker, name=f'download-worker-{number}', daemon=True
+            ))
+        for number in range(1, POSTPROCESS_WORKERS + 1):
+            download_workers.append(threading.Thread(
+                target=postprocess_worker, name=f'postprocess-worker-{number}', daemon=True
+            ))
+        for worker in download_workers:
+            worker.start()
+        if EXECUTION_MODE == 'process':
+            job_processes.fill()
+    logger.info(f"Download worker pool started with {MAX_CONCURRENT_DOWNLOADS} download "
+                f"and {POSTPROCESS_WORKERS} postprocessing workers")
+
+
+class FileCatalog:
+    """In-memory index of the files in the download directories.
+
+    Directories are rescanned with os.scandir when a download finishes there
+    and periodically by reconcile_loop(). /downloads only stats the
+    directories, so files deleted since the last scan (by /delete in another
+    process or outside the app) disappear from the next listing. Files in
+    download directories only show up for RECENT_FILE_DAYS; the default
+    download directory lists everything.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.directories = {}  # directory -> recent files only
+        self.files = {}  # directory -> {path: entry}
+        self.mtimes = {}  # directory -> mtime at the last scan
+        self.version = 0
+        self.sorted_cache = {}
+
+    def track(self, directory, recent_only=True):
+        """Add a directory to the catalog (if needed) and rescan it"""
+        with self.lock:
+            self.directories[directory] = self.directories.get(directory, False) or recent_only
+        self.scan(directory)
+
+    def scan(self, directory):
+        """Rescan one directory, bumping the version if anything changed"""
+        entries = {}
+        mtime = None
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+            with os.scandir(directory) as it:
+                for entry in it:
+                    try:
+                        if not entry.is_file():
+                            continue
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    entries[entry.path] = {
+                        'name': entry.name,
+                        'size': stat.st_size,
+                        'mtime': stat.st_mtime,
+                        'directory': directory,
+                        'path': entry.path
+                    }
+        except OSError:
+            pass
+
+        with self.lock:
+            self.mtimes[directory] = mtime
+            if self.files.get(directory) != entries:
+                self.files[directory] = entries
+                self.version += 1
+                self.sorted_cache.clear()
+
+    def remove(self, path):
+        with self.lock:
+            entries = self.files.get(os.path.dirname(path))
+            if entries and entries.pop(path, None) is not None:
+                self.version += 1
+                self.sorted_cache.clear()
+
+    def query(self, sort, reverse, offset, limit):
+        """Return (page of files, total, version) sorted by `sort`"""
+        # Deleting a file changes its directory's mtime
+        with self.lock:
+            directories = list(self.directories)
+        for directory in directories:
+            if self.changed(directory):
+                self.scan(directory)
+
+        cutoff = time.time() - RECENT_FILE_DAYS * 86400
+        with self.lock:
+            # The cutoff moves with time, so sorted listings expire hourly
+            hour = int(time.time() // 3600)
+            key = (sort, reverse, hour)
+            listing = self.sorted_cache.get(key)
+            if listing is None:
+                listing = [
+                    entry for directory, entries in self.files.items()
+                    for entry in entries.values()
+                    if not self.directories.get(directory) or entry['mtime'] >= cutoff
+                ]
+                sort_key = 'mtime' if sort == 'modified' else sort
+                listing.sort(key=lambda entry: entry[sort_key], reverse=reverse)
+                self.sorted_cache[key] = listing
+            version = f'{self.version}.{hour}'
+
+        files = [{
+            'name': entry['name'],
+            'size': entry['size'],
+            'modified': datetime.fromtimestamp(entry['mtime']).isoformat(),
+            'directory': entry['directory'],
+            'path': entry['path']
+        } for entry in listing[offset:offset + limit]]
+        return files, len(listing), version
+
+    def changed(self, directory):
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+        except OSError:
+            mtime = None
+        with self.lock:
+            if mtime is None:
+                return bool(self.files.get(directory))
+            return mtime != self.mtimes.get(directory)
+
+    def reconcile_loop(self):
+        """Pick up changes made by other processes or outside the app.
 
-        logger.info(f"[{download_id}] Generated NFO file: {nfo_path}")
-        return nfo_path
+        Directories whose mtime changed (files added, renamed or deleted) are
+        rescanned every CATALOG_POLL_INTERVAL, as are directories of jobs
+        completed in another worker process. Everything is rescanned every
+        FILE_CATALOG_INTERVAL to catch files changed in place.
+        """
+        last_full = time.monotonic()
+        last_check = time.time()
+        while True:
+            time.sleep(CATALOG_POLL_INTERVAL)
+            try:
+                check = time.time()
+                for directory in job_store.directories('completed', since=last_check - CATALOG_POLL_INTERVAL):
+                    if directory not in self.directories:
+                        self.track(directory)
+                last_check = check
 
-    except Exception as e:
-        logger.error(f"[{download_id}] Failed to generate NFO file: {e}")
-        return None
+                full = time.monotonic() - last_full >= FILE_CATALOG_INTERVAL
+                if full:
+                    last_full = time.monotonic()
+                with self.lock:
+                    directories = list(self.directories)
+                for directory in directories:
+                    if full or self.changed(directory):
+                        self.scan(directory)
+            except Exception as e:
+                logger.error(f"File catalog refresh failed: {e}")
 
 
-def download_video(url, options, download_id, download_dir):
-    """Background task to download video"""
-    try:
-        logger.info(f"[{download_id}] Starting download of {url} to {download_dir}")
-        logger.info(f"[{download_id}] Options: {json.dumps(options, indent=2)}")
+file_catalog = FileCatalog()
 
-        # Extract NFO flag before passing to yt-dlp (it's not a valid yt-dlp option)
-        generate_nfo = options.pop('_generate_nfo', False)
 
-        ydl_opts = {
-            'outtmpl': os.path.join(download_dir, '%(title)s.%(ext)s'),
-            'progress_hooks': [lambda d: progress_hook(d, download_id)],
-            'logger': ProgressLogger(download_id),
-            'verbose': True,  # Enable verbose logging for yt-dlp
-        }
+def sync_cancellations():
+    """Stop running jobs that were cancelled through another worker process"""
+    for download_id in job_store.cancel_requested_ids():
+        if download_id in download_status:
+            cancelled_downloads.add(download_id)
 
-        # Merge user options
-        ydl_opts.update(options)
 
-        logger.info(f"[{download_id}] Final yt-dlp options: {json.dumps(ydl_opts, indent=2, default=str)}")
+def run_scheduler():
+    """Run the download workers and job housekeeping in exactly one process.
 
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            logger.info(f"[{download_id}] Extracting info from URL...")
-            info = ydl.extract_info(url, download=True)
-
-            # Get the actual downloaded filename
-            filename = ydl.prepare_filename(info)
-
-            # For audio files, the extension might be different
-            if options.get('postprocessors'):
-                # Check if audio extraction was requested
-                for pp in options['postprocessors']:
-                    if pp.get('key') == 'FFmpegExtractAudio':
-                        # Replace extension with the actual audio format
-                        base_name = os.path.splitext(filename)[0]
-                        audio_ext = pp.get('preferredcodec', 'mp3')
-                        filename = f"{base_name}.{audio_ext}"
-                        logger.info(f"[{download_id}] Audio file expected at: {filename}")
-                    elif pp.get('key') == 'FFmpegVideoConvertor':
-                        # Replace extension with the requested format
-                        base_name = os.path.splitext(filename)[0]
-                        video_ext = pp.get('preferedformat', 'mp4')
-                        filename = f"{base_name}.{video_ext}"
-                        logger.info(f"[{download_id}] Video file expected at: {filename}")
-
-            # Check if file actually exists
-            if not os.path.exists(filename):
-                logger.warning(f"[{download_id}] Expected file not found at {filename}, checking directory...")
-                # List all files in the directory to help debug
-                if os.path.exists(download_dir):
-                    files = os.listdir(download_dir)
-                    logger.info(f"[{download_id}] Files in {download_dir}: {files}")
-
-            # Generate NFO file if requested
-            if generate_nfo and info:
-                generate_nfo_file(info, filename, download_id)
-
-            logger.info(f"[{download_id}] Download completed successfully: {filename}")
-
-            download_status[download_id].update({
-                'status': 'completed',
-                'message': f'Download completed: {os.path.basename(filename)}',
-                'filename': os.path.basename(filename),
-                'full_path': filename
-            })
+    Under a multi-process server every worker process imports the app. The
+    first one to lock DATA_DIR/scheduler.lock runs the queue; the others only
+    serve HTTP, and one of them takes over if that process exits.
+    """
+    lock_file = open(os.path.join(DATA_DIR, 'scheduler.lock'), 'w')
+    fcntl.flock(lock_file, fcntl.LOCK_EX)
+    logger.info(f"Process {os.getpid()} is running the download scheduler")
+
+    job_store.prune()
+    prune_profiles()
+    prune_job_logs()
+    resume_interrupted_jobs()
+    start_download_workers()
+
+    last_prune = time.monotonic()
+    while True:
+        time.sleep(EVENT_INTERVAL)
+        try:
+            sync_cancellations()
+            bandwidth.rebalance()
+            if time.monotonic() - last_prune >= 3600:
+                job_store.prune()
+                prune_profiles()
+                prune_job_logs()
+                last_prune = time.monotonic()
+        except Exception as e:
+            logger.error(f"Job store maintenance failed: {e}")
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_latency(response):
+    if request.url_rule is not None and request.url_rule.rule in HTTP_METRIC_RULES:
+        metrics.observe('ytdlp_dash_http_request_seconds', time.perf_counter() - g.request_started,
+                        endpoint=request.url_rule.rule)
+    return response
 
-    except Exception as e:
-        error_msg = str(e)
-        error_trace = traceback.format_exc()
-        logger.error(f"[{download_id}] Download failed: {error_msg}")
-        logger.error(f"[{download_id}] Traceback: {error_trace}")
-
-        download_status[download_id].update({
-            'status': 'error',
-            'error': error_msg,
-            'traceback': error_trace
-        })
 
 @app.route('/')
 def index():
@@ -326,85 +3014,513 @@ def create_folder():
         logger.error(f"Error creating folder: {str(e)}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/extract-playlist', methods=['POST'])
-def extract_playlist():
-    """Extract playlist info without downloading"""
-    data = request.json
-    url = data.get('url')
+def normalize_url(url):
+    """Normalize a URL for use as a cache key"""
+    parts = urllib.parse.urlsplit(url.strip())
+    host = parts.netloc.lower()
+    for prefix in ('www.', 'm.'):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+    query = sorted(
+        (key, value) for key, value in urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+        if not key.startswith('utm_') and key not in ('si', 'feature')
+    )
+    return urllib.parse.urlunsplit((
+        parts.scheme.lower() or 'https', host, parts.path.rstrip('/'),
+        urllib.parse.urlencode(query), ''
+    ))
 
-    if not url:
-        return jsonify({'error': 'No URL provided'}), 400
 
-    try:
-        logger.info(f"Extracting playlist info from: {url}")
+class PlaylistCache(SQLiteStore):
+    """LRU cache of flat playlist extractions with a time-to-live.
 
-        ydl_opts = {
-            'extract_flat': 'in_playlist',  # Don't download, just get info
-            'quiet': True,
-            'no_warnings': True,
-        }
+    Expired entries are kept until they are evicted, so an incremental
+    refresh can still start from their head. Kept in the job database, so
+    every web worker process serves and refreshes the same listings.
+    """
 
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
+    def __init__(self, path, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        super().__init__(path)
 
-            if info is None:
-                return jsonify({'error': 'Could not extract info from URL'}), 400
+    def create_schema(self, conn):
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS playlist_cache (
+                key TEXT PRIMARY KEY,
+                result BLOB NOT NULL,
+                created REAL NOT NULL,
+                used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_playlist_cache_used ON playlist_cache(used);
+        ''')
+
+    def get(self, url, allow_stale=False):
+        """Return (result, age in seconds) or None"""
+        key = normalize_url(url)
+        with self.connection() as conn:
+            row = conn.execute('SELECT result, created FROM playlist_cache WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            age = time.time() - row['created']
+            if age > self.ttl and not allow_stale:
+                return None
+            conn.execute('UPDATE playlist_cache SET used = ? WHERE key = ?', (time.time(), key))
+        return json.loads(zlib.decompress(row['result'])), age
+
+    def put(self, url, result):
+        data = zlib.compress(json.dumps(result, separators=(',', ':')).encode())
+        now = time.time()
+        with self.connection() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO playlist_cache (key, result, created, used) VALUES (?, ?, ?, ?)',
+                (normalize_url(url), data, now, now)
+            )
+            conn.execute(
+                'DELETE FROM playlist_cache WHERE key NOT IN '
+                '(SELECT key FROM playlist_cache ORDER BY used DESC LIMIT ?)',
+                (self.max_entries,)
+            )
+
+
+playlist_cache = PlaylistCache(JOB_DB_PATH, PLAYLIST_CACHE_TTL, PLAYLIST_CACHE_SIZE)
+
+
+class InfoCache(SQLiteStore):
+    """Recently extracted video info, so a download doesn't extract it again.
+
+    A single-video listing or a conversion probe already resolved the page
+    and the format manifests; the download stage hands the cached info to
+    process_ie_result() instead, as yt-dlp's --load-info-json does. Entries
+    are the sanitized info JSON, zlib-compressed, keyed by the normalized
+    URL and the options that affect extraction. Kept in the job database,
+    so jobs running in worker processes share it.
+    """
+
+    def create_schema(self, conn):
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS info_cache (
+                key TEXT PRIMARY KEY,
+                info BLOB NOT NULL,
+                created REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_info_cache_created ON info_cache(created);
+        ''')
+
+    @staticmethod
+    def key(url, options):
+        extraction = {key: value for key, value in (options or {}).items()
+                      if key not in INFO_CACHE_NEUTRAL_OPTIONS and not key.startswith('_')}
+        return normalize_url(url) + ' ' + json.dumps(extraction, sort_keys=True, default=str)
+
+    def get(self, url, options=None):
+        """Return the cached info dict, or None if there is none younger than INFO_CACHE_TTL"""
+        if INFO_CACHE_TTL <= 0:
+            return None
+        row = self.connection().execute(
+            'SELECT info FROM info_cache WHERE key = ? AND created > ?',
+            (self.key(url, options), time.time() - INFO_CACHE_TTL)
+        ).fetchone()
+        metrics.inc('ytdlp_dash_info_cache_total', result='hit' if row else 'miss')
+        return json.loads(zlib.decompress(row['info'])) if row else None
+
+    def put(self, url, options, ydl, info):
+        """Remember the info of a single video (playlists aren't cached)"""
+        if INFO_CACHE_TTL <= 0 or not info or info.get('_type', 'video') != 'video' or not (info.get('formats') or info.get('url')):
+            return
+        info = ydl.sanitize_info(info, remove_private_keys=True)
+        data = zlib.compress(json.dumps(info, separators=(',', ':')).encode())
+        with self.connection() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO info_cache (key, info, created) VALUES (?, ?, ?)',
+                (self.key(url, options), data, time.time())
+            )
+            conn.execute(
+                'DELETE FROM info_cache WHERE created <= ? OR key NOT IN '
+                '(SELECT key FROM info_cache ORDER BY created DESC LIMIT ?)',
+                (time.time() - INFO_CACHE_TTL, INFO_CACHE_SIZE)
+            )
+
+    def discard(self, url, options=None):
+        with self.connection() as conn:
+            conn.execute('DELETE FROM info_cache WHERE key = ?', (self.key(url, options),))
+
+
+info_cache = InfoCache(JOB_DB_PATH)
+
+
+def flat_entry_video(entry, index):
+    """Describe one entry of a flat playlist extraction for the UI"""
+    # Entries that are already full videos have their media URL in 'url'
+    page_url = entry.get('url') if entry.get('_type') in ('url', 'url_transparent') else entry.get('webpage_url')
+    return {
+        'index': index,
+        'id': entry.get('id', ''),
+        'extractor': entry.get('ie_key') or entry.get('extractor_key', ''),
+        'title': entry.get('title', f'Video {index}'),
+        'url': page_url or entry.get('url') or entry.get('webpage_url') or f"https://www.youtube.com/watch?v={entry.get('id', '')}",
+        'duration': entry.get('duration'),
+        'uploader': entry.get('uploader', ''),
+    }
+
+
+def resolve_url_result(ydl, info):
+    """Follow the URL results an extraction points to (e.g. a channel to its videos tab)"""
+    for _ in range(5):
+        if info is None or info.get('_type') not in ('url', 'url_transparent'):
+            break
+        outer = info
+        info = ydl.extract_info(outer['url'], ie_key=outer.get('ie_key'), download=False, process=False)
+        if info is not None and outer['_type'] == 'url_transparent':
+            # As in yt-dlp: the fields of the pointing result win
+            info = dict(info, **{key: value for key, value in outer.items()
+                                 if value is not None and key not in ('_type', 'url', 'ie_key')})
+    return info
+
+
+def iter_raw_entries(entries):
+    """Iterate the entries of an unprocessed playlist, fetching pages only as they are reached"""
+    if isinstance(entries, PagedList):
+        for index in itertools.count():
+            try:
+                yield entries[index]
+            except PagedList.IndexError:
+                return
+    else:
+        yield from entries or []
+
+
+def iter_playlist_info(url, stop_at=None):
+    """Run a flat extraction of a URL and yield its description for the UI.
 
-            # Check if it's actually a playlist
-            if info.get('_type') == 'playlist' or 'entries' in info:
-                entries = list(info.get('entries', []))
-                videos = []
+    The first item is a header dict ({'is_playlist', 'title', ...}), followed
+    by one dict per video as the extractor's entries arrive: the playlist is
+    extracted without processing, so entries are only fetched as far as they
+    are read. With stop_at, reading stops at the first entry with that id
+    (or URL, for entries without an id) and the header gets 'reached_head'
+    set, so only videos newer than a known head are fetched.
+    """
+    ydl_opts = {
+        'extract_flat': 'in_playlist',  # Don't download, just get info
+        'quiet': True,
+        'no_warnings': True,
+    }
+
+    with extractor_registry.pooled(ydl_opts) as ydl:
+        info = resolve_url_result(ydl, ydl.extract_info(url, download=False, process=False))
+
+        if info is None:
+            return
+
+        # Check if it's actually a playlist
+        if info.get('_type') == 'playlist' or 'entries' in info:
+            header = {
+                'is_playlist': True,
+                'title': info.get('title', 'Playlist'),
+                'uploader': info.get('uploader', ''),
+                'reached_head': False
+            }
+            yield header
 
+            entries = iter_raw_entries(info.get('entries'))
+            try:
                 for i, entry in enumerate(entries):
                     if entry is None:
                         continue
-                    videos.append({
-                        'index': i + 1,
-                        'id': entry.get('id', ''),
-                        'title': entry.get('title', f'Video {i + 1}'),
-                        'url': entry.get('url') or entry.get('webpage_url') or f"https://www.youtube.com/watch?v={entry.get('id', '')}",
-                        'duration': entry.get('duration'),
-                        'uploader': entry.get('uploader', ''),
-                    })
+                    video = flat_entry_video(entry, i + 1)
+                    if stop_at and (video['id'] or video['url']) == stop_at:
+                        # Leave the rest of the playlist unfetched
+                        header['reached_head'] = True
+                        break
+                    yield video
+            finally:
+                entries.close()
+        else:
+            # Single video, not a playlist: its download can start from this extraction
+            info_cache.put(url, None, ydl, info)
+            yield {
+                'is_playlist': False,
+                'title': info.get('title', 'Video'),
+            }
+            yield {
+                'index': 1,
+                'id': info.get('id', ''),
+                'extractor': info.get('extractor_key', ''),
+                'title': info.get('title', 'Video'),
+                'url': url,
+                'duration': info.get('duration'),
+                'uploader': info.get('uploader', ''),
+            }
 
-                logger.info(f"Extracted playlist with {len(videos)} videos")
 
-                return jsonify({
-                    'is_playlist': True,
-                    'title': info.get('title', 'Playlist'),
-                    'uploader': info.get('uploader', ''),
-                    'video_count': len(videos),
-                    'videos': videos
-                })
-            else:
-                # Single video, not a playlist
-                return jsonify({
-                    'is_playlist': False,
-                    'title': info.get('title', 'Video'),
-                    'video_count': 1,
-                    'videos': [{
-                        'index': 1,
-                        'id': info.get('id', ''),
-                        'title': info.get('title', 'Video'),
-                        'url': url,
-                        'duration': info.get('duration'),
-                        'uploader': info.get('uploader', ''),
-                    }]
-                })
+def extract_playlist_info(url, stop_at=None):
+    """Collect iter_playlist_info() into a single result, or None"""
+    items = iter_playlist_info(url, stop_at)
+    header = next(items, None)
+    if header is None:
+        return None
+    videos = list(items)
+    return dict(header, video_count=len(videos), videos=videos)
+
+
+def incremental_base(url):
+    """Return the cached listing an incremental refresh can start from"""
+    cached = playlist_cache.get(url, allow_stale=True)
+    if cached and cached[0]['is_playlist'] and cached[0]['videos']:
+        return cached[0]
+    return None
+
+
+def refresh_playlist_info(url, previous):
+    """Fetch only the entries newer than the head of a cached listing.
+
+    The extraction stops reading the playlist at the cached head, so only
+    the new entries are fetched. Returns the updated listing (with
+    'new_videos' set) or None.
+    """
+    logger.info(f"Refreshing cached playlist info from: {url}")
+    head = previous['videos'][0]
+    update = extract_playlist_info(url, stop_at=head['id'] or head['url'])
+    if update is None:
+        return None
+
+    new_videos = update['videos']
+    if update.get('reached_head'):
+        videos = new_videos + previous['videos']
+        # Indexes shift by the number of new entries at the top
+        videos = [dict(video, index=i) for i, video in enumerate(videos, 1)]
+        result = dict(previous, title=update['title'], uploader=update['uploader'],
+                      video_count=len(videos), videos=videos)
+    else:
+        # The old head is gone (reordered or deleted): this was a full pass
+        result = update
+    logger.info(f"Found {len(new_videos)} new videos in playlist")
+    result.pop('reached_head', None)
+    result['new_videos'] = len(new_videos)
+    playlist_cache.put(url, result)
+    return result
+
+
+def stream_playlist_info(url, cached=None, previous=None, directory=None, chunk_size=50):
+    """Yield NDJSON lines describing a playlist while it is being extracted.
+
+    A cached listing is replayed as is; a previous listing is refreshed
+    incrementally first. Otherwise lines are sent as entries arrive.
+    """
+    def line(kind, **fields):
+        return json.dumps(dict(fields, type=kind)) + '\n'
+
+    try:
+        if previous:
+            cached = refresh_playlist_info(url, previous)
+            if cached is None:
+                yield line('error', error='Could not extract info from URL', fallback=True)
+                return
+
+        if cached:
+            yield line('info', cached=previous is None, **{k: v for k, v in cached.items() if k != 'videos'})
+            for start in range(0, len(cached['videos']), chunk_size):
+                yield line('videos', videos=mark_archived(cached['videos'][start:start + chunk_size], directory))
+            yield line('done', video_count=cached['video_count'])
+            return
+
+        items = iter_playlist_info(url)
+        header = next(items, None)
+        if header is None:
+            yield line('error', error='Could not extract info from URL', fallback=True)
+            return
+        header.pop('reached_head', None)
+        yield line('info', cached=False, **header)
+
+        videos = []
+        chunk = []
+        for video in items:
+            videos.append(video)
+            chunk.append(video)
+            if len(chunk) >= chunk_size:
+                yield line('videos', videos=mark_archived(chunk, directory))
+                chunk = []
+        if chunk:
+            yield line('videos', videos=mark_archived(chunk, directory))
+
+        logger.info(f"Streamed playlist with {len(videos)} videos")
+        playlist_cache.put(url, dict(header, video_count=len(videos), videos=videos))
+        yield line('done', video_count=len(videos))
 
     except Exception as e:
         logger.error(f"Error extracting playlist: {str(e)}")
-        return jsonify({'error': str(e), 'fallback': True}), 500
+        yield line('error', error=str(e), fallback=True)
 
 
-@app.route('/download', methods=['POST'])
-def download():
+@app.route('/extract-playlist', methods=['POST'])
+def extract_playlist():
+    """Extract playlist info without downloading.
+
+    `refresh` selects how the cache is used: 'auto' (default) serves a fresh
+    cached result, 'incremental' only fetches entries newer than the cached
+    head, and 'full' always re-extracts. With `stream`, the result is sent
+    as NDJSON while the extraction runs. With `downloadPath`, videos already
+    in that directory's download archive are flagged as `archived`.
+    """
     data = request.json
     url = data.get('url')
-    
+    refresh = data.get('refresh', 'auto')
+    directory = os.path.abspath(data['downloadPath']) if data.get('downloadPath') else None
+
     if not url:
         return jsonify({'error': 'No URL provided'}), 400
-    
+
+    def respond(result, **fields):
+        return jsonify(dict(result, videos=mark_archived(result['videos'], directory), **fields))
+
+    if data.get('stream'):
+        # NDJSON: an 'info' line, 'videos' lines as entries arrive, then 'done'
+        cached = playlist_cache.get(url) if refresh == 'auto' else None
+        previous = incremental_base(url) if refresh == 'incremental' else None
+        logger.info(f"Streaming playlist info from: {url}")
+        return Response(stream_playlist_info(url, cached[0] if cached else None, previous, directory),
+                        mimetype='application/x-ndjson',
+                        headers={'X-Accel-Buffering': 'no'})
+
+    try:
+        if refresh == 'auto':
+            cached = playlist_cache.get(url)
+            if cached:
+                result, age = cached
+                logger.info(f"Serving cached playlist info for: {url} ({int(age)}s old)")
+                return respond(result, cached=True, cache_age=int(age))
+
+        previous = incremental_base(url) if refresh == 'incremental' else None
+        if previous:
+            result = refresh_playlist_info(url, previous)
+            if result is None:
+                return jsonify({'error': 'Could not extract info from URL'}), 400
+            return respond(result, cached=False)
+
+        logger.info(f"Extracting playlist info from: {url}")
+        result = extract_playlist_info(url)
+        if result is None:
+            return jsonify({'error': 'Could not extract info from URL'}), 400
+
+        result.pop('reached_head', None)
+        if result['is_playlist']:
+            logger.info(f"Extracted playlist with {result['video_count']} videos")
+        playlist_cache.put(url, result)
+        return respond(result, cached=False)
+
+    except Exception as e:
+        logger.error(f"Error extracting playlist: {str(e)}")
+        return jsonify({'error': str(e), 'fallback': True}), 500
+
+
+def format_row(f, duration):
+    """Describe one format of a probed video for /formats"""
+    tbr = f.get('tbr')
+    return {
+        'format_id': f.get('format_id'),
+        'ext': f.get('ext'),
+        'resolution': f.get('resolution') or ('audio only' if f.get('vcodec') == 'none' else None),
+        'width': f.get('width'),
+        'height': f.get('height'),
+        'fps': f.get('fps'),
+        'dynamic_range': f.get('dynamic_range'),
+        'vcodec': f.get('vcodec'),
+        'acodec': f.get('acodec'),
+        'tbr': tbr,
+        'vbr': f.get('vbr'),
+        'abr': f.get('abr'),
+        'protocol': f.get('protocol'),
+        'note': f.get('format_note'),
+        'filesize': f.get('filesize'),
+        # kbit/s * seconds -> bytes, when the site doesn't tell
+        'filesize_approx': (f.get('filesize') or f.get('filesize_approx')
+                            or (int(tbr * duration * 125) if tbr and duration else None)),
+    }
+
+
+def probe_formats(url, refresh=False):
+    """Return the format table of a single video, probing it unless the info cache has it"""
+    info = None if refresh else info_cache.get(url)
+    cached = info is not None
+    # A fresh dict each time: YoutubeDL adds its defaults to the one it gets
+    with extractor_registry.pooled({'quiet': True, 'no_warnings': True, 'noplaylist': True}) as ydl:
+        if info is None:
+            info = ydl.extract_info(url, download=False)
+            if info is None or info.get('_type', 'video') != 'video':
+                raise ValueError('Not a single video; list playlists with /extract-playlist')
+            info_cache.put(url, None, ydl, info)
+        duration = info.get('duration')
+        # What a download without a formatId would get (the 'best' quality preset)
+        default = select_format(ydl, info, 'bestvideo+bestaudio/best') or []
+    sizes = [format_row(f, duration)['filesize_approx'] for f in default]
+    return {
+        'url': url,
+        'id': info.get('id'),
+        'title': info.get('title'),
+        'extractor': info.get('extractor_key'),
+        'duration': duration,
+        # Storyboards (mhtml) are images, not something to download
+        'formats': [format_row(f, duration) for f in info.get('formats') or [] if f.get('ext') != 'mhtml'],
+        'default': {
+            'format_id': '+'.join(f.get('format_id') or '?' for f in default) or None,
+            'filesize_approx': sum(sizes) if sizes and None not in sizes else None,
+        },
+        'cached': cached,
+    }
+
+
+format_probe_pool = concurrent.futures.ThreadPoolExecutor(FORMAT_PROBE_WORKERS, thread_name_prefix='format-probe')
+
+
+@app.route('/formats', methods=['POST'])
+def formats():
+    """List the formats of a video (`url`) or of several (`urls`), without downloading.
+
+    Several videos are probed concurrently. Probes are kept in the info cache
+    for INFO_CACHE_TTL, so a download queued with one of the returned
+    `format_id`s as `formatId` starts without extracting the video again.
+    `refresh` probes again even when the cache has the video.
+    """
+    data = request.json or {}
+    urls = data.get('urls') if 'urls' in data else [data.get('url')]
+    if not isinstance(urls, list) or not urls or not all(isinstance(url, str) and url for url in urls):
+        return jsonify({'error': 'No URL provided'}), 400
+    if len(urls) > FORMAT_PROBE_MAX_URLS:
+        return jsonify({'error': f'At most {FORMAT_PROBE_MAX_URLS} URLs per request'}), 400
+
+    def probe(url):
+        try:
+            return probe_formats(url, bool(data.get('refresh')))
+        except Exception as e:
+            logger.error(f"Error probing formats of {url}: {e}")
+            return {'url': url, 'error': str(e), 'status': probe_error_status(e)}
+
+    if 'urls' not in data:
+        result = probe(urls[0])
+        return jsonify(result), result.get('status', 200)
+    return jsonify({'results': list(format_probe_pool.map(probe, urls))})
+
+
+def probe_error_status(error):
+    """HTTP status for a failed probe: 400 for a bad URL, 502 when the site or network failed"""
+    if isinstance(error, ValueError):
+        # Not a single video
+        return 400
+    if isinstance(error, yt_dlp.utils.DownloadError):
+        cause = error.exc_info[1] if error.exc_info else None
+        if isinstance(cause, yt_dlp.utils.UnsupportedError) or 'is not a valid URL' in str(error):
+            return 400
+        # Unavailable, geo-blocked, HTTP or connection errors
+        return 502
+    return 500
+
+
+def build_download_options(data, download_id):
+    """Validate download settings sent by the UI and compile the yt-dlp options.
+
+    Returns (download_dir, options). Raises ValueError when the settings
+    cannot be used.
+    """
     # Get the selected download path
     download_path = data.get('downloadPath', DEFAULT_DOWNLOAD_DIR)
     
@@ -416,21 +3532,10 @@ def download():
         try:
             os.makedirs(download_dir, exist_ok=True)
         except Exception as e:
-            return jsonify({'error': f'Cannot create directory: {str(e)}'}), 400
+            raise ValueError(f'Cannot create directory: {str(e)}')
     
     if not os.access(download_dir, os.W_OK):
-        return jsonify({'error': 'Directory is not writable'}), 400
-    
-    # Generate unique download ID
-    download_id = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
-    
-    # Initialize status
-    download_status[download_id] = {
-        'status': 'starting',
-        'url': url,
-        'directory': download_dir,
-        'started': datetime.now().isoformat()
-    }
+        raise ValueError('Directory is not writable')
     
     # Parse options
     options = {}
@@ -478,6 +3583,13 @@ def download():
         })
         logger.info(f"[{download_id}] Audio only mode: {audio_format}")
 
+    # Exact streams picked from /formats take precedence over the presets
+    if data.get('formatId'):
+        options['format'] = str(data['formatId'])
+        # Popped by download_stage(), which leaves the streams to plan_conversion() otherwise
+        options['_format_pinned'] = True
+        logger.info(f"[{download_id}] Format: {options['format']}")
+
     # Subtitle options
     if data.get('subtitles', False):
         options['writesubtitles'] = True
@@ -508,6 +3620,21 @@ def download():
         options['_generate_nfo'] = True
         logger.info(f"[{download_id}] NFO generation enabled")
 
+    if data.get('bandwidthWeight'):
+        # Share of the bandwidth relative to other jobs (see BandwidthScheduler)
+        options['_bandwidth_weight'] = max(float(data['bandwidthWeight']), 0.01)
+
+    if data.get('logLevel'):
+        if data['logLevel'] not in JOB_LOG_LEVELS:
+            raise ValueError(f"logLevel must be one of {', '.join(JOB_LOG_LEVELS)}")
+        # Read by ytdlp_options() in each job stage
+        options['_log_level'] = data['logLevel']
+
+    if data.get('profile', False):
+        # Popped again by download_video(), like _generate_nfo
+        options['_profile'] = True
+        logger.info(f"[{download_id}] Profiling enabled")
+
     # Add postprocessors if any were configured
     if postprocessors:
         options['postprocessors'] = postprocessors
@@ -535,7 +3662,8 @@ def download():
                 if snake_key in ['ignore_errors', 'no_warnings', 'quiet', 'verbose']:
                     options[snake_key] = value
                 elif snake_key == 'limit_rate':
-                    options['ratelimit'] = value
+                    # yt-dlp wants bytes/s; the UI sends strings like '500K'
+                    options['ratelimit'] = parse_rate(value)
                 elif snake_key == 'write_subs':
                     options['writesubtitles'] = value
                 elif snake_key == 'write_auto_subs':
@@ -545,112 +3673,422 @@ def download():
                     options[snake_key] = value
 
         logger.info(f"[{download_id}] Advanced options applied: {len(custom_flags)} settings")
+
+    return download_dir, options
+
+
+def new_download_id():
+    return datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+
+
+@app.route('/download', methods=['POST'])
+def download():
+    data = request.json
+    url = data.get('url')
     
-    # Start download in background thread
-    thread = threading.Thread(target=download_video, args=(url, options, download_id, download_dir))
-    thread.daemon = True
-    thread.start()
+    if not url:
+        return jsonify({'error': 'No URL provided'}), 400
     
+    # Generate unique download ID
+    download_id = new_download_id()
+
+    try:
+        download_dir, options = build_download_options(data, download_id)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # Skip videos that are already in this directory, unless forced
+    if not data.get('force') and not data.get('downloadPlaylist'):
+        archived = find_archived([{'url': url}], download_dir, resolve_urls=True)
+        if archived:
+            logger.info(f"[{download_id}] Skipped, already downloaded to {download_dir}")
+            return jsonify({
+                'error': 'Already downloaded to this directory',
+                'archived': archived[0]
+            }), 409
+
+    # Hand the job to the worker pool; higher priority jobs are started first
+    try:
+        priority = int(data.get('priority', 0))
+    except (TypeError, ValueError):
+        priority = 0
+    enqueue_download(url, options, download_id, download_dir, priority)
+
     return jsonify({
         'success': True,
         'download_id': download_id,
-        'message': 'Download started'
+        'message': 'Download queued'
+    })
+
+@app.route('/download/batch', methods=['POST'])
+def download_batch():
+    """Queue many videos (e.g. from /extract-playlist) with one set of settings.
+
+    A video can carry a `formatId` from /formats to pick its streams.
+    """
+    data = request.json or {}
+    videos = [video for video in data.get('videos') or [] if video and video.get('url')]
+    settings = dict(data.get('settings') or {})
+
+    if not videos:
+        return jsonify({'error': 'No videos provided'}), 400
+
+    batch_id = f'batch_{new_download_id()}'
+
+    # Every item is a single video, even if it came from a playlist
+    settings['downloadPlaylist'] = False
+    try:
+        download_dir, options = build_download_options(settings, batch_id)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # Drop videos that are already in this directory, unless forced
+    skipped = []
+    if not data.get('force'):
+        archived = find_archived(videos, download_dir)
+        skipped = [videos[i] for i in sorted(archived)]
+        videos = [video for i, video in enumerate(videos) if i not in archived]
+        if skipped:
+            logger.info(f"[{batch_id}] Skipping {len(skipped)} videos already downloaded to {download_dir}")
+
+    if not videos:
+        return jsonify({
+            'success': True,
+            'batch_id': None,
+            'download_ids': [],
+            'skipped': skipped,
+            'message': 'All videos were already downloaded'
+        })
+
+    try:
+        priority = int(data.get('priority', settings.get('priority', 0)))
+    except (TypeError, ValueError):
+        priority = 0
+    download_ids = enqueue_batch(batch_id, videos, options, download_dir, priority)
+
+    return jsonify({
+        'success': True,
+        'batch_id': batch_id,
+        'download_ids': download_ids,
+        'skipped': skipped,
+        'message': f'{len(download_ids)} downloads queued'
     })
 
+@app.route('/batch/<batch_id>')
+def batch_status(batch_id):
+    """Aggregate progress of a batch"""
+    summary = job_store.batch_summary(batch_id)
+    if summary is None:
+        return jsonify({'error': 'Batch not found'}), 404
+
+    finished = sum(summary['counts'].get(state, 0) for state in FINISHED_STATES)
+    # As last flushed to the store: only the scheduler process has download_status
+    running = job_store.jobs_with_status(('starting', 'downloading', 'processing'), batch_id)
+    summary.update({
+        'batch_id': batch_id,
+        'finished': finished,
+        'percent': round(finished * 100 / summary['total'], 1) if summary['total'] else 100.0,
+        'speed_bytes': sum(job.get('speed_bytes') or 0 for job in running if job.get('status') == 'downloading'),
+        'downloaded_bytes': sum(job.get('downloaded_bytes') or 0 for job in running)
+    })
+    return jsonify(summary)
+
+@app.route('/archive')
+def export_archive():
+    """Export a directory's download archive in yt-dlp's --download-archive format"""
+    directory = os.path.abspath(request.args.get('directory', DEFAULT_DOWNLOAD_DIR))
+    lines = download_archive.export_lines(directory)
+    return Response(''.join(f'{line}\n' for line in lines), mimetype='text/plain',
+                    headers={'Content-Disposition': 'attachment; filename=archive.txt'})
+
+@app.route('/archive', methods=['POST'])
+def import_archive():
+    """Import a yt-dlp download archive, given as `content` or a file `path`"""
+    data = request.json or {}
+    directory = os.path.abspath(data.get('directory', DEFAULT_DOWNLOAD_DIR))
+    try:
+        if data.get('path'):
+            with open(os.path.abspath(data['path']), 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+        else:
+            lines = (data.get('content') or '').splitlines()
+        imported = download_archive.import_lines(directory, lines)
+        logger.info(f"Imported {imported} download archive entries for {directory}")
+        return jsonify({'success': True, 'imported': imported})
+    except OSError as e:
+        return jsonify({'error': str(e)}), 400
+
 @app.route('/status/<download_id>')
 def status(download_id):
-    if download_id in download_status:
-        return jsonify(download_status[download_id])
+    job = get_job(download_id)
+    if job is not None:
+        return jsonify(format_progress(job))
     return jsonify({'error': 'Download not found'}), 404
 
 
 @app.route('/cancel/<download_id>', methods=['POST'])
 def cancel_download(download_id):
     """Cancel an active download"""
-    if download_id not in download_status:
+    job = get_job(download_id)
+    if job is None:
         return jsonify({'error': 'Download not found'}), 404
 
-    current_status = download_status[download_id].get('status')
-    if current_status in ['completed', 'error', 'cancelled']:
+    current_status = job.get('status')
+    if current_status in FINISHED_STATES:
         return jsonify({'error': f'Download already {current_status}'}), 400
 
     # Mark for cancellation
-    cancelled_downloads.add(download_id)
-    download_status[download_id].update({
+    job.update({
         'status': 'cancelled',
         'message': 'Cancelled by user'
     })
+    # Queued jobs are no longer claimed once saved as cancelled. Running ones
+    # are stopped by the progress hook of the process that runs them.
+    job_store.request_cancel(download_id)
+    if download_id in download_status:
+        cancelled_downloads.add(download_id)
+    save_job(download_id, job)
 
     logger.info(f"[{download_id}] Download cancelled by user")
     return jsonify({'success': True, 'message': 'Download cancelled'})
 
+@app.route('/events')
+def events():
+    """Server-sent event stream of status updates for all jobs"""
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+
+    def stream():
+        yield 'retry: 3000\n\n'
+        cursor = event_broker.parse_event_id(last_event_id)
+        while True:
+            if cursor is None:
+                # Resume point unknown or too old: tell the client to resync
+                cursor = event_broker.latest_seq()
+                yield f'id: {event_broker.event_id(cursor)}\nevent: reset\ndata: {{}}\n\n'
+            pending = event_broker.wait(cursor, timeout=15)
+            if pending is None:
+                cursor = None
+                continue
+            if not pending:
+                yield ': keepalive\n\n'
+                continue
+            for seq, data in pending:
+                yield f'id: {event_broker.event_id(seq)}\nevent: status\ndata: {data}\n\n'
+            cursor = pending[-1][0]
+
+    return Response(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route('/queue')
+def queue_info():
+    """Summarize the server-side download queue"""
+    counts = job_store.count_by_status()
+
+    # Aggregate progress of the running downloads, as last flushed to the store
+    total_speed = 0
+    total_eta = 0
+    remaining_bytes = 0
+    for job in job_store.jobs_with_status(('downloading',)):
+        total_speed += job.get('speed_bytes') or 0
+        total_eta += job.get('eta_seconds') or 0
+        if job.get('total_bytes'):
+            remaining_bytes += max(job['total_bytes'] - (job.get('downloaded_bytes') or 0), 0)
+
+    stages = job_store.count_by_stage()
+
+    return jsonify({
+        'max_concurrent': MAX_CONCURRENT_DOWNLOADS,
+        'waiting': counts.get('queued', 0),
+        'counts': counts,
+        'stages': {
+            'download': {'active': stages.get('download', 0), 'slots': MAX_CONCURRENT_DOWNLOADS},
+            'postprocess': {
+                'waiting': stages.get('postprocess_wait', 0),
+                'active': stages.get('postprocess', 0),
+                'slots': POSTPROCESS_WORKERS
+            }
+        },
+        'speed_bytes': total_speed,
+        'speed': FileDownloader.format_speed(total_speed).strip() if total_speed else 'N/A',
+        'eta_seconds': total_eta,
+        'remaining_bytes': remaining_bytes
+    })
+
+@app.route('/bandwidth')
+def bandwidth_info():
+    """Show the bandwidth limits and the share of every running download"""
+    limit, hosts = bandwidth.limits()
+    return jsonify({
+        'limit': limit,
+        'hosts': hosts,
+        'jobs': [{
+            'download_id': job.get('download_id'),
+            'title': job.get('title'),
+            'host': job.get('host'),
+            'speed_bytes': job.get('rate_bytes'),
+            'share_bytes': job.get('bandwidth_share')
+        } for job in job_store.jobs_with_status(('downloading',))]
+    })
+
+
+@app.route('/bandwidth', methods=['PUT', 'POST'])
+def set_bandwidth():
+    """Change bandwidth limits at runtime.
+
+    `limit` is the global cap and `hosts` maps hosts to caps, in bytes/s or
+    as strings like '5M'; null removes a limit. Running jobs pick the new
+    shares up within a second.
+    """
+    data = request.json or {}
+    changes = {}
+    try:
+        if 'limit' in data:
+            changes[''] = parse_rate(data['limit'])
+        for host, rate in (data.get('hosts') or {}).items():
+            changes[host.strip().lower()] = parse_rate(rate)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    bandwidth.set_limits(changes)
+    logger.info(f"Bandwidth limits changed: {changes}")
+    return bandwidth_info()
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Expose queue, job phase, throughput, error and HTTP metrics for Prometheus"""
+    counts = job_store.count_by_status()
+    downloading = job_store.jobs_with_status(('downloading',))
+    gauges = {
+        'ytdlp_dash_queued_jobs': ('Jobs waiting for a download slot', {'': counts.get('queued', 0)}),
+        'ytdlp_dash_active_jobs': ('Jobs being downloaded or postprocessed',
+                                   {'': sum(counts.get(status, 0) for status in ACTIVE_STATES if status != 'queued')}),
+        'ytdlp_dash_stage_jobs': ('Running jobs per pipeline stage', {
+            Metrics.format_labels({'stage': stage}): n for stage, n in job_store.count_by_stage().items()
+        }),
+        'ytdlp_dash_download_speed_bytes': ('Combined speed of the running downloads (bytes/s)',
+                                            {'': sum(job.get('speed_bytes') or 0 for job in downloading)}),
+    }
+    return Response(metrics.render(gauges), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 @app.route('/downloads')
 def list_downloads():
-    """List recent downloaded files from tracked downloads"""
+    """List recent downloaded files from the file catalog.
+
+    Supports `page`, `per_page`, `sort` (modified, name or size) and `order`
+    (desc or asc), and answers 304 when the listing has not changed.
+    """
     try:
-        all_files = []
-        checked_paths = set()
-        
-        # Get files from recent download locations
-        for dl_id, dl_info in download_status.items():
-            if dl_info.get('status') == 'completed':
-                dir_path = dl_info.get('directory', '')
-                if dir_path and dir_path not in checked_paths and os.path.exists(dir_path):
-                    checked_paths.add(dir_path)
-                    try:
-                        for filename in os.listdir(dir_path):
-                            filepath = os.path.join(dir_path, filename)
-                            if os.path.isfile(filepath):
-                                # Only show files modified in last 7 days
-                                mtime = os.path.getmtime(filepath)
-                                if (datetime.now() - datetime.fromtimestamp(mtime)).days <= 7:
-                                    all_files.append({
-                                        'name': filename,
-                                        'size': os.path.getsize(filepath),
-                                        'modified': datetime.fromtimestamp(mtime).isoformat(),
-                                        'directory': dir_path,
-                                        'path': filepath
-                                    })
-                    except:
-                        pass
-        
-        # Also check default download directory
-        if DEFAULT_DOWNLOAD_DIR not in checked_paths and os.path.exists(DEFAULT_DOWNLOAD_DIR):
-            for filename in os.listdir(DEFAULT_DOWNLOAD_DIR):
-                filepath = os.path.join(DEFAULT_DOWNLOAD_DIR, filename)
-                if os.path.isfile(filepath):
-                    all_files.append({
-                        'name': filename,
-                        'size': os.path.getsize(filepath),
-                        'modified': datetime.fromtimestamp(os.path.getmtime(filepath)).isoformat(),
-                        'directory': DEFAULT_DOWNLOAD_DIR,
-                        'path': filepath
-                    })
-        
-        # Sort by modification time, newest first
-        all_files.sort(key=lambda x: x['modified'], reverse=True)
-        # Limit to 50 most recent files
-        return jsonify({'files': all_files[:50]})
+        sort = request.args.get('sort', 'modified')
+        if sort not in ('modified', 'name', 'size'):
+            sort = 'modified'
+        reverse = request.args.get('order', 'desc') != 'asc'
+        page = max(request.args.get('page', 1, type=int), 1)
+        per_page = min(max(request.args.get('per_page', 50, type=int), 1), 500)
+
+        files, total, version = file_catalog.query(sort, reverse, (page - 1) * per_page, per_page)
+
+        response = jsonify({
+            'files': files,
+            'total': total,
+            'page': page,
+            'per_page': per_page
+        })
+        response.set_etag(f'{version}-{sort}-{int(reverse)}-{page}-{per_page}')
+        response.headers['Cache-Control'] = 'no-cache'
+        return response.make_conditional(request)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def profile_summary(download_id, stage, limit):
+    """Spans of a profiled stage, totals per span name and the costliest functions"""
+    with open(profile_path(download_id, f'{stage}.json')) as f:
+        summary = json.load(f)
+    totals = {}
+    for span in summary['spans']:
+        total = totals.setdefault(span['name'], {'count': 0, 'seconds': 0.0})
+        total['count'] += 1
+        total['seconds'] = round(total['seconds'] + span['seconds'], 4)
+    summary['span_totals'] = totals
+
+    stats_path = profile_path(download_id, f'{stage}.prof')
+    if os.path.exists(stats_path):
+        stats = pstats.Stats(stats_path, stream=io.StringIO()).stats
+        top = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:limit]
+        summary['functions'] = [{
+            'function': f'{os.path.basename(filename)}:{line}({name})',
+            'calls': calls,
+            'own_seconds': round(own, 4),
+            'cumulative_seconds': round(cumulative, 4)
+        } for (filename, line, name), (_, calls, own, cumulative, _) in top]
+        summary['stats_url'] = f'/profile/{download_id}/{stage}.prof'
+    return summary
+
+
+@app.route('/profile/<download_id>')
+def job_profile(download_id):
+    """Show the profile of a job queued with "profile": true"""
+    directory = profile_path(download_id, '')
+    if not os.path.isdir(directory):
+        return jsonify({'error': 'No profile for this download'}), 404
+    limit = min(max(request.args.get('limit', 30, type=int), 1), 500)
+    stages = sorted(name[:-len('.json')] for name in os.listdir(directory) if name.endswith('.json'))
+    return jsonify({
+        'download_id': download_id,
+        'stages': {stage: profile_summary(download_id, stage, limit) for stage in stages}
+    })
+
+
+@app.route('/profile/<download_id>/<stage>.prof')
+def job_profile_stats(download_id, stage):
+    """Download the raw cProfile stats of a job stage (for pstats, snakeviz, ...)"""
+    path = profile_path(download_id, f'{os.path.basename(stage)}.prof')
+    if not os.path.exists(path):
+        return jsonify({'error': 'No profile for this download'}), 404
+    return send_file(path, as_attachment=True, download_name=f'{download_id}-{os.path.basename(stage)}.prof')
+
+
 @app.route('/download-file')
 def download_file():
-    """Serve downloaded files from their actual path"""
+    """Serve downloaded files from their actual path.
+
+    Supports Range, If-Range and ETag/Last-Modified revalidation, so
+    interrupted transfers resume and players can seek. `stream=true` serves
+    the file inline for playback in the browser.
+    """
     try:
         filepath = request.args.get('path')
         if not filepath:
             return jsonify({'error': 'No file path provided'}), 400
+        stream = request.args.get('stream', 'false').lower() == 'true'
         
         # Security check - ensure file exists and is within the container
         safe_path = os.path.abspath(filepath)
         
         if os.path.exists(safe_path) and os.path.isfile(safe_path):
-            directory = os.path.dirname(safe_path)
-            filename = os.path.basename(safe_path)
-            return send_from_directory(directory, filename, as_attachment=True)
+            mimetype = mimetypes.guess_type(safe_path)[0] or 'application/octet-stream'
+            if SENDFILE_HEADER in ('x-sendfile', 'x-accel-redirect'):
+                # The proxy handles ranges and conditionals on the real file. Only
+                # this route hands files to the proxy, so USE_X_SENDFILE stays off
+                response = werkzeug.utils.send_file(
+                    safe_path, request.environ, mimetype=mimetype, as_attachment=not stream,
+                    conditional=False, use_x_sendfile=True, response_class=app.response_class
+                )
+                if SENDFILE_HEADER == 'x-accel-redirect':
+                    response.headers['X-Accel-Redirect'] = ACCEL_REDIRECT_PREFIX + urllib.parse.quote(
+                        response.headers.pop('X-Sendfile'))
+                return response
+
+            # Whole-file responses go through the server's wsgi.file_wrapper,
+            # which uses sendfile() where the server supports it
+            return send_file(safe_path, mimetype=mimetype, as_attachment=not stream, conditional=True)
         
         return jsonify({'error': 'File not found'}), 404
+    except HTTPException:
+        # e.g. 416 for an unsatisfiable range
+        raise
     except Exception as e:
         return jsonify({'error': str(e)}), 404
 
@@ -673,6 +4111,7 @@ def delete_file():
         
         # Delete the file
         os.remove(safe_path)
+        file_catalog.remove(safe_path)
         logger.info(f"Deleted file: {safe_path}")
         
         return jsonify({
@@ -686,36 +4125,128 @@ def delete_file():
         logger.error(f"Error deleting file: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+# yt-dlp's in-progress lines, in all of its templates: "[download]  42.0% of
+# 10.00MiB at 2.00MiB/s ETA 00:03", "  N/A% at ...", "  1.46KiB at ... (00:01)",
+# numbered "2: [download] ..." for concurrent downloads. Not the final "100% of ... in ..."
+PROGRESS_LINE = re.compile(r'^(?:\d+: )?\[download\]\s+(?:\d+\.\d%|N/A%|[\d.]+\w*B|N/A) (?:of|at) ')
+LOG_RECORD_START = re.compile(r'^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2},\d{3} - \S+ - (\w+) - ')
+LOG_LEVELS = {'DEBUG': 10, 'INFO': 20, 'WARNING': 30, 'ERROR': 40, 'CRITICAL': 50}
+
+
+def filter_log_lines(lines, download_id=None, min_level=0):
+    """Keep the lines of log records that pass the filters.
+
+    Continuation lines (e.g. tracebacks) belong to the record above them;
+    lines before the first record start in `lines` are dropped.
+    """
+    selected = []
+    keep = False
+    for line in lines:
+        match = LOG_RECORD_START.match(line)
+        if match:
+            keep = (
+                '- werkzeug -' not in line and 'HTTP/1.1"' not in line
+                and LOG_LEVELS.get(match.group(1), 0) >= min_level
+                and (download_id is None or f'[{download_id}]' in line)
+            )
+        if keep:
+            selected.append(line)
+    return selected
+
+
+def read_log_tail(f, end, wanted, start=0, block_size=65536, **filters):
+    """Return the last `wanted` matching lines between `start` and `end`.
+
+    Reads backwards from `end` in growing blocks, so only as much of the
+    file as needed is read.
+    """
+    size = block_size
+    while True:
+        offset = max(start, end - size)
+        f.seek(offset)
+        lines = f.read(end - offset).decode('utf-8', 'replace').splitlines(keepends=True)
+        selected = filter_log_lines(lines, **filters)
+        if len(selected) >= wanted or offset == start:
+            return selected[-wanted:]
+        size *= 2
+
+
 @app.route('/logs')
 def get_logs():
-    """Get recent log entries, filtering out HTTP request noise"""
+    """Get recent log entries, filtering out HTTP request noise.
+
+    `download_id` and `level` filter the records. Each response carries a
+    `cursor`; passing it back returns only lines written since then.
+    """
     try:
         log_file = os.path.join(LOG_DIR, 'ytdlp-web.log')
-        lines = request.args.get('lines', 100, type=int)
+        lines = max(request.args.get('lines', 100, type=int), 1)
+        cursor = request.args.get('cursor', '')
+        filters = {
+            'download_id': request.args.get('download_id') or None,
+            'min_level': LOG_LEVELS.get(request.args.get('level', '').upper(), 0)
+        }
 
         if not os.path.exists(log_file):
             return jsonify({'logs': 'No logs available yet'})
 
-        # Read log file and filter out werkzeug HTTP request logs
-        with open(log_file, 'r') as f:
-            all_lines = f.readlines()
+        with open(log_file, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            end = stat.st_size
 
-        # Filter out werkzeug HTTP request lines (GET/POST requests)
-        filtered_lines = [
-            line for line in all_lines
-            if '- werkzeug -' not in line and 'HTTP/1.1"' not in line
-        ]
+            # Only hand out complete lines
+            if end:
+                f.seek(max(0, end - 65536))
+                tail = f.read(end - max(0, end - 65536))
+                end -= len(tail) - (tail.rfind(b'\n') + 1)
 
-        recent_lines = filtered_lines[-lines:] if len(filtered_lines) > lines else filtered_lines
+            inode, _, offset = cursor.partition(':')
+            if inode == str(stat.st_ino) and offset.isdigit() and int(offset) <= end:
+                # Incremental: only what was written after the cursor
+                offset = int(offset)
+                recent_lines = read_log_tail(f, end, lines, start=offset, **filters) if offset < end else []
+                reset = False
+            else:
+                # First request, or the log was rotated since the cursor
+                recent_lines = read_log_tail(f, end, lines, **filters)
+                reset = True
 
         return jsonify({
-            'logs': ''.join(recent_lines) if recent_lines else 'No download logs yet. Start a download to see logs here.',
-            'total_lines': len(filtered_lines)
+            'logs': ''.join(recent_lines) if recent_lines or not reset else 'No download logs yet. Start a download to see logs here.',
+            'lines': len(recent_lines),
+            'cursor': f'{stat.st_ino}:{end}',
+            'reset': reset
         })
     except Exception as e:
         logger.error(f"Error reading logs: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/logs/<download_id>')
+def get_job_logs(download_id):
+    """Log of one job, including records the shared log dropped over LOG_BUDGET.
+
+    Served from memory while the job runs in a thread of this process,
+    otherwise from the job's log file. `lines` and `level` work as for /logs.
+    """
+    lines = max(request.args.get('lines', 200, type=int), 1)
+    min_level = LOG_LEVELS.get(request.args.get('level', '').upper(), 0)
+    # Other processes only hold the lines they logged themselves (e.g. 'Queued'),
+    # and job processes write only the file
+    running_here = EXECUTION_MODE == 'thread' and download_id in download_status
+    recent = job_log_handler.recent(download_id) if running_here else None
+    if recent is not None:
+        recent = filter_log_lines(recent, min_level=min_level)[-lines:]
+    else:
+        try:
+            with open(job_log_path(download_id), 'rb') as f:
+                recent = read_log_tail(f, os.fstat(f.fileno()).st_size, lines, min_level=min_level)
+        except FileNotFoundError:
+            if job_store.get(download_id) is None:
+                return jsonify({'error': 'Download not found'}), 404
+            recent = []
+    return jsonify({'download_id': download_id, 'logs': ''.join(recent), 'lines': len(recent)})
+
+
 @app.route('/version')
 def check_version():
     """Check current and latest yt-dlp version"""
@@ -799,5 +4330,20 @@ def update_ytdlp():
             'error': str(e)
         }), 500
 
+def load_file_catalog():
+    file_catalog.track(DEFAULT_DOWNLOAD_DIR, recent_only=False)
+    for directory in job_store.directories('completed'):
+        file_catalog.track(directory)
+    file_catalog.reconcile_loop()
+
+
+# Job worker processes import this module too; they only run their job
+if multiprocessing.parent_process() is None:
+    threading.Thread(target=run_scheduler, name='scheduler', daemon=True).start()
+    threading.Thread(target=event_broker.flush_loop, name='event-flush', daemon=True).start()
+    threading.Thread(target=metrics.flush_loop, name='metrics-flush', daemon=True).start()
+    threading.Thread(target=load_file_catalog, name='file-catalog', daemon=True).start()
+    threading.Thread(target=extractor_registry.warm, name='extractor-warmup', daemon=True).start()
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=False)
@@ -0,0 +1,173 @@
+"""Local stand-in for a video site, for running the benchmarks offline.
+
+yt-dlp's generic extractor handles everything served here:
+
+    /media/<name>.mp4   synthetic media file
+    /feed.xml           RSS feed (a playlist) whose items point to /media/
+    /hls/<name>.m3u8    HLS playlist of <segments> /media/ files, for fragmented downloads
+
+Query parameters, on both URLs (the feed passes them on to its items):
+
+    size=BYTES          size of each media file (default 1 MiB)
+    rate=BYTES          throttle each response to this many bytes per second
+    fail=P              answer 503 with probability P
+    drop=P              close the connection half way with probability P
+    throttle=P          answer 429 Too Many Requests with probability P
+    count=N             number of feed items (default 20)
+    segments=N          number of HLS segments (default 10); size is per segment
+
+Run on its own with `python benchmarks/media_server.py [port]`, or use
+start() from another script.
+"""
+import html
+import http.server
+import random
+import sys
+import threading
+import time
+import urllib.parse
+
+CHUNK = 64 * 1024
+# Enough of an MP4 header for the file to be recognized as one
+MEDIA_HEADER = b'\x00\x00\x00\x18ftypmp42\x00\x00\x00\x00mp42isom'
+PATTERN = bytes(range(256)) * (CHUNK // 256)
+
+
+class MediaHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def handle(self):
+        try:
+            super().handle()
+        except ConnectionResetError:
+            # The client dropped a kept-alive connection
+            pass
+
+    def do_HEAD(self):
+        self.respond(head=True)
+
+    def do_GET(self):
+        self.respond()
+
+    def respond(self, head=False):
+        url = urllib.parse.urlsplit(self.path)
+        params = {key: values[-1] for key, values in urllib.parse.parse_qs(url.query).items()}
+        if url.path.startswith('/hls/'):
+            # Failures are for the segments, which get the parameters passed on
+            return self.send_hls(url.path, params, head)
+        if random.random() < float(params.get('fail', 0)):
+            return self.send_plain(503, b'injected failure\n')
+        if random.random() < float(params.get('throttle', 0)):
+            return self.send_plain(429, b'slow down\n')
+        if url.path == '/feed.xml':
+            return self.send_feed(params, head)
+        if url.path.startswith('/media/'):
+            return self.send_media(params, head)
+        self.send_plain(404, b'not found\n')
+
+    def send_plain(self, code, body):
+        self.send_response(code)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_feed(self, params, head):
+        count = int(params.pop('count', 20))
+        query = html.escape(urllib.parse.urlencode(params))
+        host = self.headers.get('Host')
+        items = ''.join(
+            f'<item><title>Video {i}</title><guid>video-{i}</guid>'
+            f'<enclosure url="http://{host}/media/video-{i}.mp4?{query}" type="video/mp4"/></item>'
+            for i in range(count, 0, -1)
+        )
+        body = (f'<?xml version="1.0"?><rss version="2.0"><channel><title>Benchmark feed</title>'
+                f'<link>http://{host}/</link>{items}</channel></rss>').encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/rss+xml')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def send_hls(self, path, params, head):
+        segments = int(params.pop('segments', 10))
+        query = urllib.parse.urlencode(params)
+        name = path[len('/hls/'):].rsplit('.', 1)[0]
+        body = '#EXTM3U\n#EXT-X-VERSION:3\n#EXT-X-TARGETDURATION:4\n#EXT-X-MEDIA-SEQUENCE:0\n'
+        body += ''.join(f'#EXTINF:4.0,\n/media/{name}-{i}.ts?{query}\n' for i in range(segments))
+        body += '#EXT-X-ENDLIST\n'
+        body = body.encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/vnd.apple.mpegurl')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def send_media(self, params, head):
+        size = int(params.get('size', 1024 * 1024))
+        start, end = 0, size - 1
+        match = self.headers.get('Range', '').partition('bytes=')[2].split('-')
+        if match[0].isdigit():
+            start = int(match[0])
+            if len(match) > 1 and match[1].isdigit():
+                end = min(int(match[1]), size - 1)
+        if start >= size:
+            self.send_response(416)
+            self.send_header('Content-Range', f'bytes */{size}')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        self.send_response(206 if self.headers.get('Range') else 200)
+        self.send_header('Content-Type', 'video/mp4')
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(end - start + 1))
+        if self.headers.get('Range'):
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        self.end_headers()
+        if head:
+            return
+
+        rate = float(params.get('rate', 0))
+        drop_at = (start + end) // 2 if random.random() < float(params.get('drop', 0)) else None
+        started = time.monotonic()
+        sent = 0
+        position = start
+        while position <= end:
+            length = min(CHUNK, end - position + 1)
+            if drop_at is not None and position + length > drop_at:
+                self.close_connection = True
+                return
+            data = (MEDIA_HEADER + PATTERN)[:length] if position == 0 else PATTERN[:length]
+            try:
+                self.wfile.write(data)
+            except (BrokenPipeError, ConnectionResetError):
+                # The client gave up (cancelled download, app shut down)
+                self.close_connection = True
+                return
+            position += length
+            sent += length
+            if rate:
+                # Sleep until the average rate is back under the limit
+                ahead = sent / rate - (time.monotonic() - started)
+                if ahead > 0:
+                    time.sleep(ahead)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start(port=0):
+    """Serve in a background thread; returns the server (server.server_port has the port)"""
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', port), MediaHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='media-server', daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8765
+    print(f'Serving synthetic media on http://127.0.0.1:{port}/')
+    http.server.ThreadingHTTPServer(('127.0.0.1', port), MediaHandler).serve_forever()
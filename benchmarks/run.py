@@ -0,0 +1,359 @@
+"""Benchmark the download pipeline and the API hot paths, without network.
+
+For every concurrency level, the app is started under gunicorn with a fresh
+DATA_DIR and MAX_CONCURRENT_DOWNLOADS set to the level. It then queues
+downloads from the local media stand-in (benchmarks/media_server.py) while
+client threads keep calling /status/<id>, /downloads, /logs and
+/extract-playlist. Measured per level:
+
+- jobs/minute from the first queued job until the last one finished
+- memory (RSS of the app and its job processes) per active job
+- latency percentiles per endpoint, including /download itself
+
+Results are printed and written as JSON, so runs before and after an
+upgrade can be compared (--baseline does that for the headline numbers).
+
+    python benchmarks/run.py --levels 1,10,100 --output results.json
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import media_server  # noqa: E402
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FINISHED_STATES = ('completed', 'error', 'cancelled')
+# How often each client thread picks an endpoint (status is what the UI polls)
+ENDPOINT_WEIGHTS = {'/status/<id>': 6, '/downloads': 2, '/logs': 1, '/extract-playlist': 1}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of a sorted list"""
+    if not values:
+        return None
+    return values[max(math.ceil(p / 100 * len(values)) - 1, 0)]
+
+
+def process_tree_rss(pid):
+    """Resident memory in bytes of `pid` and all its descendants (Linux only)"""
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                # The command name can contain spaces; the fields after it can't
+                ppid = int(f.read().rpartition(')')[2].split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        pending.extend(children.get(current, ()))
+        try:
+            with open(f'/proc/{current}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+        except OSError:
+            pass
+    return total
+
+
+class LatencyRecorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}
+        self.errors = {}
+
+    def call(self, endpoint, method, url, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = requests.request(method, url, timeout=60, **kwargs)
+            ok = response.status_code < 500
+        except requests.RequestException:
+            response, ok = None, False
+        elapsed = time.perf_counter() - started
+        with self.lock:
+            self.samples.setdefault(endpoint, []).append(elapsed)
+            if not ok:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+        return response
+
+    def summary(self):
+        result = {}
+        for endpoint, samples in sorted(self.samples.items()):
+            samples = sorted(samples)
+            result[endpoint] = {
+                'requests': len(samples),
+                'errors': self.errors.get(endpoint, 0),
+                'mean_ms': round(sum(samples) / len(samples) * 1000, 2),
+                'p50_ms': round(percentile(samples, 50) * 1000, 2),
+                'p95_ms': round(percentile(samples, 95) * 1000, 2),
+                'p99_ms': round(percentile(samples, 99) * 1000, 2),
+                'max_ms': round(samples[-1] * 1000, 2),
+            }
+        return result
+
+
+class AppServer:
+    """The app under gunicorn, with its own data and download directories"""
+
+    def __init__(self, args, level, workdir):
+        self.port = free_port()
+        self.base = f'http://127.0.0.1:{self.port}'
+        self.download_dir = os.path.join(workdir, 'downloads')
+        os.makedirs(self.download_dir)
+        env = dict(
+            os.environ,
+            BIND=f'127.0.0.1:{self.port}',
+            WEB_WORKERS=str(args.web_workers),
+            DATA_DIR=os.path.join(workdir, 'data'),
+            MAX_CONCURRENT_DOWNLOADS=str(level),
+            EXECUTION_MODE=args.execution_mode,
+        )
+        if not args.domain_limits:
+            # Every job targets 127.0.0.1: per-site limits would cap the level and pace extractions
+            env.update(DOMAIN_CONCURRENCY='0', DOMAIN_REQUEST_INTERVAL='0')
+        os.makedirs(env['DATA_DIR'])
+        self.log = open(os.path.join(workdir, 'server.log'), 'w')
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:app'],
+            cwd=REPO_DIR, env=env, stdout=self.log, stderr=subprocess.STDOUT,
+            start_new_session=True
+        )
+
+    def wait_ready(self, timeout=60):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f'App exited with code {self.process.returncode}, see {self.log.name}')
+            try:
+                if requests.get(f'{self.base}/queue', timeout=5).ok:
+                    return
+            except requests.RequestException:
+                pass
+            time.sleep(0.2)
+        raise RuntimeError(f'App did not start within {timeout}s, see {self.log.name}')
+
+    def rss(self):
+        return process_tree_rss(self.process.pid)
+
+    def stop(self):
+        try:
+            os.killpg(self.process.pid, 15)
+            self.process.wait(timeout=30)
+        except (OSError, subprocess.TimeoutExpired):
+            os.killpg(self.process.pid, 9)
+            self.process.wait()
+        self.log.close()
+
+
+def media_query(args):
+    query = f'size={args.size}&rate={args.rate}'
+    if args.fail:
+        query += f'&fail={args.fail}'
+    if args.drop:
+        query += f'&drop={args.drop}'
+    if args.throttle:
+        query += f'&throttle={args.throttle}'
+    return query
+
+
+def run_level(args, level, media_base):
+    jobs = args.jobs or max(level * 3, 5)
+    with tempfile.TemporaryDirectory(prefix=f'ytdlp-dash-bench-{level}-') as workdir:
+        server = AppServer(args, level, workdir)
+        try:
+            server.wait_ready()
+            latency = LatencyRecorder()
+            feed_url = f'{media_base}/feed.xml?count={args.feed_items}&{media_query(args)}'
+
+            # One request per endpoint first, so imports and caches don't count
+            requests.get(f'{server.base}/downloads', timeout=60)
+            requests.post(f'{server.base}/extract-playlist', json={'url': feed_url}, timeout=60)
+            rss_idle = server.rss()
+
+            ids = []
+            started = time.monotonic()
+            for i in range(jobs):
+                response = latency.call('/download', 'POST', f'{server.base}/download', json={
+                    'url': (f'{media_base}/hls/level{level}-job{i}.m3u8?segments={args.segments}&{media_query(args)}'
+                            if args.segments else f'{media_base}/media/level{level}-job{i}.mp4?{media_query(args)}'),
+                    'downloadPath': server.download_dir,
+                    'metadataMode': 'none',
+                    'embedThumbnail': False,
+                    'force': True,
+                })
+                if response is not None and response.ok:
+                    ids.append(response.json()['download_id'])
+
+            done = threading.Event()
+            endpoints = [name for name, weight in ENDPOINT_WEIGHTS.items() for _ in range(weight)]
+
+            def client():
+                while not done.is_set():
+                    endpoint = random.choice(endpoints)
+                    if endpoint == '/status/<id>':
+                        latency.call(endpoint, 'GET', f'{server.base}/status/{random.choice(ids)}')
+                    elif endpoint == '/downloads':
+                        latency.call(endpoint, 'GET', f'{server.base}/downloads')
+                    elif endpoint == '/logs':
+                        latency.call(endpoint, 'GET', f'{server.base}/logs', params={'lines': 200})
+                    else:
+                        latency.call(endpoint, 'POST', f'{server.base}/extract-playlist',
+                                     json={'url': feed_url, 'refresh': 'full'})
+                    time.sleep(args.think_time)
+
+            clients = [threading.Thread(target=client, daemon=True) for _ in range(args.clients if ids else 0)]
+            for thread in clients:
+                thread.start()
+
+            # Sample memory and active jobs until every job has finished
+            rss_peak, active_peak, per_job = rss_idle, 0, []
+            statuses = {}
+            deadline = time.monotonic() + args.timeout
+            while time.monotonic() < deadline:
+                counts = requests.get(f'{server.base}/queue', timeout=60).json()['counts']
+                active = sum(n for status, n in counts.items() if status not in FINISHED_STATES + ('queued',))
+                rss = server.rss()
+                rss_peak = max(rss_peak, rss)
+                active_peak = max(active_peak, active)
+                if active:
+                    per_job.append((rss - rss_idle) / active)
+                for download_id in ids:
+                    if statuses.get(download_id) not in FINISHED_STATES:
+                        statuses[download_id] = requests.get(
+                            f'{server.base}/status/{download_id}', timeout=60).json().get('status')
+                if all(statuses.get(download_id) in FINISHED_STATES for download_id in ids):
+                    break
+                time.sleep(args.sample_interval)
+            elapsed = time.monotonic() - started
+            done.set()
+            for thread in clients:
+                thread.join()
+
+            completed = sum(1 for status in statuses.values() if status == 'completed')
+            return {
+                'concurrency': level,
+                'jobs': jobs,
+                'queued': len(ids),
+                'completed': completed,
+                'failed': sum(1 for status in statuses.values() if status == 'error'),
+                'unfinished': sum(1 for status in statuses.values() if status not in FINISHED_STATES),
+                'seconds': round(elapsed, 2),
+                'jobs_per_minute': round(completed / elapsed * 60, 2),
+                'rss_idle_bytes': rss_idle,
+                'rss_peak_bytes': rss_peak,
+                'peak_active_jobs': active_peak,
+                'memory_per_active_job_bytes': round(max(per_job)) if per_job else None,
+                'endpoints': latency.summary(),
+            }
+        finally:
+            server.stop()
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_level(result, baseline=None):
+    def change(value, key):
+        old = (baseline or {}).get(key)
+        if not old or value is None:
+            return ''
+        return f' ({(value - old) / old * 100:+.1f}%)'
+
+    memory = result['memory_per_active_job_bytes']
+    print(f"\n== {result['concurrency']} concurrent: {result['completed']}/{result['jobs']} completed, "
+          f"{result['failed']} failed, {result['seconds']}s")
+    print(f"   jobs/minute: {result['jobs_per_minute']}{change(result['jobs_per_minute'], 'jobs_per_minute')}")
+    print(f"   memory per active job: {(memory or 0) / 2 ** 20:.1f} MiB{change(memory, 'memory_per_active_job_bytes')}")
+    old_endpoints = (baseline or {}).get('endpoints', {})
+    for endpoint, stats in result['endpoints'].items():
+        old = old_endpoints.get(endpoint, {}).get('p99_ms')
+        delta = f' ({(stats["p99_ms"] - old) / old * 100:+.1f}%)' if old else ''
+        print(f"   {endpoint:<20} p50 {stats['p50_ms']:>8.1f} ms  p99 {stats['p99_ms']:>8.1f} ms{delta}"
+              f"  ({stats['requests']} requests, {stats['errors']} errors)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--levels', default='1,10,100', help='comma separated concurrency levels')
+    parser.add_argument('--jobs', type=int, default=0, help='downloads per level (default: 3 x level, at least 5)')
+    parser.add_argument('--size', type=int, default=2 * 1024 * 1024, help='bytes per media file')
+    parser.add_argument('--rate', type=int, default=1024 * 1024, help='bytes/s per download, 0 = unthrottled')
+    parser.add_argument('--fail', type=float, default=0, help='probability of a 503 per media request')
+    parser.add_argument('--throttle', type=float, default=0, help='probability of a 429 per request')
+    parser.add_argument('--domain-limits', action='store_true',
+                        help="keep the app's DOMAIN_CONCURRENCY and DOMAIN_REQUEST_INTERVAL (off by default)")
+    parser.add_argument('--drop', type=float, default=0, help='probability of a dropped connection per media request')
+    parser.add_argument('--segments', type=int, default=0,
+                        help='download HLS playlists of this many --size segments instead of single files')
+    parser.add_argument('--feed-items', type=int, default=50, help='entries in the playlist feed')
+    parser.add_argument('--clients', type=int, default=4, help='threads calling the API endpoints')
+    parser.add_argument('--think-time', type=float, default=0.05, help='seconds between calls of one client')
+    parser.add_argument('--web-workers', type=int, default=2, help='gunicorn worker processes')
+    parser.add_argument('--execution-mode', choices=('thread', 'process'), default='thread')
+    parser.add_argument('--sample-interval', type=float, default=0.5, help='seconds between memory samples')
+    parser.add_argument('--timeout', type=float, default=1800, help='give up on a level after this many seconds')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare with')
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = {level['concurrency']: level for level in json.load(f)['levels']}
+
+    media = media_server.start()
+    media_base = f'http://127.0.0.1:{media.server_port}'
+
+    import yt_dlp.version
+    results = {
+        'started': datetime.now().isoformat(),
+        'revision': git_revision(),
+        'yt_dlp': yt_dlp.version.__version__,
+        'python': platform.python_version(),
+        'settings': vars(args),
+        'levels': [],
+    }
+    for level in (int(value) for value in args.levels.split(',')):
+        print(f'Running {level} concurrent jobs...', flush=True)
+        result = run_level(args, level, media_base)
+        results['levels'].append(result)
+        print_level(result, baseline.get(level))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'\nResults written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
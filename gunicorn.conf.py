@@ -0,0 +1,29 @@
+# Production server settings, used by the Docker image:
+#   gunicorn -c gunicorn.conf.py app:app
+#
+# Every worker process serves HTTP. One of them also runs the download queue
+# (see run_scheduler in app.py); job state, progress, cancellation and events
+# are shared through the job database in DATA_DIR.
+import multiprocessing
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:5000')
+
+# HTTP worker processes; defaults to one per CPU core
+workers = int(os.environ.get('WEB_WORKERS', multiprocessing.cpu_count()))
+
+# Threaded workers, so long-lived /events streams don't block a whole process
+worker_class = 'gthread'
+threads = int(os.environ.get('WEB_THREADS', 16))
+
+# Each process must import the app itself: the scheduler and its threads
+# cannot survive a fork from a preloaded master
+preload_app = False
+
+# Downloads can take hours; don't recycle worker processes
+max_requests = 0
+timeout = 120
+graceful_timeout = 30
+
+accesslog = None
+errorlog = '-'
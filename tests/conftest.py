@@ -0,0 +1,7 @@
+import os
+import sys
+import tempfile
+
+# app.py creates its job database under DATA_DIR on import
+os.environ.setdefault('DATA_DIR', tempfile.mkdtemp(prefix='ytdlp-dash-tests-'))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
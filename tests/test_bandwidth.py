@@ -0,0 +1,44 @@
+import pytest
+
+import app
+
+
+def test_equal_weights_split_evenly():
+    assert app.fair_shares(300, {'a': (1, float('inf')), 'b': (1, float('inf')), 'c': (1, float('inf'))}) == {
+        'a': 100, 'b': 100, 'c': 100}
+
+
+def test_weights():
+    assert app.fair_shares(400, {'a': (1, float('inf')), 'b': (3, float('inf'))}) == {'a': 100, 'b': 300}
+
+
+def test_capped_job_leaves_the_rest_to_the_others():
+    shares = app.fair_shares(300, {'slow': (1, 20), 'a': (1, float('inf')), 'b': (1, float('inf'))})
+    assert shares == {'slow': 20, 'a': 140, 'b': 140}
+
+
+def test_caps_freed_in_rounds():
+    # b's cap is only below its share once a's leftover is redistributed
+    shares = app.fair_shares(300, {'a': (1, 10), 'b': (1, 80), 'c': (2, float('inf'))})
+    assert shares['a'] == 10
+    assert shares['b'] == 80
+    assert shares['c'] == pytest.approx(210)
+
+
+def test_cap_above_the_share_is_not_reached():
+    assert app.fair_shares(100, {'a': (1, 80), 'b': (1, 80)}) == {'a': 50, 'b': 50}
+
+
+def test_all_capped_below_capacity():
+    assert app.fair_shares(1000, {'a': (1, 100), 'b': (2, 50)}) == {'a': 100, 'b': 50}
+
+
+def test_shares_never_exceed_capacity():
+    demands = {f'job{i}': (1 + i % 3, 10 * i) for i in range(1, 20)}
+    shares = app.fair_shares(500, demands)
+    assert sum(shares.values()) == pytest.approx(500)
+    assert all(shares[key] <= cap + 1e-9 for key, (_, cap) in demands.items())
+
+
+def test_no_jobs():
+    assert app.fair_shares(100, {}) == {}
@@ -0,0 +1,51 @@
+import pytest
+
+import app
+
+
+@pytest.mark.parametrize('url, expected', [
+    ('https://www.youtube.com/watch?v=abc', 'https://youtube.com/watch?v=abc'),
+    ('  https://m.youtube.com/watch?v=abc  ', 'https://youtube.com/watch?v=abc'),
+    ('HTTPS://Example.COM/Path/', 'https://example.com/Path'),
+    ('https://youtu.be/abc?si=xyz&feature=share', 'https://youtu.be/abc'),
+    ('https://example.com/v?utm_source=a&utm_medium=b&id=1', 'https://example.com/v?id=1'),
+    ('https://example.com/v?b=2&a=1', 'https://example.com/v?a=1&b=2'),
+    ('https://example.com/v?a=&b=1', 'https://example.com/v?a=&b=1'),
+    ('https://example.com/v#t=30', 'https://example.com/v'),
+    ('//example.com/v', 'https://example.com/v'),
+])
+def test_normalize_url(url, expected):
+    assert app.normalize_url(url) == expected
+
+
+def test_equivalent_urls_share_a_key():
+    assert (app.InfoCache.key('https://www.youtube.com/watch?v=abc&si=1', {})
+            == app.InfoCache.key('https://youtube.com/watch?v=abc', None))
+
+
+def test_neutral_options_are_not_in_the_key():
+    url = 'https://example.com/v'
+    options = {'format': 'best', 'outtmpl': '%(title)s.%(ext)s', 'postprocessors': [{'key': 'FFmpegMetadata'}],
+               'ratelimit': 1000, 'quiet': True, 'concurrent_fragment_downloads': 8}
+    assert app.InfoCache.key(url, options) == app.InfoCache.key(url, {})
+
+
+def test_private_options_are_not_in_the_key():
+    url = 'https://example.com/v'
+    assert app.InfoCache.key(url, {'_download_id': 'x'}) == app.InfoCache.key(url, {})
+
+
+@pytest.mark.parametrize('options', [
+    {'cookiefile': '/cookies.txt'},
+    {'proxy': 'socks5://127.0.0.1:1080'},
+    {'extractor_args': {'youtube': {'player_client': ['web']}}},
+])
+def test_extraction_options_are_in_the_key(options):
+    url = 'https://example.com/v'
+    assert app.InfoCache.key(url, options) != app.InfoCache.key(url, {})
+
+
+def test_option_order_does_not_matter():
+    url = 'https://example.com/v'
+    assert (app.InfoCache.key(url, {'proxy': 'p', 'cookiefile': 'c'})
+            == app.InfoCache.key(url, {'cookiefile': 'c', 'proxy': 'p'}))
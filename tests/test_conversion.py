@@ -0,0 +1,155 @@
+import pytest
+import yt_dlp
+
+import app
+
+
+def fmt(format_id, ext, vcodec, acodec, height=None):
+    return {'format_id': format_id, 'ext': ext, 'vcodec': vcodec, 'acodec': acodec,
+            'height': height, 'url': f'https://example.com/{format_id}', 'protocol': 'https'}
+
+
+# yt-dlp lists formats worst to best
+AUDIO_M4A = fmt('140', 'm4a', 'none', 'mp4a.40.2')
+AUDIO_OPUS = fmt('251', 'webm', 'none', 'opus')
+VIDEO_VP8_1080 = fmt('vp8', 'webm', 'vp8', 'none', 1080)
+VIDEO_AVC_720 = fmt('136', 'mp4', 'avc1.4d401f', 'none', 720)
+VIDEO_AVC_1080 = fmt('137', 'mp4', 'avc1.640028', 'none', 1080)
+VIDEO_VP9_1080 = fmt('248', 'webm', 'vp9', 'none', 1080)
+MUXED_MP4 = fmt('18', 'mp4', 'avc1.42001E', 'mp4a.40.2', 360)
+MUXED_WEBM = fmt('43', 'webm', 'vp8', 'vorbis', 360)
+UNKNOWN_MP4 = fmt('hls', 'mp4', None, None, 720)
+
+CONVERT = {'key': 'FFmpegVideoConvertor', 'preferedformat': 'mp4'}
+
+
+def probed(formats, *chosen):
+    """A probed info dict with `chosen` as the formats yt-dlp selected"""
+    info = {'id': 'x', 'title': 'x', 'formats': list(formats)}
+    if len(chosen) > 1:
+        info['requested_formats'] = list(chosen)
+    else:
+        info.update(chosen[0])
+    return info
+
+
+def convert_to(target):
+    return {'postprocessors': [{'key': 'FFmpegVideoConvertor', 'preferedformat': target}]}
+
+
+def extract_to(codec, convert=None):
+    postprocessors = [{'key': 'FFmpegExtractAudio', 'preferredcodec': codec}]
+    if convert:
+        postprocessors.append({'key': 'FFmpegVideoConvertor', 'preferedformat': convert})
+    return {'postprocessors': postprocessors}
+
+
+@pytest.fixture(scope='module')
+def ydl():
+    with yt_dlp.YoutubeDL({'quiet': True}) as ydl:
+        yield ydl
+
+
+PLANS = [
+    # (case, formats, chosen, options, pinned, path)
+    ('single file already in the target', [MUXED_MP4], [MUXED_MP4], convert_to('mp4'), False, 'none'),
+    ('fitting streams are merged into the target', [AUDIO_M4A, VIDEO_AVC_1080], [VIDEO_AVC_1080, AUDIO_M4A],
+     convert_to('mp4'), False, 'merge'),
+    ('vp9 fits mp4 as it is', [AUDIO_M4A, VIDEO_VP9_1080], [VIDEO_VP9_1080, AUDIO_M4A],
+     convert_to('mp4'), False, 'merge'),
+    ('fitting single file in another container', [MUXED_WEBM], [MUXED_WEBM], convert_to('mkv'), False, 'remux'),
+    ('same quality in fitting codecs is picked', [AUDIO_M4A, AUDIO_OPUS, VIDEO_AVC_1080, VIDEO_VP8_1080],
+     [VIDEO_VP8_1080, AUDIO_OPUS], convert_to('mp4'), False, 'merge'),
+    ('fitting codecs only at a lower height', [AUDIO_M4A, AUDIO_OPUS, VIDEO_AVC_720, VIDEO_VP8_1080],
+     [VIDEO_VP8_1080, AUDIO_OPUS], convert_to('mp4'), False, 'transcode'),
+    ('pinned formats are kept', [AUDIO_M4A, AUDIO_OPUS, VIDEO_AVC_1080, VIDEO_VP8_1080],
+     [VIDEO_VP8_1080, AUDIO_OPUS], convert_to('mp4'), True, 'transcode'),
+    ('container that always re-encodes', [MUXED_MP4], [MUXED_MP4], convert_to('avi'), False, 'transcode'),
+    ('unknown codecs in the target container', [UNKNOWN_MP4], [UNKNOWN_MP4], convert_to('mp4'), False, 'none'),
+    ('unknown codecs in another container', [UNKNOWN_MP4], [UNKNOWN_MP4], convert_to('webm'), False, 'transcode'),
+    ('unknown codecs into mkv', [UNKNOWN_MP4], [UNKNOWN_MP4], convert_to('mkv'), False, 'remux'),
+    ('audio already in the target codec', [AUDIO_M4A, VIDEO_AVC_1080], [VIDEO_AVC_1080, AUDIO_M4A],
+     extract_to('m4a'), False, 'copy'),
+    ('best audio is never re-encoded', [AUDIO_OPUS], [AUDIO_OPUS], extract_to('best'), False, 'copy'),
+    ('fitting audio stream is picked', [AUDIO_M4A, AUDIO_OPUS], [AUDIO_OPUS], extract_to('aac'), False, 'copy'),
+    ('no fitting audio stream', [AUDIO_M4A, AUDIO_OPUS], [AUDIO_OPUS], extract_to('mp3'), False, 'transcode'),
+    ('pinned audio is kept', [AUDIO_M4A, AUDIO_OPUS], [AUDIO_OPUS], extract_to('aac'), True, 'transcode'),
+    ('unknown audio codec', [UNKNOWN_MP4], [UNKNOWN_MP4], extract_to('mp3'), False, 'transcode'),
+]
+
+
+@pytest.mark.parametrize('case, formats, chosen, options, pinned, path', PLANS, ids=[plan[0] for plan in PLANS])
+def test_plan_conversion_path(ydl, case, formats, chosen, options, pinned, path):
+    _, conversion = app.plan_conversion(ydl, probed(formats, *chosen), options, pinned)
+    assert conversion['path'] == path
+
+
+def test_merge_writes_the_target_container(ydl):
+    info = probed([AUDIO_M4A, VIDEO_AVC_1080], VIDEO_AVC_1080, AUDIO_M4A)
+    options, _ = app.plan_conversion(ydl, info, convert_to('mp4'))
+    assert options['merge_output_format'] == 'mp4'
+    assert options['postprocessors'] == []
+
+
+def test_remux_replaces_the_convertor(ydl):
+    options, _ = app.plan_conversion(ydl, probed([MUXED_WEBM], MUXED_WEBM), convert_to('mkv'))
+    assert options['postprocessors'] == [{'key': 'FFmpegVideoRemuxer', 'preferedformat': 'mkv'}]
+
+
+def test_transcode_keeps_the_convertor(ydl):
+    options, _ = app.plan_conversion(ydl, probed([MUXED_MP4], MUXED_MP4), convert_to('avi'))
+    assert options['postprocessors'] == convert_to('avi')['postprocessors']
+    assert 'format' not in options
+
+
+def test_picked_formats_fall_back_to_the_original_spec(ydl):
+    info = probed([AUDIO_M4A, AUDIO_OPUS, VIDEO_AVC_1080, VIDEO_VP8_1080], VIDEO_VP8_1080, AUDIO_OPUS)
+    options, conversion = app.plan_conversion(ydl, info, dict(convert_to('mp4'), format='bestvideo+bestaudio'))
+    video_codecs, audio_codecs = app.CONTAINER_CODECS['mp4']
+    restricted = app.restrict_format_spec('bestvideo+bestaudio', video_codecs, audio_codecs)
+    assert options['format'] == f'{restricted}/bestvideo+bestaudio'
+    assert conversion['detail'] == 'picked avc1+mp4a instead of vp8+opus'
+    assert app.select_format(ydl, info, options['format']) == [VIDEO_AVC_1080, AUDIO_M4A]
+
+
+def test_audio_extraction_drops_the_video_convertor(ydl):
+    options, _ = app.plan_conversion(ydl, probed([AUDIO_OPUS], AUDIO_OPUS), extract_to('best', convert='mp4'))
+    assert [pp['key'] for pp in options['postprocessors']] == ['FFmpegExtractAudio']
+
+
+def test_fitting_audio_spec(ydl):
+    options, _ = app.plan_conversion(ydl, probed([AUDIO_M4A, AUDIO_OPUS], AUDIO_OPUS), extract_to('aac'))
+    assert options['format'] == "bestaudio[acodec~='^(mp4a|aac)']/bestvideo*+bestaudio/best"
+
+
+def test_no_conversion_requested(ydl):
+    options = {'format': 'best', 'postprocessors': [{'key': 'FFmpegMetadata'}]}
+    assert app.plan_conversion(ydl, probed([MUXED_MP4], MUXED_MP4), options) == (options, None)
+
+
+def test_plan_conversion_leaves_the_options_alone(ydl):
+    options = convert_to('mkv')
+    app.plan_conversion(ydl, probed([MUXED_WEBM], MUXED_WEBM), options)
+    assert options == convert_to('mkv')
+
+
+@pytest.mark.parametrize('spec, expected', [
+    ('bestvideo+bestaudio', "bestvideo[vcodec~='^(avc1|vp9)']+bestaudio[acodec~='^(mp4a)']"),
+    ('best', "best[vcodec~='^(avc1|vp9)'][acodec~='^(mp4a)']"),
+    ('bestvideo*+bestaudio/best',
+     "bestvideo*[vcodec~='^(avc1|vp9)']+bestaudio[acodec~='^(mp4a)']/best[vcodec~='^(avc1|vp9)'][acodec~='^(mp4a)']"),
+    ('worstvideo[height>=720]', "worstvideo[vcodec~='^(avc1|vp9)'][height>=720]"),
+    ('137+140', '137+140'),
+])
+def test_restrict_format_spec(spec, expected):
+    assert app.restrict_format_spec(spec, ('avc1', 'vp9'), ('mp4a',)) == expected
+
+
+def test_restricted_default_spec_selects(ydl):
+    info = probed([AUDIO_M4A, AUDIO_OPUS, VIDEO_AVC_1080, VIDEO_VP8_1080], VIDEO_VP8_1080, AUDIO_OPUS)
+    spec = app.restrict_format_spec('bestvideo*+bestaudio/best', *app.CONTAINER_CODECS['mp4'])
+    assert app.select_format(ydl, info, spec) == [VIDEO_AVC_1080, AUDIO_M4A]
+
+
+def test_restrict_format_spec_without_codec_limits():
+    assert app.restrict_format_spec('bestvideo+bestaudio', None, ('opus',)) == "bestvideo+bestaudio[acodec~='^(opus)']"
@@ -0,0 +1,111 @@
+import time
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def store(tmp_path):
+    path = str(tmp_path / 'jobs.db')
+    # claim_next() reads the governor's table from the same database
+    app.DomainGovernor(path)
+    return app.JobStore(path)
+
+
+def queue(store, download_id, url='https://example.com/video', priority=0):
+    store.create(download_id, {'status': 'queued', 'url': url}, {}, priority)
+
+
+def set_status(store, download_id, status):
+    store.save(download_id, {'status': status})
+
+
+def claim_all(store):
+    claimed = []
+    while (download_id := store.claim_next()) is not None:
+        claimed.append(download_id)
+    return claimed
+
+
+def test_claims_by_priority_then_queue_order(store):
+    queue(store, 'a')
+    queue(store, 'b', priority=5)
+    queue(store, 'c')
+    queue(store, 'd', priority=5)
+    assert claim_all(store) == ['b', 'd', 'a', 'c']
+
+
+def test_claim_marks_the_job_starting(store):
+    queue(store, 'a')
+    assert store.claim_next() == 'a'
+    row = store.connection().execute("SELECT status FROM jobs WHERE id = 'a'").fetchone()
+    assert row['status'] == 'starting'
+    assert store.claim_next() is None
+
+
+def test_only_queued_jobs_are_claimed(store):
+    queue(store, 'a')
+    queue(store, 'b')
+    set_status(store, 'a', 'cancelled')
+    assert claim_all(store) == ['b']
+
+
+def test_deferred_job_waits_for_not_before(store):
+    queue(store, 'later', priority=5)
+    queue(store, 'now')
+    store.defer('later', time.time() + 60)
+    assert claim_all(store) == ['now']
+
+
+def test_deferral_expires(store):
+    queue(store, 'a')
+    store.defer('a', time.time() - 1)
+    assert store.claim_next() == 'a'
+    row = store.connection().execute("SELECT not_before FROM jobs WHERE id = 'a'").fetchone()
+    assert row['not_before'] is None
+
+
+def test_blocked_host_is_skipped(store):
+    queue(store, 'blocked', url='https://www.throttled.example/v/1', priority=5)
+    queue(store, 'other', url='https://other.example/v/1')
+    with store.connection() as conn:
+        conn.execute("INSERT INTO domain_governor (host, blocked_until) VALUES ('throttled.example', ?)",
+                     (time.time() + 60,))
+    assert claim_all(store) == ['other']
+    with store.connection() as conn:
+        conn.execute("UPDATE domain_governor SET blocked_until = ?", (time.time() - 1,))
+    assert store.claim_next() == 'blocked'
+
+
+def test_domain_concurrency(store, monkeypatch):
+    monkeypatch.setattr(app, 'DOMAIN_CONCURRENCY', 1)
+    queue(store, 'a1', url='https://a.example/1')
+    queue(store, 'a2', url='https://a.example/2')
+    queue(store, 'b1', url='https://b.example/1')
+    assert claim_all(store) == ['a1', 'b1']
+    set_status(store, 'a1', 'downloading')
+    assert store.claim_next() is None
+    set_status(store, 'a1', 'processing')
+    assert store.claim_next() == 'a2'
+
+
+def test_domain_concurrency_off_by_default(store):
+    assert app.DOMAIN_CONCURRENCY == 0
+    queue(store, 'a1', url='https://a.example/1')
+    queue(store, 'a2', url='https://a.example/2')
+    assert claim_all(store) == ['a1', 'a2']
+
+
+def test_jobs_without_host_ignore_domain_limits(store, monkeypatch):
+    monkeypatch.setattr(app, 'DOMAIN_CONCURRENCY', 1)
+    queue(store, 'a', url=None)
+    queue(store, 'b', url=None)
+    assert claim_all(store) == ['a', 'b']
+
+
+def test_queued_job_cancelled_before_claim(store):
+    queue(store, 'a')
+    assert store.request_cancel('a') is True
+    assert store.claim_next() is None
+    assert store.cancel_requested_ids() == []
@@ -0,0 +1,75 @@
+import io
+
+import app
+
+ID = '20260101_120000_000001'
+OTHER = '20260101_120000_000002'
+
+
+def record(level, message, name='app'):
+    return f'2026-01-01 12:00:00,000 - {name} - {level} - {message}\n'
+
+
+LINES = [
+    'tail of a record that started earlier\n',
+    record('INFO', f'[{ID}] Starting download'),
+    record('DEBUG', f'[{ID}] [download]  42.0% of 10.00MiB at 2.00MiB/s ETA 00:03'),
+    record('INFO', '127.0.0.1 - - "GET /status HTTP/1.1" 200 -', name='werkzeug'),
+    record('INFO', f'[{OTHER}] Starting download'),
+    record('ERROR', f'[{ID}] Download failed'),
+    'Traceback (most recent call last):\n',
+    '  File "app.py", line 1, in <module>\n',
+    record('WARNING', 'Disk almost full'),
+]
+
+
+def test_drops_http_noise_and_orphan_lines():
+    assert app.filter_log_lines(LINES) == [LINES[1], LINES[2], LINES[4], *LINES[5:]]
+
+
+def test_filter_by_job_keeps_tracebacks():
+    assert app.filter_log_lines(LINES, download_id=ID) == [LINES[1], LINES[2], *LINES[5:8]]
+
+
+def test_filter_by_level():
+    assert app.filter_log_lines(LINES, min_level=app.LOG_LEVELS['WARNING']) == LINES[5:]
+
+
+def test_filters_combine():
+    assert app.filter_log_lines(LINES, download_id=OTHER, min_level=app.LOG_LEVELS['INFO']) == [LINES[4]]
+
+
+def log_file(lines):
+    data = ''.join(lines).encode()
+    return io.BytesIO(data), len(data)
+
+
+def test_tail_reads_back_in_growing_blocks():
+    lines = [record('INFO', f'[{ID}] line {i}') for i in range(1000)]
+    f, end = log_file(lines)
+    assert app.read_log_tail(f, end, 10, block_size=64) == lines[-10:]
+
+
+def test_tail_of_filtered_lines():
+    lines = [record('INFO', f'[{ID if i % 10 == 0 else OTHER}] line {i}') for i in range(1000)]
+    f, end = log_file(lines)
+    assert app.read_log_tail(f, end, 5, block_size=256, download_id=ID) == [lines[i] for i in range(950, 1000, 10)]
+
+
+def test_tail_returns_what_there_is():
+    f, end = log_file(LINES)
+    assert app.read_log_tail(f, end, 100, block_size=16, download_id=ID) == [LINES[1], LINES[2], *LINES[5:8]]
+
+
+def test_tail_between_cursor_and_end():
+    lines = [record('INFO', f'line {i}') for i in range(100)]
+    f, end = log_file(lines)
+    start = len(''.join(lines[:90]).encode())
+    stop = len(''.join(lines[:95]).encode())
+    assert app.read_log_tail(f, stop, 100, start=start, block_size=32) == lines[90:95]
+
+
+def test_tail_with_multibyte_characters():
+    lines = [record('INFO', f'[{ID}] Täst ✓ {i}') for i in range(50)]
+    f, end = log_file(lines)
+    assert app.read_log_tail(f, end, 3, block_size=50) == lines[-3:]